@@ -0,0 +1,3 @@
+"""
+Contains benchmarks. Run them as modules, e.g.: python -m benchmarks.bench_site_structure
+"""
@@ -0,0 +1,75 @@
+"""Benchmarks the memory footprint of large synthetic site structures."""
+import argparse
+import time
+import tracemalloc
+from typing import List, Tuple
+
+from scrapy_patterns.site_structure import SiteStructure
+from scrapy_patterns.columnar_site_structure import ColumnarSiteStructure
+
+_STRUCTURE_CLASSES = {"linked": SiteStructure, "columnar": ColumnarSiteStructure}
+
+
+def build_structure(widths: List[int], structure_cls: type = SiteStructure):
+    """
+    Builds a synthetic structure, where names repeat across levels like on real sites (e.g. "Sale" in every category).
+    Args:
+        widths: The number of children per node on each level.
+        structure_cls: The class of the structure.
+
+    Returns: The structure.
+    """
+    structure = structure_cls("benchmark")
+    paths = [""]
+    for width in widths:
+        next_paths = []
+        for path in paths:
+            for i in range(width):
+                child_path = "{}/category-{}".format(path, i) if path else "category-{}".format(i)
+                structure.add_node_with_path(child_path, "http://synthetic.com/" + child_path)
+                next_paths.append(child_path)
+        paths = next_paths
+    return structure
+
+
+def measure(widths: List[int], structure_cls: type = SiteStructure) -> Tuple[int, int, float]:
+    """
+    Measures the memory used by a synthetic structure, and by the same structure restored from its dict.
+    Args:
+        widths: The number of children per node on each level.
+        structure_cls: The class of the structure.
+
+    Returns: The memory used by the built, and the restored structure in bytes, and the time of restoring in seconds.
+    The restored structure may share strings with the dict, which are not counted.
+    """
+    tracemalloc.start()
+    structure = build_structure(widths, structure_cls)
+    built_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    structure_dict = structure.to_dict()
+    del structure
+    tracemalloc.start()
+    start = time.perf_counter()
+    restored_structure = structure_cls.from_dict(structure_dict)
+    elapsed = time.perf_counter() - start
+    restored_size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del restored_structure
+    return built_size, restored_size, elapsed
+
+
+def main():
+    """Entry point."""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--widths", type=int, nargs="+", default=[10, 100, 100],
+                            help="Children per node on each level (default gives ~100k nodes).")
+    arg_parser.add_argument("--structure", choices=sorted(_STRUCTURE_CLASSES), default="linked",
+                            help="The site structure implementation.")
+    args = arg_parser.parse_args()
+    built_size, restored_size, elapsed = measure(args.widths, _STRUCTURE_CLASSES[args.structure])
+    print("Built structure: {:.1f} MiB, restored from dict: {:.1f} MiB (in {:.3f} s)".format(
+        built_size / 2 ** 20, restored_size / 2 ** 20, elapsed))
+
+
+if __name__ == "__main__":
+    main()
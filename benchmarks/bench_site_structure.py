@@ -0,0 +1,75 @@
+"""Benchmarks site structure discovery on large synthetic trees."""
+import argparse
+import time
+from typing import List, Tuple
+from unittest.mock import Mock
+
+from scrapy_patterns.spiderlings.site_structure_discoverer import SiteStructureDiscoverer, CategoryParser
+
+
+class _SyntheticCategoryParser(CategoryParser):
+    def __init__(self, width: int):
+        self.__width = width
+
+    def parse(self, response) -> List[Tuple[str, str]]:
+        return [("{}/{}".format(response.url, i), "category-{}".format(i)) for i in range(self.__width)]
+
+
+class _SyntheticRequest:
+    def __init__(self, url, callback, cb_kwargs):
+        self.url = url
+        self.callback = callback
+        self.cb_kwargs = cb_kwargs
+
+
+class _CollectingRequestFactory:
+    def __init__(self):
+        self.pending = []
+
+    def create(self, url, callback, **kwargs):
+        request = _SyntheticRequest(url, callback, kwargs.get("cb_kwargs", {}))
+        self.pending.append(request)
+        return request
+
+
+def run_discovery(widths: List[int]) -> Tuple[int, float]:
+    """
+    Runs a discovery of a synthetic tree without any networking.
+    Args:
+        widths: The number of children per node on each level.
+
+    Returns: The number of discovered nodes, and the elapsed time in seconds.
+    """
+    spider = Mock()
+    spider.name = "benchmark"
+    request_factory = _CollectingRequestFactory()
+    discoverer = SiteStructureDiscoverer(spider, "http://synthetic.com", [_SyntheticCategoryParser(width)
+                                                                           for width in widths], request_factory)
+    start = time.perf_counter()
+    discoverer.create_start_request()
+    num_of_nodes = 0
+    while request_factory.pending:
+        request = request_factory.pending.pop()
+        for _ in request.callback(request, **request.cb_kwargs):
+            pass
+    elapsed = time.perf_counter() - start
+    nodes = [discoverer.structure.root_node]
+    while nodes:
+        node = nodes.pop()
+        num_of_nodes += len(node.children)
+        nodes.extend(node.children)
+    return num_of_nodes, elapsed
+
+
+def main():
+    """Entry point."""
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--widths", type=int, nargs="+", default=[10, 100, 100],
+                            help="Children per node on each level (default gives ~100k nodes).")
+    args = arg_parser.parse_args()
+    num_of_nodes, elapsed = run_discovery(args.widths)
+    print("Discovered {} nodes (widths: {}) in {:.3f} s".format(num_of_nodes, args.widths, elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""Contains a Bloom filter for de-duplicating URLs."""
+import hashlib
+import math
+import struct
+
+
+class BloomFilter:
+    """
+    A memory bounded set of strings, which can have false positives (a string may be reported as added, when it wasn't),
+    but no false negatives. Its size depends only on the capacity, and the false positive rate.
+    """
+    __HEADER = struct.Struct("<QIQ")
+
+    def __init__(self, capacity: int, false_positive_rate: float = 0.001):
+        """
+        Args:
+            capacity: The expected number of strings. Beyond that the false positive rate grows.
+            false_positive_rate: The expected false positive rate when the filter is at capacity (between 0 and 1).
+        """
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+        if not 0.0 < false_positive_rate < 1.0:
+            raise ValueError("False positive rate must be between 0 and 1")
+        num_of_bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+        self.__num_of_bits = num_of_bits
+        self.__num_of_hashes = max(1, round(num_of_bits / capacity * math.log(2)))
+        self.__num_of_items = 0
+        self.__bits = bytearray((num_of_bits + 7) // 8)
+
+    def add(self, key: str) -> bool:
+        """
+        Adds a string.
+        Args:
+            key: The string.
+
+        Returns: True if the string wasn't in the filter.
+        """
+        is_new = False
+        for position in self.__get_positions(key):
+            mask = 1 << (position & 7)
+            if not self.__bits[position >> 3] & mask:
+                self.__bits[position >> 3] |= mask
+                is_new = True
+        if is_new:
+            self.__num_of_items += 1
+        return is_new
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns: The filter serialized, which can be restored with from_bytes().
+        """
+        return self.__HEADER.pack(self.__num_of_bits, self.__num_of_hashes, self.__num_of_items) + self.__bits
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'BloomFilter':
+        """
+        Restores a filter serialized with to_bytes().
+        Args:
+            data: The serialized filter.
+
+        Returns: The filter.
+        """
+        header_size = cls.__HEADER.size
+        if len(data) < header_size:
+            raise ValueError("Serialized Bloom filter is too short")
+        num_of_bits, num_of_hashes, num_of_items = cls.__HEADER.unpack_from(data)
+        if len(data) - header_size != (num_of_bits + 7) // 8 or num_of_hashes < 1:
+            raise ValueError("Serialized Bloom filter is invalid")
+        bloom_filter = cls.__new__(cls)
+        bloom_filter.__num_of_bits = num_of_bits
+        bloom_filter.__num_of_hashes = num_of_hashes
+        bloom_filter.__num_of_items = num_of_items
+        bloom_filter.__bits = bytearray(data[header_size:])
+        return bloom_filter
+
+    @property
+    def num_of_bits(self) -> int:
+        """The size of the filter in bits."""
+        return self.__num_of_bits
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.__bits[position >> 3] & (1 << (position & 7)) for position in self.__get_positions(key))
+
+    def __len__(self):
+        # The number of added strings, not counting the ones that were false positives when added.
+        return self.__num_of_items
+
+    def __get_positions(self, key: str):
+        # Double hashing: the positions are derived from two halves of one digest.
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        first_hash = int.from_bytes(digest[:8], "little")
+        second_hash = int.from_bytes(digest[8:], "little") | 1
+        return ((first_hash + i * second_hash) % self.__num_of_bits for i in range(self.__num_of_hashes))
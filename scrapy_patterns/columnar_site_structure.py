@@ -0,0 +1,366 @@
+"""
+Contains an array backed site structure for very large structures. It has the same interface as
+`scrapy_patterns.site_structure.SiteStructure`, so it can be used in its place.
+"""
+# pylint: disable=protected-access
+import sys
+from array import array
+from typing import Optional, List, Union, Dict, Callable, Iterator
+
+from scrapy_patterns.site_structure import VisitState, tree_to_str, tree_to_json_chunks
+
+_NO_INDEX = -1
+_VISIT_STATES_BY_VALUE = {state.value: state for state in VisitState}
+
+
+class ColumnarNode:
+    """
+    A view of a node in a `ColumnarSiteStructure`. It has the same interface as `scrapy_patterns.site_structure.Node`
+    except for adding children, which is done through the structure. Views are created on demand; two views of the
+    same node are equal.
+    """
+    __slots__ = ("structure", "index")
+
+    def __init__(self, structure: 'ColumnarSiteStructure', index: int):
+        """
+        Args:
+            structure: The structure containing the node.
+            index: The index of the node in the structure's arrays.
+        """
+        self.structure = structure
+        self.index = index
+
+    @property
+    def name(self) -> str:
+        """The name of the node."""
+        return self.structure._names[self.index]
+
+    @property
+    def url(self) -> str:
+        """The url at which the node (category) is available."""
+        return self.structure._get_url(self.index)
+
+    @property
+    def parent(self) -> Optional['ColumnarNode']:
+        """The parent of the node."""
+        parent_index = self.structure._parents[self.index]
+        return ColumnarNode(self.structure, parent_index) if parent_index != _NO_INDEX else None
+
+    @property
+    def children(self) -> List['ColumnarNode']:
+        """Children of node."""
+        return [ColumnarNode(self.structure, child_index)
+                for child_index in self.structure._iter_child_indices(self.index)]
+
+    @property
+    def visit_state(self) -> VisitState:
+        """The visit state of the node."""
+        return _VISIT_STATES_BY_VALUE[self.structure._visit_states[self.index]]
+
+    @visit_state.setter
+    def visit_state(self, visit_state: VisitState):
+        self.structure._set_visit_state(self.index, visit_state)
+
+    def get_child(self, name: str) -> Optional['ColumnarNode']:
+        """
+        Gets a direct child by its name.
+        Args:
+            name: The name of the child.
+
+        Returns: The first child with the given name if found, else None.
+        """
+        child_index = self.structure._get_child_index(self.index, name)
+        return ColumnarNode(self.structure, child_index) if child_index != _NO_INDEX else None
+
+    def get_path(self) -> str:
+        """
+        Returns: The path of the node separated by slashes (/), excluding the name of the root node.
+        """
+        return self.structure._get_path(self.index)
+
+    def to_dict(self):
+        """
+        Returns: A dict representation of the tree rooted at this node.
+        """
+        return self.structure._to_dict(self.index)
+
+    def set_visit_state(self, visit_state: VisitState, propagate: bool = False):
+        """
+        Sets the visit state of this node optionally propagating it to ancestors.
+        Args:
+            visit_state: The new state.
+            propagate: Whether to propagate to ancestors.
+        """
+        index = self.index
+        while index != _NO_INDEX:
+            self.structure._set_visit_state(index, visit_state)
+            index = self.structure._parents[index] if propagate else _NO_INDEX
+
+    def __eq__(self, other):
+        return isinstance(other, ColumnarNode) and self.structure is other.structure and self.index == other.index
+
+    def __hash__(self):
+        return hash((id(self.structure), self.index))
+
+    def __repr__(self):
+        return "ColumnarNode({!r}, {})".format(self.name, self.index)
+
+
+# pylint: disable=too-many-instance-attributes
+class ColumnarSiteStructure:
+    """
+    A site structure, which stores its nodes in parallel arrays (parent, first child, next sibling, visit state)
+    instead of linked objects, so very large structures take less memory, and traversals are plain loops over
+    integers. URLs are stored UTF-8 encoded in a single buffer, and names are interned. Nodes are returned as
+    `ColumnarNode` views.
+    """
+
+    def __init__(self, name=""):
+        """
+        Creates the structure with a root node initialized to the given name prefixed with '(root) '.
+        Args:
+            name: The name of the root node. (The root node doesn't have an url)
+        """
+        self._names: List[str] = []
+        self._url_buffer = bytearray()
+        self._url_offsets = array("q", [0])
+        self._parents = array("i")
+        self._first_children = array("i")
+        self._last_children = array("i")
+        self._next_siblings = array("i")
+        self._visit_states = array("b")
+        # Only nodes with children have a name map, which is keyed by the name of the child.
+        self._child_indices: Dict[int, Dict[str, int]] = {}
+        self.__leaves: Optional[array] = None
+        self.__leaf_positions: Optional[array] = None
+        self.__leaf_cursors: List[int] = []
+        self.__visit_state_counts: List[int] = [0] * len(VisitState)
+        self.__visit_state_listeners: List[Callable[[ColumnarNode], None]] = []
+        self.__append_node("(root) {}".format(name), "", _NO_INDEX, VisitState.NEW.value)
+
+    @property
+    def root_node(self) -> ColumnarNode:
+        """The root node."""
+        return ColumnarNode(self, 0)
+
+    def add_visit_state_listener(self, listener: Callable[[ColumnarNode], None]):
+        """
+        Adds a listener that is called with the node whenever the visit state of a node in this structure changes.
+        Args:
+            listener: The listener.
+        """
+        self.__visit_state_listeners.append(listener)
+
+    def remove_visit_state_listener(self, listener: Callable[[ColumnarNode], None]):
+        """
+        Removes a listener added with add_visit_state_listener().
+        Args:
+            listener: The listener.
+        """
+        self.__visit_state_listeners.remove(listener)
+
+    def add_node_with_path(self, path: str, url: str) -> ColumnarNode:
+        """
+        Adds a new node with url under path, where the name of the new node will be the last part of the path.
+        Nodes along the path should pre-exists except for the last node.
+        Args:
+            path (str): The path.
+            url (str): The url.
+
+        Returns: The newly created node.
+        """
+        parent_path, _, new_node_name = path.strip("/").rpartition("/")
+        parent_index = self.__find_index(parent_path) if parent_path else 0
+        if parent_index != _NO_INDEX and self._get_child_index(parent_index, new_node_name) != _NO_INDEX:
+            raise RuntimeError("Path \"{}\" already exists!".format(path))
+        if parent_index == _NO_INDEX:
+            raise RuntimeError("Parent path \"{}\" not existing!".format(parent_path))
+        index = self.__append_node(new_node_name, url, parent_index, VisitState.NEW.value)
+        self.__leaves = None
+        return ColumnarNode(self, index)
+
+    def get_node_at_path(self, path: str) -> Optional[ColumnarNode]:
+        """
+        Gets a node at path.
+        Args:
+            path (str): The path
+
+        Returns: The node if found, else None.
+        """
+        index = self.__find_index(path.strip("/"))
+        return ColumnarNode(self, index) if index != _NO_INDEX else None
+
+    def to_dict(self):
+        """
+        Returns: The structure as a dict.
+        """
+        return self._to_dict(0)
+
+    @classmethod
+    def from_dict(cls, struct_dict):
+        """
+        Creates a structure from its dict representation.
+        Args:
+            struct_dict: The dict.
+
+        Returns: The site structure.
+        """
+        structure = ColumnarSiteStructure()
+        structure._names[0] = sys.intern(str(struct_dict["name"]))
+        # The root doesn't have an url.
+        structure._visit_states[0] = VisitState[struct_dict["visit_state"]].value
+        dicts_to_add = [(child_dict, 0) for child_dict in reversed(struct_dict["children"])]
+        while dicts_to_add:
+            node_dict, parent_index = dicts_to_add.pop()
+            index = structure.__append_node(node_dict["name"], node_dict["url"], parent_index,
+                                            VisitState[node_dict["visit_state"]].value)
+            dicts_to_add.extend((child_dict, index) for child_dict in reversed(node_dict["children"]))
+        return structure
+
+    def find_leaf_with_visit_state(self, visit_state: Union[VisitState, List[VisitState]]) -> Optional[ColumnarNode]:
+        """
+        Finds a leaf node with matching visit state(s). The first match in DFS order is returned.
+        Args:
+            visit_state: Either a VisitState, or list of VisitStates. If a list, a match is found when any of the
+            list's element matches.
+
+        Returns: The first matching node if found, else None.
+        """
+        if visit_state is None:
+            raise TypeError("Visit state cannot be none")
+        if isinstance(visit_state, list) and not visit_state:
+            raise ValueError("Visit states is empty!")
+        visit_states = visit_state if isinstance(visit_state, list) else [visit_state]
+        if self.__leaves is None:
+            self.__collect_leaves()
+        first_position = min(self.__advance_leaf_cursor(state.value) for state in visit_states)
+        return ColumnarNode(self, self.__leaves[first_position]) if first_position < len(self.__leaves) else None
+
+    def get_visit_state_counts(self) -> Dict[VisitState, int]:
+        """
+        Returns: The number of nodes (excluding the root node) per visit state.
+        """
+        return {state: self.__visit_state_counts[state.value] for state in VisitState}
+
+    def iter_json(self) -> Iterator[str]:
+        """
+        Returns: The JSON representation of the structure in chunks, without building its dict first. Joined, the
+        chunks are the same as json.dumps(to_dict(), sort_keys=True).
+        """
+        return tree_to_json_chunks(self.root_node)
+
+    def __str__(self):
+        return tree_to_str(self.root_node)
+
+    def _iter_child_indices(self, index: int):
+        child_index = self._first_children[index]
+        while child_index != _NO_INDEX:
+            yield child_index
+            child_index = self._next_siblings[child_index]
+
+    def _get_url(self, index: int) -> str:
+        return self._url_buffer[self._url_offsets[index]:self._url_offsets[index + 1]].decode("utf-8")
+
+    def _get_child_index(self, index: int, name: str) -> int:
+        child_indices = self._child_indices.get(index)
+        return child_indices.get(name, _NO_INDEX) if child_indices else _NO_INDEX
+
+    def _get_path(self, index: int) -> str:
+        names = []
+        while self._parents[index] != _NO_INDEX:
+            names.append(self._names[index])
+            index = self._parents[index]
+        return "".join("/" + name for name in reversed(names))
+
+    def _to_dict(self, index: int) -> dict:
+        root_dict = self.__create_node_dict(index)
+        nodes_to_convert = [(index, root_dict)]
+        while nodes_to_convert:
+            parent_index, parent_dict = nodes_to_convert.pop()
+            for child_index in self._iter_child_indices(parent_index):
+                child_dict = self.__create_node_dict(child_index)
+                parent_dict["children"].append(child_dict)
+                nodes_to_convert.append((child_index, child_dict))
+        return root_dict
+
+    def _set_visit_state(self, index: int, visit_state: VisitState):
+        previous_value = self._visit_states[index]
+        if previous_value == visit_state.value:
+            return
+        self._visit_states[index] = visit_state.value
+        if index != 0:
+            self.__visit_state_counts[previous_value] -= 1
+            self.__visit_state_counts[visit_state.value] += 1
+        if self.__visit_state_listeners:
+            node = ColumnarNode(self, index)
+            for listener in self.__visit_state_listeners:
+                listener(node)
+        if self.__leaves is not None:
+            position = self.__leaf_positions[index]
+            if position != _NO_INDEX and position < self.__leaf_cursors[visit_state.value]:
+                self.__leaf_cursors[visit_state.value] = position
+
+    def __create_node_dict(self, index: int) -> dict:
+        return {"name": self._names[index], "url": self._get_url(index),
+                "visit_state": _VISIT_STATES_BY_VALUE[self._visit_states[index]].name, "children": []}
+
+    def __append_node(self, name: str, url: str, parent_index: int, visit_state_value: int) -> int:
+        index = len(self._names)
+        name = sys.intern(str(name))
+        self._names.append(name)
+        self._url_buffer.extend(url.encode("utf-8"))
+        self._url_offsets.append(len(self._url_buffer))
+        self._parents.append(parent_index)
+        self._first_children.append(_NO_INDEX)
+        self._last_children.append(_NO_INDEX)
+        self._next_siblings.append(_NO_INDEX)
+        self._visit_states.append(visit_state_value)
+        if parent_index != _NO_INDEX:
+            self.__visit_state_counts[visit_state_value] += 1
+            last_sibling_index = self._last_children[parent_index]
+            if last_sibling_index == _NO_INDEX:
+                self._first_children[parent_index] = index
+                self._child_indices[parent_index] = {}
+            else:
+                self._next_siblings[last_sibling_index] = index
+            self._last_children[parent_index] = index
+            self._child_indices[parent_index].setdefault(name, index)
+        return index
+
+    def __find_index(self, used_path: str) -> int:
+        index = 0
+        for node_name in used_path.split("/"):
+            index = self._get_child_index(index, node_name)
+            if index == _NO_INDEX:
+                break
+        return index
+
+    def __collect_leaves(self):
+        self.__leaves = array("i")
+        self.__leaf_positions = array("i", [_NO_INDEX]) * len(self._names)
+        first_children = self._first_children
+        next_siblings = self._next_siblings
+        indices_to_visit = [0]
+        while indices_to_visit:
+            index = indices_to_visit.pop()
+            child_index = first_children[index]
+            if child_index == _NO_INDEX:
+                self.__leaf_positions[index] = len(self.__leaves)
+                self.__leaves.append(index)
+                continue
+            child_indices = []
+            while child_index != _NO_INDEX:
+                child_indices.append(child_index)
+                child_index = next_siblings[child_index]
+            indices_to_visit.extend(reversed(child_indices))
+        self.__leaf_cursors = [0] * len(VisitState)
+
+    def __advance_leaf_cursor(self, visit_state_value: int) -> int:
+        # No leaf before the cursor has the given visit state, so it's enough to continue from there.
+        leaves = self.__leaves
+        visit_states = self._visit_states
+        position = self.__leaf_cursors[visit_state_value]
+        while position < len(leaves) and visit_states[leaves[position]] != visit_state_value:
+            position += 1
+        self.__leaf_cursors[visit_state_value] = position
+        return position
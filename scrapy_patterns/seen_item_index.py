@@ -0,0 +1,97 @@
+"""Contains the persistent index of seen items."""
+import sqlite3
+import time
+from typing import Iterable, List, Optional
+
+
+class SeenItemIndexStats:
+    """
+    Statistics of a seen item index.
+    Attributes:
+        num_of_hits (int): The number of looked up URLs that were seen.
+        num_of_misses (int): The number of looked up URLs that weren't seen, or were seen too long ago.
+    """
+    def __init__(self):
+        self.num_of_hits = 0
+        self.num_of_misses = 0
+
+
+class SeenItemIndex:
+    """
+    A persistent set of item URLs that were already scraped, so they can be skipped when the same site is crawled again.
+    The URLs are stored in an SQLite database, and only the looked up ones are read, so it can hold millions of URLs.
+    Additions are committed in batches, so close() must be called at the end.
+    """
+    __LOOKUP_BATCH_SIZE = 500
+
+    def __init__(self, file_path: str, max_age_seconds: Optional[float] = None, commit_interval: int = 1000):
+        """
+        Args:
+            file_path: The path of the database file. It's created if it doesn't exist.
+            max_age_seconds: URLs seen longer ago than this are treated as not seen, so they are scraped again. None
+            means that seen URLs never expire.
+            commit_interval: The number of additions after which they are committed.
+        """
+        self.stats = SeenItemIndexStats()
+        self.__max_age_seconds = max_age_seconds
+        self.__commit_interval = commit_interval
+        self.__num_of_uncommitted = 0
+        self.__connection = sqlite3.connect(file_path)
+        self.__connection.execute("CREATE TABLE IF NOT EXISTS seen_items "
+                                  "(url TEXT PRIMARY KEY, seen_at REAL NOT NULL) WITHOUT ROWID")
+        self.__connection.commit()
+
+    def is_seen(self, url: str) -> bool:
+        """
+        Args:
+            url: The URL of the item.
+
+        Returns: True if the item was seen (and not too long ago).
+        """
+        return bool(self.filter_seen([url]))
+
+    def filter_seen(self, urls: Iterable[str]) -> List[str]:
+        """
+        Looks up the given URLs.
+        Args:
+            urls: The URLs of the items.
+
+        Returns: The seen URLs from the given ones, in the given order.
+        """
+        urls = list(urls)
+        seen_at_by_url = {}
+        for start in range(0, len(urls), self.__LOOKUP_BATCH_SIZE):
+            batch = urls[start:start + self.__LOOKUP_BATCH_SIZE]
+            rows = self.__connection.execute(
+                "SELECT url, seen_at FROM seen_items WHERE url IN ({})".format(", ".join("?" * len(batch))), batch)
+            seen_at_by_url.update(rows)
+        min_seen_at = time.time() - self.__max_age_seconds if self.__max_age_seconds is not None else None
+        seen_urls = [url for url in urls
+                     if url in seen_at_by_url and (min_seen_at is None or seen_at_by_url[url] >= min_seen_at)]
+        self.stats.num_of_hits += len(seen_urls)
+        self.stats.num_of_misses += len(urls) - len(seen_urls)
+        return seen_urls
+
+    def add(self, url: str):
+        """
+        Adds a URL, or refreshes its age if it's already in the index.
+        Args:
+            url: The URL of the item.
+        """
+        self.__connection.execute("INSERT OR REPLACE INTO seen_items (url, seen_at) VALUES (?, ?)", (url, time.time()))
+        self.__num_of_uncommitted += 1
+        if self.__num_of_uncommitted >= self.__commit_interval:
+            self.flush()
+
+    def flush(self):
+        """Commits the additions."""
+        self.__connection.commit()
+        self.__num_of_uncommitted = 0
+
+    def close(self):
+        """Commits the additions, and closes the database."""
+        self.flush()
+        self.__connection.close()
+
+    def __len__(self):
+        return self.__connection.execute("SELECT COUNT(*) FROM seen_items").fetchone()[0]
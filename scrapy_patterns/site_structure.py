@@ -1,6 +1,10 @@
 """Contains classes that are used to describe the structure of a site."""
+import re
+import sys
+import json
+from json.decoder import scanstring
 from enum import Enum
-from typing import Optional, List, Union
+from typing import Optional, List, Union, Dict, Callable, Sequence, Iterator
 
 
 class VisitState(Enum):
@@ -10,6 +14,31 @@ class VisitState(Enum):
     VISITED = 2
 
 
+# Shared by all leaves, so they don't need a list of their own.
+_NO_CHILDREN = ()
+
+
+class _ChildrenView(Sequence):
+    # A read-only view of the children of a node, so children can only be added through add_child(), which keeps the
+    # name map of the node, and the structure of the node up to date.
+    __slots__ = ("__children",)
+
+    def __init__(self, children: List['Node']):
+        self.__children = children
+
+    def __getitem__(self, index):
+        return self.__children[index]
+
+    def __len__(self):
+        return len(self.__children)
+
+    def __iter__(self):
+        return iter(self.__children)
+
+    def __reversed__(self):
+        return reversed(self.__children)
+
+
 class Node:
     """
     The node (category). Most sites are built around categories, which in turn can contain sub-categories, etc...
@@ -19,8 +48,14 @@ class Node:
         url (str): The url at which the node (category) is available.
         parent (Node): The parent of the node.
         visit_state (VisitState): The visit state of the node. Default value is VisitState.NEW
-        children (List[Node]): Children of node. Default value is an empty list.
+        children (Sequence[Node]): Children of node, read-only. Default value is an empty sequence. Children can only
+        be added with add_child().
+        visit_state_listener (Callable[[Node, Optional[VisitState]], None]): Called with the node, and its previous
+        visit state when its visit state changes, or with None as the previous visit state when the node is added
+        through add_child(). Children added through add_child() inherit it. Default value is None.
     """
+    # Large structures can have hundreds of thousands of nodes, so nodes are kept compact.
+    __slots__ = ("name", "url", "parent", "visit_state_listener", "__visit_state", "__children", "__children_by_name")
 
     def __init__(self, name: str, url: str, parent: 'Node' = None):
         """
@@ -29,31 +64,90 @@ class Node:
             url: The url at which the node (category) is available.
             parent: The node's parent.
         """
-        self.name = name
+        # Names are interned, as the same names (e.g. "Sale") tend to repeat across categories.
+        self.name = sys.intern(str(name))
         self.url = url
-        self.visit_state = VisitState.NEW
-        self.children: List[Node] = []
+        self.visit_state_listener: Optional[Callable[[Node, Optional[VisitState]], None]] = None
+        self.__visit_state = VisitState.NEW
+        self.__children: Sequence[Node] = _NO_CHILDREN
         self.parent: Node = parent
+        self.__children_by_name: Optional[Dict[str, Node]] = None
+
+    @property
+    def children(self) -> Sequence['Node']:
+        """The children of the node. Use add_child() to add children."""
+        if self.__children is _NO_CHILDREN:
+            return _NO_CHILDREN
+        return _ChildrenView(self.__children)
+
+    @property
+    def visit_state(self) -> VisitState:
+        """The visit state of the node."""
+        return self.__visit_state
+
+    @visit_state.setter
+    def visit_state(self, visit_state: VisitState):
+        previous_visit_state = self.__visit_state
+        if visit_state == previous_visit_state:
+            return
+        self.__visit_state = visit_state
+        if self.visit_state_listener:
+            self.visit_state_listener(self, previous_visit_state)
+
+    def add_child(self, child: 'Node'):
+        """
+        Appends a child to this node, and sets its parent to this node. The visit state listener is notified, so a
+        structure the node belongs to keeps track of the new child (and its descendants).
+        Args:
+            child: The child node.
+        """
+        child.parent = self
+        child.visit_state_listener = self.visit_state_listener
+        if self.__children is _NO_CHILDREN:
+            self.__children = []
+            self.__children_by_name = {}
+        self.__children.append(child)
+        self.__children_by_name.setdefault(child.name, child)
+        if self.visit_state_listener:
+            self.visit_state_listener(child, None)
+
+    def get_child(self, name: str) -> Optional['Node']:
+        """
+        Gets a direct child by its name.
+        Args:
+            name: The name of the child.
+
+        Returns: The first child with the given name if found, else None.
+        """
+        if self.__children_by_name is None:
+            return None
+        return self.__children_by_name.get(name)
 
     def get_path(self) -> str:
         """
         Returns: The path of the node separated by slashes (/), excluding the name of the root node. Paths consists of
         the names of the nodes.
         """
-        if self.parent is None:
-            return ""
-        else:
-            return self.parent.get_path() + "/" + self.name
+        names = []
+        node = self
+        while node.parent is not None:
+            names.append(node.name)
+            node = node.parent
+        return "".join("/" + name for name in reversed(names))
 
     def to_dict(self):
         """
         Returns: A dict representation of the tree rooted at this node.
         """
-        node_dict = {"name": self.name, "url": self.url, "visit_state": self.visit_state.name, "children": []}
-        if self.children:
-            children = [node.to_dict() for node in self.children]
-            node_dict.update({"children": children})
-        return node_dict
+        root_dict = self.__create_dict()
+        nodes_to_convert = [(self, root_dict)]
+        while nodes_to_convert:
+            node, node_dict = nodes_to_convert.pop()
+            for child in node.__children:
+                child_dict = child.__create_dict()
+                node_dict["children"].append(child_dict)
+                nodes_to_convert.append((child, child_dict))
+        return root_dict
 
     @classmethod
     def from_dict(cls, node_dict: dict):
@@ -64,17 +158,14 @@ class Node:
 
         Returns: The restored tree.
         """
-        name = node_dict["name"]
-        url = node_dict["url"]
-        visit_state = VisitState[node_dict["visit_state"]]
-        node = Node(name, url)
-        node.visit_state = visit_state
-        if node_dict["children"]:
-            for child_dict in node_dict["children"]:
-                child_node = Node.from_dict(child_dict)
-                child_node.parent = node
-                node.children.append(child_node)
-        return node
+        root_node = Node.__create_from_dict(node_dict)
+        dicts_to_convert = [(child_dict, root_node) for child_dict in reversed(node_dict["children"])]
+        while dicts_to_convert:
+            child_dict, parent = dicts_to_convert.pop()
+            child = Node.__create_from_dict(child_dict)
+            parent.add_child(child)
+            dicts_to_convert.extend((grandchild_dict, child) for grandchild_dict in reversed(child_dict["children"]))
+        return root_node
 
     def set_visit_state(self, visit_state: VisitState, propagate: bool = False):
         """
@@ -83,14 +174,26 @@ class Node:
             visit_state: The new state.
             propagate: Whether to propagate to ancestors.
         """
-        self.visit_state = visit_state
-        if self.parent and propagate:
-            self.parent.set_visit_state(visit_state, propagate)
+        node = self
+        while node is not None:
+            node.visit_state = visit_state
+            node = node.parent if propagate else None
+
+    def __create_dict(self) -> dict:
+        return {"name": self.name, "url": self.url, "visit_state": self.visit_state.name, "children": []}
+
+    @staticmethod
+    def __create_from_dict(node_dict: dict) -> 'Node':
+        node = Node(node_dict["name"], node_dict["url"])
+        node.visit_state = VisitState[node_dict["visit_state"]]
+        return node
 
 
 class SiteStructure:
     """
-    Handles the nodes of the structure.
+    Handles the nodes of the structure. Nodes find their children by name, so lookups don't need to scan siblings.
+    Leaves are kept in DFS order along with a cursor per visit state, so finding the next leaf with a given visit state
+    doesn't need to restart the search from the root.
     Attributes:
         root_node (Node): The root node.
     """
@@ -102,6 +205,28 @@ class SiteStructure:
             name: The name of the root node. (The root node doesn't have an url)
         """
         self.root_node = Node("(root) {}".format(name), "")
+        self.root_node.visit_state_listener = self.__on_visit_state_changed
+        self.__leaves: Optional[List[Node]] = None
+        self.__leaf_positions: Dict[Node, int] = {}
+        self.__leaf_cursors: Dict[VisitState, int] = {}
+        self.__visit_state_listeners: List[Callable[[Node], None]] = []
+        self.__visit_state_counts: Dict[VisitState, int] = {state: 0 for state in VisitState}
+
+    def add_visit_state_listener(self, listener: Callable[[Node], None]):
+        """
+        Adds a listener that is called with the node whenever the visit state of a node in this structure changes.
+        Args:
+            listener: The listener.
+        """
+        self.__visit_state_listeners.append(listener)
+
+    def remove_visit_state_listener(self, listener: Callable[[Node], None]):
+        """
+        Removes a listener added with add_visit_state_listener().
+        Args:
+            listener: The listener.
+        """
+        self.__visit_state_listeners.remove(listener)
 
     def add_node_with_path(self, path: str, url: str):
         """
@@ -113,23 +238,14 @@ class SiteStructure:
 
         Returns: The newly created node.
         """
-        if self.get_node_at_path(path) is not None:
+        parent_path, _, new_node_name = path.strip("/").rpartition("/")
+        parent = self.get_node_at_path(parent_path) if parent_path else self.root_node
+        if parent is not None and parent.get_child(new_node_name) is not None:
             raise RuntimeError("Path \"{}\" already exists!".format(path))
-        used_path = path.strip("/")
-        node_names = self.__split_path(used_path)
-        children = self.root_node.children
-        parent = self.root_node
-        if len(node_names) > 1:
-            parent_path = "/".join(node_names[:-1])
-            existing = self.get_node_at_path(parent_path)
-            if existing:
-                parent = existing
-                children = existing.children
-            else:
-                raise RuntimeError("Parent path \"{}\" not existing!".format(parent_path))
-        new_node_name = node_names[-1]
+        if parent is None:
+            raise RuntimeError("Parent path \"{}\" not existing!".format(parent_path))
         node = Node(new_node_name, url, parent)
-        children.append(node)
+        parent.add_child(node)
         return node
 
     def get_node_at_path(self, path: str) -> Node:
@@ -140,14 +256,11 @@ class SiteStructure:
 
         Returns: The node if found, else None.
         """
-        children = self.root_node.children
-        result_node = None
-        used_path = path.strip("/")
-        for node_name in self.__split_path(used_path):
-            result_node = self.__find_node(node_name, children)
+        result_node = self.root_node
+        for node_name in path.strip("/").split("/"):
+            result_node = result_node.get_child(node_name)
             if result_node is None:
                 break
-            children = result_node.children
         return result_node
 
     def to_dict(self):
@@ -167,11 +280,13 @@ class SiteStructure:
         """
         structure = SiteStructure()
         structure.root_node = Node.from_dict(struct_dict)
+        structure.root_node.visit_state_listener = structure.__on_visit_state_changed
+        structure.__register_nodes(list(structure.root_node.children))
         return structure
 
     def find_leaf_with_visit_state(self, visit_state: Union[VisitState, List[VisitState]]) -> Optional[Node]:
         """
-        Finds a leaf node with matching visit state(s). Search is DFS.
+        Finds a leaf node with matching visit state(s). The first match in DFS order is returned.
         Args:
             visit_state: Either a VisitState, or list of VisitStates. If a list, a match is found when any of the
             list's element matches.
@@ -183,82 +298,253 @@ class SiteStructure:
             raise TypeError("Visit state cannot be none")
         if isinstance(visit_state, list) and not visit_state:
             raise ValueError("Visit states is empty!")
-        return self.__find_leaf_with_visit_state(visit_state, self.root_node)
+        visit_states = visit_state if isinstance(visit_state, list) else [visit_state]
+        if self.__leaves is None:
+            self.__collect_leaves()
+        positions = [self.__advance_leaf_cursor(state) for state in visit_states]
+        first_position = min(positions)
+        return self.__leaves[first_position] if first_position < len(self.__leaves) else None
+
+    def get_visit_state_counts(self) -> Dict[VisitState, int]:
+        """
+        Returns: The number of nodes (excluding the root node) per visit state.
+        """
+        return dict(self.__visit_state_counts)
+
+    def iter_json(self) -> Iterator[str]:
+        """
+        Returns: The JSON representation of the structure in chunks, without building its dict first. Joined, the
+        chunks are the same as json.dumps(to_dict(), sort_keys=True).
+        """
+        return tree_to_json_chunks(self.root_node)
 
     def __str__(self):
-        return "\n".join(self.__create_log_msg_records(self.root_node))
-
-    def __find_leaf_with_visit_state(self, visit_state: Union[VisitState, List[VisitState]], node: Node):
-        is_leaf = len(node.children) == 0
-        if is_leaf and self.__visit_state_matches(visit_state, node):
-            return node
-        for child in node.children:
-            descendant_match = self.__find_leaf_with_visit_state(visit_state, child)
-            if descendant_match:
-                return descendant_match
-        return None
+        return tree_to_str(self.root_node)
+
+    def __collect_leaves(self):
+        self.__leaves = []
+        nodes_to_visit = [self.root_node]
+        while nodes_to_visit:
+            node = nodes_to_visit.pop()
+            if node.children:
+                nodes_to_visit.extend(reversed(node.children))
+            else:
+                self.__leaves.append(node)
+        self.__leaf_positions = {leaf: position for position, leaf in enumerate(self.__leaves)}
+        self.__leaf_cursors = {state: 0 for state in VisitState}
+
+    def __advance_leaf_cursor(self, visit_state: VisitState) -> int:
+        # No leaf before the cursor has the given visit state, so it's enough to continue from there.
+        position = self.__leaf_cursors[visit_state]
+        while position < len(self.__leaves) and self.__leaves[position].visit_state != visit_state:
+            position += 1
+        self.__leaf_cursors[visit_state] = position
+        return position
+
+    def __on_visit_state_changed(self, node: Node, previous_visit_state: Optional[VisitState]):
+        if previous_visit_state is None:
+            # The node is added, with its descendants if any.
+            self.__register_nodes([node])
+            self.__leaves = None
+            return
+        if node is not self.root_node:
+            self.__visit_state_counts[previous_visit_state] -= 1
+            self.__visit_state_counts[node.visit_state] += 1
+        for listener in self.__visit_state_listeners:
+            listener(node)
+        if self.__leaves is None:
+            return
+        position = self.__leaf_positions.get(node)
+        if position is not None and position < self.__leaf_cursors[node.visit_state]:
+            self.__leaf_cursors[node.visit_state] = position
+
+    def __register_nodes(self, nodes_to_index: List[Node]):
+        # The same bound method is shared by all nodes instead of creating one per node.
+        visit_state_listener = self.root_node.visit_state_listener
+        while nodes_to_index:
+            node = nodes_to_index.pop()
+            node.visit_state_listener = visit_state_listener
+            self.__visit_state_counts[node.visit_state] += 1
+            nodes_to_index.extend(node.children)
+
+
+def tree_to_str(root_node) -> str:
+    """
+    Creates the multi-line text representation of a tree, where each line shows the visit state, name and url of a
+    node.
+    Args:
+        root_node: The root of the tree. Any object with the attributes of a Node.
 
-    @staticmethod
-    def __visit_state_matches(visit_state, node):
-        if isinstance(visit_state, list):
-            return node.visit_state in visit_state
-        else:
-            return node.visit_state == visit_state
+    Returns: The text.
+    """
+    return "\n".join(_create_log_msg_records(root_node))
 
-    @staticmethod
-    def __find_node(name, nodes):
-        for node in nodes:
-            if node.name == name:
-                return node
-        return None
 
-    @staticmethod
-    def __split_path(path):
-        return path.split("/")
+def visit_state_counts_to_str(structure) -> str:
+    """
+    Creates the short text representation of a structure, which shows only the number of nodes per visit state.
+    Args:
+        structure: The structure. Any object with get_visit_state_counts() like a SiteStructure.
 
-    def __create_log_msg_records(self, node: Node, prefix=""):
-        records = []
-        is_root = node.parent is None
-        has_sibling = self.__has_sibling(node)
-        node_prefix = self.__create_node_prefix(is_root, has_sibling)
-        node_prefix = prefix + node_prefix
-        log_msg_record = self.__create_single_log_msg_record(node, node_prefix)
-        records.append(log_msg_record)
-        carry_on_prefix = self.__create_carry_on_prefix(is_root, has_sibling)
-        carry_on_prefix = prefix + carry_on_prefix
-        for child in node.children:
-            records.extend(self.__create_log_msg_records(child, carry_on_prefix))
-        return records
+    Returns: The text.
+    """
+    counts = structure.get_visit_state_counts()
+    return ", ".join("{} {}".format(count, state.name) for state, count in counts.items())
 
-    @staticmethod
-    def __create_single_log_msg_record(node, node_prefix):
-        is_root = node.parent is None
-        if is_root:
-            return node.name
-        else:
-            return "{node_prefix}[{visit_state}] {node_name} ({node_url})".format(
-                node_prefix=node_prefix, visit_state=node.visit_state.name, node_name=node.name, node_url=node.url)
 
-    @staticmethod
-    def __has_sibling(child):
-        if child and child.parent:
-            return child.parent.children[-1].name != child.name
-        return None
+def tree_to_json_chunks(root_node) -> Iterator[str]:
+    """
+    Creates the JSON representation of a tree in chunks. Joined, the chunks are the same as
+    json.dumps(root_node.to_dict(), sort_keys=True).
+    Args:
+        root_node: The root of the tree. Any object with the attributes of a Node.
 
-    @staticmethod
-    def __create_node_prefix(is_root, has_sibling):
-        if is_root:
-            return ""
-        if has_sibling:
-            return "├── "
-        else:
-            return "└── "
+    Returns: The chunks.
+    """
+    # Items are either nodes to write, or texts to write as they are.
+    items_to_write = [root_node]
+    while items_to_write:
+        item = items_to_write.pop()
+        if isinstance(item, str):
+            yield item
+            continue
+        yield '{"children": ['
+        items_to_write.append('], "name": {}, "url": {}, "visit_state": {}}}'.format(
+            json.dumps(item.name), json.dumps(item.url), json.dumps(item.visit_state.name)))
+        children = item.children
+        for position in reversed(range(len(children))):
+            items_to_write.append(children[position])
+            if position > 0:
+                items_to_write.append(", ")
+
+
+def load_deep_json(json_str: str):
+    """
+    Parses JSON like json.loads(), but values nested deeper than what json.loads() can parse within the recursion limit
+    (e.g. the dicts of long category chains) are parsed without recursion.
+    Args:
+        json_str: The JSON.
 
-    @staticmethod
-    def __create_carry_on_prefix(is_root, has_sibling):
-        if is_root:
-            return ""
-        if has_sibling:
-            return "|   "
+    Returns: The parsed value.
+    """
+    try:
+        return json.loads(json_str)
+    except RecursionError:
+        return _load_json_iteratively(json_str)
+
+
+_JSON_WHITESPACE = re.compile(r"[ \t\n\r]*")
+_JSON_NUMBER = re.compile(r"-?(?:0|[1-9][0-9]*)(\.[0-9]+)?([eE][-+]?[0-9]+)?")
+_JSON_LITERALS = {"true": True, "false": False, "null": None}
+
+
+def _load_json_iteratively(json_str: str):
+    # Each entry is a container being parsed, and the key of the member being parsed if it's an object.
+    containers = []
+    position = _JSON_WHITESPACE.match(json_str, 0).end()
+    while True:
+        char = json_str[position:position + 1]
+        if char in ("{", "["):
+            container = {} if char == "{" else []
+            position = _JSON_WHITESPACE.match(json_str, position + 1).end()
+            if json_str[position:position + 1] != ("}" if char == "{" else "]"):
+                key = None
+                if char == "{":
+                    key, position = _parse_json_key(json_str, position)
+                containers.append([container, key])
+                continue
+            value = container
+            position += 1
         else:
-            return "    "
+            value, position = _parse_json_scalar(json_str, position)
+        # The value is complete, so it's added to its container, and the containers completed by it are closed.
+        while containers:
+            container, key = containers[-1]
+            if isinstance(container, list):
+                container.append(value)
+            else:
+                container[key] = value
+            position = _JSON_WHITESPACE.match(json_str, position).end()
+            char = json_str[position:position + 1]
+            if char == ",":
+                position = _JSON_WHITESPACE.match(json_str, position + 1).end()
+                if isinstance(container, dict):
+                    containers[-1][1], position = _parse_json_key(json_str, position)
+                break
+            if char != ("]" if isinstance(container, list) else "}"):
+                raise ValueError("Invalid JSON at position {}".format(position))
+            containers.pop()
+            value = container
+            position += 1
+        if not containers:
+            if _JSON_WHITESPACE.match(json_str, position).end() != len(json_str):
+                raise ValueError("Extra data in JSON at position {}".format(position))
+            return value
+
+
+def _parse_json_key(json_str: str, position: int):
+    if json_str[position:position + 1] != '"':
+        raise ValueError("Invalid JSON object key at position {}".format(position))
+    key, position = scanstring(json_str, position + 1)
+    position = _JSON_WHITESPACE.match(json_str, position).end()
+    if json_str[position:position + 1] != ":":
+        raise ValueError("Missing colon in JSON at position {}".format(position))
+    return key, _JSON_WHITESPACE.match(json_str, position + 1).end()
+
+
+def _parse_json_scalar(json_str: str, position: int):
+    if json_str[position:position + 1] == '"':
+        return scanstring(json_str, position + 1)
+    number_match = _JSON_NUMBER.match(json_str, position)
+    if number_match:
+        is_float = number_match.group(1) or number_match.group(2)
+        return (float if is_float else int)(number_match.group()), number_match.end()
+    for literal, value in _JSON_LITERALS.items():
+        if json_str.startswith(literal, position):
+            return value, position + len(literal)
+    raise ValueError("Invalid JSON value at position {}".format(position))
+
+
+def _create_log_msg_records(root_node):
+    records = []
+    # Each entry is a node, the prefix of its ancestors, and whether it has a sibling after it.
+    nodes_to_visit = [(root_node, "", None)]
+    while nodes_to_visit:
+        node, prefix, has_sibling = nodes_to_visit.pop()
+        is_root = node.parent is None
+        node_prefix = _create_node_prefix(is_root, has_sibling)
+        node_prefix = prefix + node_prefix
+        records.append(_create_single_log_msg_record(node, node_prefix))
+        carry_on_prefix = _create_carry_on_prefix(is_root, has_sibling)
+        carry_on_prefix = prefix + carry_on_prefix
+        children = node.children
+        nodes_to_visit.extend((child, carry_on_prefix, position < len(children) - 1)
+                              for position, child in reversed(list(enumerate(children))))
+    return records
+
+
+def _create_single_log_msg_record(node, node_prefix):
+    is_root = node.parent is None
+    if is_root:
+        return node.name
+    else:
+        return "{node_prefix}[{visit_state}] {node_name} ({node_url})".format(
+            node_prefix=node_prefix, visit_state=node.visit_state.name, node_name=node.name, node_url=node.url)
+
+
+def _create_node_prefix(is_root, has_sibling):
+    if is_root:
+        return ""
+    if has_sibling:
+        return "├── "
+    else:
+        return "└── "
+
+
+def _create_carry_on_prefix(is_root, has_sibling):
+    if is_root:
+        return ""
+    if has_sibling:
+        return "|   "
+    else:
+        return "    "
@@ -0,0 +1,85 @@
+"""Contains the cache of discovered site structures."""
+import os
+import json
+import time
+import logging
+from typing import Optional, Tuple, Any
+from scrapy_patterns.site_structure import SiteStructure, VisitState, load_deep_json
+
+
+class SiteStructureCache:
+    """
+    Keeps a discovered site structure in a file, so new crawls of the same site don't have to discover it again. The
+    structure is restored with every category being NEW, regardless of the visit states when it was saved.
+    """
+    def __init__(self, file_path: str, site_structure_class: type = SiteStructure):
+        """
+        Args:
+            file_path: The path of the cache file.
+            site_structure_class: The class used to restore the site structure.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.__file_path = file_path
+        self.__site_structure_class = site_structure_class
+
+    def load(self, max_age_seconds: Optional[float] = None):
+        """
+        Loads the saved structure.
+        Args:
+            max_age_seconds: If given, a structure saved longer ago than this is not loaded.
+
+        Returns: The structure with every category being NEW, or None if there's no (recent enough) saved structure.
+        """
+        structure_and_age = self.load_with_age()
+        if structure_and_age is None:
+            return None
+        structure, age_seconds = structure_and_age
+        if max_age_seconds is not None and age_seconds > max_age_seconds:
+            self.logger.info("Cached site structure is expired: %s", self.__file_path)
+            return None
+        return structure
+
+    def load_with_age(self) -> Optional[Tuple[Any, float]]:
+        """
+        Loads the saved structure regardless of its age, so the age can be checked without reading the file again.
+        Returns: The structure with every category being NEW, and the number of seconds since it was saved, or None if
+        there's no saved structure.
+        """
+        cache_dict = self.__try_read()
+        if cache_dict is None:
+            return None
+        structure_dict = cache_dict["site_structure"]
+        dicts_to_reset = [structure_dict]
+        while dicts_to_reset:
+            node_dict = dicts_to_reset.pop()
+            node_dict["visit_state"] = VisitState.NEW.name
+            dicts_to_reset.extend(node_dict["children"])
+        return self.__site_structure_class.from_dict(structure_dict), time.time() - cache_dict["saved_at"]
+
+    def save(self, structure):
+        """
+        Saves the structure, replacing the previously saved one.
+        Args:
+            structure: The structure.
+        """
+        temp_file_path = self.__file_path + ".tmp"
+        with open(temp_file_path, "w") as cache_file:
+            cache_file.write('{{"saved_at": {}, "site_structure": '.format(json.dumps(time.time())))
+            for json_chunk in structure.iter_json():
+                cache_file.write(json_chunk)
+            cache_file.write("}")
+        os.replace(temp_file_path, self.__file_path)
+
+    def __try_read(self) -> Optional[dict]:
+        if not os.path.isfile(self.__file_path):
+            return None
+        try:
+            with open(self.__file_path, "r") as cache_file:
+                # The structure may be nested deeper than what json.load() can parse.
+                cache_dict = load_deep_json(cache_file.read())
+            if not isinstance(cache_dict["saved_at"], (int, float)):
+                raise ValueError("Invalid save time")
+            return cache_dict
+        except (ValueError, KeyError, TypeError) as error:
+            self.logger.error("Failed to read cached site structure from file %s: %s", self.__file_path, error)
+            return None
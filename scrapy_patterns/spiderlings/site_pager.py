@@ -1,10 +1,15 @@
 """Contains the site pager spiderling."""
 import logging
-from typing import List, Union, Tuple, Callable
+import functools
+from collections import deque
+from typing import List, Union, Tuple, Callable, Deque, Optional, AbstractSet, Iterable, Iterator, Mapping
 
 from scrapy import Spider, Item, signals, exceptions, Request
 from scrapy.http import Response
+from scrapy.utils.defer import deferred_from_coro
 from scrapy_patterns.request_factory import RequestFactory
+from scrapy_patterns.seen_item_index import SeenItemIndex
+from scrapy_patterns.bloom_filter import BloomFilter
 
 
 class ItemParser:
@@ -23,13 +28,29 @@ class ItemParser:
 class ItemUrlsParser:
     """Interface used for parsing item urls from a response (typically from a page)"""
 
-    def parse(self, response: Response) -> Union[List[str], List[Tuple[str, dict]]]:
+    def parse(self, response: Response) -> Union[Iterable[str], Iterable[Tuple[str, dict]]]:
         """
         Args:
             response (Response): The scrapy response
 
         Returns: Either the list of item URLs, or a list of tuples, where the first element is the item URL, and the
-        second element is a dict that will be passed as kwargs to the Request constructor.
+        second element is a dict that will be passed as kwargs to the Request constructor. It can be a generator as
+        well, then the items are requested while the page is parsed.
+        """
+        raise NotImplementedError()
+
+
+class ListingItemParser:
+    """Interface used for parsing items from a page, for sites where the page contains the data of its items"""
+
+    def parse(self, response: Response) -> Iterable[Union[Item, str, Tuple[str, dict]]]:
+        """
+        Args:
+            response (Response): The scrapy response of the page.
+
+        Returns: A list of the items on the page. Items that are incomplete on the page can be given with their URL, or
+        with a tuple of their URL and a dict of Request kwargs (like with ItemUrlsParser); these are requested, and
+        parsed with ItemParser. It can be a generator as well.
         """
         raise NotImplementedError()
 
@@ -59,145 +80,643 @@ class NextPageUrlParser:
         raise NotImplementedError()
 
 
+class PageCountParser:
+    """
+    Interface used for sites with numbered pages, where the number of pages is shown on the first page, and the URL of
+    any page can be built from its number.
+    """
+
+    def parse(self, response: Response) -> int:
+        """
+        Parses the number of pages.
+        Args:
+            response (Response): The response of the first page.
+
+        Returns: The number of pages.
+        """
+        raise NotImplementedError()
+
+    def build_url(self, start_page_url: str, page_number: int) -> Union[str, Tuple[str, dict]]:
+        """
+        Builds the URL of a page.
+        Args:
+            start_page_url (str): The URL of the first page.
+            page_number (int): The number of the page, starting from 1.
+
+        Returns: Either the page's URL, or a tuple, where the first element is the page's URL, and the second element
+        is a dict that will be passed as kwargs to the Request constructor.
+        """
+        raise NotImplementedError()
+
+
 class SitePageParsers:
     """Groups parsers."""
-    def __init__(self, next_page_url: NextPageUrlParser, item_urls: ItemUrlsParser, item: ItemParser):
+    # pylint: disable=too-many-arguments
+    def __init__(self, next_page_url: NextPageUrlParser, item_urls: ItemUrlsParser, item: ItemParser,
+                 page_count: PageCountParser = None, listing_items: ListingItemParser = None):
         """
         Args:
             next_page_url (NextPageUrlParser): Next page URL parser
             item_urls (ItemUrlsParser): Item URLs parser
             item (ItemParser): Item parser.
+            page_count (PageCountParser): Page count parser for numbered pages. If given, it's used instead of the
+            next page URL parser, and pages are requested without waiting for the previous ones.
+            listing_items (ListingItemParser): Listing item parser. If given, it's used instead of the item URLs
+            parser, and items are parsed from the pages. The item parser is needed only for incomplete items.
         """
         self.next_page_url = next_page_url
         self.item_urls = item_urls
         self.item = item
+        self.page_count = page_count
+        self.listing_items = listing_items
 
 
 class SitePageCallbacks:
     """Callbacks for paging events."""
-    def __init__(self, on_paging_finished: Callable = None, on_page_finished: Callable = None):
+    def __init__(self, on_paging_finished: Callable = None, on_page_finished: Callable = None,
+                 on_item_finished: Callable = None, on_numbered_page_finished: Callable = None,
+                 on_item_failed: Callable = None):
         """
         Args:
             on_paging_finished: Called when paging is finished. Callback receives no parameter.
             on_page_finished:  Called when a page is finished. Callback gets the URL of the next page.
+            on_item_finished: Called when an item is parsed. Callback gets the URL of the item.
+            on_numbered_page_finished: Called instead of on_page_finished when a page is finished with numbered pages.
+            Callback gets the number of the page.
+            on_item_failed: Called when an item request fails. Callback gets the URL of the item, and whether it will
+            be retried. If it will, the callback also gets the request keyword arguments of the item, and the number of
+            its retries so far, which can be passed to start() to retry it after a restart.
         """
-        self.on_paging_finished = on_paging_finished if on_page_finished else self.__do_nothing_callback
+        self.on_paging_finished = on_paging_finished if on_paging_finished else self.__do_nothing_callback
         self.on_page_finished = on_page_finished if on_page_finished else self.__do_nothing_callback
+        self.on_item_finished = on_item_finished if on_item_finished else self.__do_nothing_callback
+        self.on_numbered_page_finished = on_numbered_page_finished if on_numbered_page_finished \
+            else self.__do_nothing_callback
+        self.on_item_failed = on_item_failed if on_item_failed else self.__do_nothing_callback
 
     def __do_nothing_callback(self, *args):
         pass
 
 
+class PagingStopPolicy:
+    """
+    Decides when paging is stopped early, before the last page is reached. Useful for pages sorted newest first, where
+    pages with items scraped in earlier crawls mean that the rest of the pages have no new items either.
+    """
+    def __init__(self, num_of_seen_pages: int = 1, min_seen_ratio: float = 1.0):
+        """
+        Args:
+            num_of_seen_pages: Paging is stopped after this many consecutive pages that have mostly seen items.
+            min_seen_ratio: A page has mostly seen items if the ratio of its items seen in earlier crawls is at least
+            this much (between 0 and 1).
+        """
+        self.num_of_seen_pages = num_of_seen_pages
+        self.min_seen_ratio = min_seen_ratio
+
+    def is_page_seen(self, num_of_items: int, num_of_seen_items: int) -> bool:
+        """
+        Args:
+            num_of_items: The number of items on the page.
+            num_of_seen_items: The number of items on the page that were seen in earlier crawls.
+
+        Returns: True if the page has mostly seen items.
+        """
+        return num_of_items > 0 and num_of_seen_items / num_of_items >= self.min_seen_ratio
+
+
+class ItemRetryPolicy:
+    """
+    Decides how failed item requests are retried. Failed items are queued, and retried when every other item of their
+    page is processed, or when the last page of the category is finished. Retries are delayed with exponential backoff.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, max_retries: int = 2, backoff_seconds: float = 1.0, backoff_factor: float = 2.0,
+                 max_retries_per_category: Optional[int] = None, retry_at_category_end: bool = False):
+        """
+        Args:
+            max_retries: The number of times a failed item is retried before it's given up.
+            backoff_seconds: The delay of the first retry of an item.
+            backoff_factor: The delay is multiplied by this after every retry of the same item.
+            max_retries_per_category: The number of retries allowed in a category, so a broken category can't slow
+            down the crawl for long. None means no limit.
+            retry_at_category_end: If True, pages are finished without waiting for their failed items, which are
+            retried when the last page of the category is finished. Otherwise they are retried at the end of their
+            page.
+        """
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.backoff_factor = backoff_factor
+        self.max_retries_per_category = max_retries_per_category
+        self.retry_at_category_end = retry_at_category_end
+
+    def get_delay(self, num_of_retries: int) -> float:
+        """
+        Args:
+            num_of_retries: The number of retries of the item so far.
+
+        Returns: The delay of the next retry in seconds.
+        """
+        return self.backoff_seconds * self.backoff_factor ** num_of_retries
+
+
+class ItemRetryStats:
+    """
+    Statistics of item retries.
+    Attributes:
+        num_of_retries (int): The number of retried item requests.
+        num_of_permanent_failures (int): The number of items given up, as they failed even after retries, or they
+        couldn't be retried.
+    """
+    def __init__(self):
+        self.num_of_retries = 0
+        self.num_of_permanent_failures = 0
+
+
 class SitePager:
-    """From the given start URL, it goes through its pages and parses items."""
+    """
+    From the given start URL, it goes through its pages and parses items. By default the next page is requested when
+    every item of the current page is processed. With prefetching, the next page is requested as soon as the current
+    one is parsed, while the pages are still reported as finished in page order. With numbered pages, every page is
+    requested based on the number of pages, so as many pages can be in progress at the same time as prefetching allows.
+    A page is finished as soon as its last item is processed, failed, could not be parsed, or was dropped by Scrapy's
+    duplicate filter. With a retry policy, failed items are retried before their page (or the category) is finished.
+    """
+    __ITEM_URL_BATCH_SIZE = 100
+
+    # pylint: disable=too-many-arguments
     def __init__(self, spider: Spider, request_factory: RequestFactory,
-                 site_page_parsers: SitePageParsers, site_page_callback: SitePageCallbacks = None):
+                 site_page_parsers: SitePageParsers, site_page_callback: SitePageCallbacks = None,
+                 max_prefetched_pages: int = 0, seen_item_index: SeenItemIndex = None,
+                 stop_policy: PagingStopPolicy = None, item_url_filter: BloomFilter = None,
+                 max_item_requests_in_flight: int = None, retry_policy: ItemRetryPolicy = None):
+        """
+        Args:
+            spider: The spider to which this belongs.
+            request_factory: The request factory.
+            site_page_parsers: The site page parsers.
+            site_page_callback: The callbacks for paging events.
+            max_prefetched_pages: The number of pages that can be requested ahead of the first page which still has
+            items in progress. With numbered pages, one more than this many pages can be in progress at the same time.
+            seen_item_index: If given, items seen in earlier crawls are not requested, and the parsed items are added
+            to it.
+            stop_policy: If given, paging is stopped early when the pages have mostly items seen in earlier crawls.
+            Needs a seen item index.
+            item_url_filter: If given, items already parsed in this crawl (e.g. in another category) are not requested
+            again, and the parsed items are added to it. It can be shared by more pagers.
+            max_item_requests_in_flight: If given, at most this many item requests of this pager are in progress at
+            the same time. The rest are created only when earlier ones are finished, so huge pages don't fill up the
+            scheduler.
+            retry_policy: If given, failed items are retried according to it, otherwise they are given up.
+        """
+        if stop_policy is not None and seen_item_index is None:
+            raise ValueError("Paging stop policy needs a seen item index")
         self.logger = logging.getLogger(self.__class__.__name__)
+        self.retry_stats = ItemRetryStats()
+        self.__spider = spider
         self.__request_factory = request_factory
-        self.__next_page_data = _NextPageData()
-        self.__items_counter = _ItemsCounter()
+        self.__max_prefetched_pages = max_prefetched_pages
+        self.__seen_item_index = seen_item_index
+        self.__stop_policy = stop_policy
+        self.__item_url_filter = item_url_filter
+        self.__max_item_requests_in_flight = max_item_requests_in_flight
+        self.__num_of_item_requests_in_flight = 0
+        # The outputs of the parsed pages that are not yet released because of the in-flight limit, in page order.
+        self.__page_outputs: Deque[Iterator] = deque()
+        self.__num_of_consecutive_seen_pages = 0
+        self.__retry_policy = retry_policy
+        self.__num_of_retries_in_category = 0
+        # The failed items to retry when the last page of the category is finished.
+        self.__category_retry_queue: Deque[_FailedItem] = deque()
+        # Retries waiting for their backoff delay, which Scrapy doesn't know about yet.
+        self.__num_of_scheduled_retries = 0
+        # The parsed pages, which still have items in progress or wait for an earlier page to finish, in page order.
+        self.__pages: Deque[_Page] = deque()
+        self.__last_page: Optional[_Page] = None
+        self.__skipped_item_urls: AbstractSet[str] = frozenset()
+        self.__start_page_url = None
+        self.__page_count = 0
+        self.__next_page_number = 2
+        self.__num_of_requested_pages = 0
+        self.__completed_page_numbers: AbstractSet[int] = frozenset()
         self.__site_page_callbacks = site_page_callback if site_page_callback else SitePageCallbacks()
         self.__site_page_parsers = site_page_parsers
         self.name = spider.name  # Needed to conform to Scrapy Spiders.
         spider.crawler.signals.connect(self.__spider_idle, signal=signals.spider_idle)
+        spider.crawler.signals.connect(self.__request_dropped, signal=signals.request_dropped)
 
-    def start(self, start_page_url: str) -> Request:
+    def start(self, start_page_url: str, completed_item_urls: AbstractSet[str] = frozenset(),
+              completed_page_numbers: AbstractSet[int] = frozenset(),
+              failed_items: Optional[Mapping[str, Tuple[dict, int]]] = None) -> Request:
         """
         Creates the starting request, and resets the pager. This request should be returned from spiders.
         start() can be used multiple times, but only when paging is finished!
         Args:
             start_page_url: The url of the start page.
+            completed_item_urls: The URLs of items on the start page (on any page with numbered pages) that were
+            already processed (e.g. before a restart). These are not requested again.
+            completed_page_numbers: With numbered pages, the numbers of the already processed pages. These are not
+            processed again, except that the first page is always requested for the number of pages.
+            failed_items: The request keyword arguments, and the number of retries of the items that failed, and were
+            waiting for a retry (e.g. before a restart), by their URLs. These are retried when the last page is
+            finished, and not requested with their page.
 
         Returns: The starting request.
         """
-        self.__next_page_data = _NextPageData()
-        self.__items_counter = _ItemsCounter()
+        self.__pages = deque()
+        self.__last_page = None
+        failed_items = failed_items if failed_items is not None else {}
+        self.__skipped_item_urls = frozenset(completed_item_urls) | frozenset(failed_items)
+        self.__num_of_retries_in_category = 0
+        self.__category_retry_queue = deque(_FailedItem(url, req_kwargs, num_of_retries)
+                                            for url, (req_kwargs, num_of_retries) in failed_items.items())
+        self.__start_page_url = start_page_url
+        self.__page_count = 0
+        self.__next_page_number = 2
+        self.__num_of_requested_pages = 0
+        self.__completed_page_numbers = frozenset(completed_page_numbers)
+        self.__num_of_item_requests_in_flight = 0
+        self.__page_outputs = deque()
+        self.__num_of_consecutive_seen_pages = 0
         return self.__request_factory.create(start_page_url, self.__process_page)
 
-    def __process_page(self, response):
-        self.__items_counter.success = 0
-        self.__items_counter.failed = 0
+    def __process_page(self, response, page_number: int = None):
+        if self.__site_page_parsers.page_count is not None:
+            yield from self.__process_numbered_page(response, page_number)
+            return
+        page = _Page()
         if self.__site_page_parsers.next_page_url.has_next(response):
             self.logger.info("[%s] Has next page.", self.name)
             url_data = self.__site_page_parsers.next_page_url.parse(response)
-            self.__set_next_page_data(url_data)
+            self.__set_next_page_data(page.next_page_data, url_data)
         else:
             self.logger.info("[%s] No more pages.", self.name)
-            self.__next_page_data.url = None
-            self.__next_page_data.req_kwargs = {}
-        item_requests = self.__create_next_item_requests(response)
-        self.__items_counter.total = len(item_requests)
-        for req in item_requests:
-            yield req
-
-    def __create_next_item_requests(self, page):
-        urls = self.__site_page_parsers.item_urls.parse(page)
-        requests = []
-        for url_data in urls:
-            url = url_data
-            req_kwargs = {}
-            if isinstance(url_data, tuple):
-                url = url_data[0]
-                req_kwargs = url_data[1]
-            requests.append(
-                self.__request_factory.create(
-                    url, self.__process_item, errback=self.__process_item_failure, **req_kwargs)
-            )
+        # Completed items are known only for the start page.
+        skipped_item_urls = self.__skipped_item_urls
+        self.__skipped_item_urls = frozenset()
+        self.__pages.append(page)
+        self.__last_page = page
+        yield from self.__limit_item_requests(self.__iter_page_output(response, page, skipped_item_urls))
+        # Finishes the page if it has no items, otherwise prefetches the next page if possible.
+        next_request = self.__finish_pages()
+        if next_request:
+            yield next_request
+
+    def __process_numbered_page(self, response, page_number: Optional[int]):
+        if page_number is None:
+            page_number = 1
+            self.__page_count = self.__site_page_parsers.page_count.parse(response)
+            self.logger.info("[%s] Number of pages: %d", self.name, self.__page_count)
+        else:
+            self.__num_of_requested_pages -= 1
+        page = _Page(page_number)
+        self.__pages.append(page)
+        if page_number in self.__completed_page_numbers:
+            page.is_parsed = True
+        else:
+            yield from self.__limit_item_requests(
+                self.__iter_page_output(response, page, self.__skipped_item_urls))
+        for next_request in self.__finish_numbered_pages():
+            if next_request:
+                yield next_request
+
+    def __iter_page_output(self, response, page: '_Page', skipped_item_urls: AbstractSet[str]):
+        # Yields the items parsed from the page, and the requests of the items while their URLs are parsed, so the
+        # number of items doesn't have to be known in advance. The page can be finished only when it's parsed.
+        if self.__site_page_parsers.listing_items is None:
+            items_or_url_data = self.__site_page_parsers.item_urls.parse(response)
+        else:
+            items_or_url_data = self.__site_page_parsers.listing_items.parse(response)
+        num_of_listing_items = 0
+        urls_and_kwargs = []
+        for item_or_url_data in items_or_url_data:
+            if isinstance(item_or_url_data, str):
+                urls_and_kwargs.append((item_or_url_data, {}))
+            elif isinstance(item_or_url_data, tuple):
+                urls_and_kwargs.append(item_or_url_data)
+            else:
+                num_of_listing_items += 1
+                yield item_or_url_data
+            if len(urls_and_kwargs) >= self.__ITEM_URL_BATCH_SIZE:
+                yield from self.__create_next_item_requests(urls_and_kwargs, page, skipped_item_urls)
+                urls_and_kwargs = []
+        yield from self.__create_next_item_requests(urls_and_kwargs, page, skipped_item_urls)
+        page.is_parsed = True
+        self.logger.info("[%s] Page parsed: %d item(s) from the page, %d item request(s), %d skipped item(s).",
+                         self.name, num_of_listing_items, page.items_counter.total, page.num_of_skipped_item_urls)
+        self.__stop_if_due(page)
+        # Items may have failed while the page was parsed.
+        self.__retry_failed_items_if_due(page)
+
+    def __limit_item_requests(self, page_output: Iterator) -> Iterable:
+        if self.__max_item_requests_in_flight is None:
+            return page_output
+        self.__page_outputs.append(page_output)
+        return self.__release_page_outputs()
+
+    def __release_page_outputs(self) -> list:
+        # Parses the pages further until the limit of item requests in flight is reached.
+        released_outputs = []
+        while self.__page_outputs and self.__num_of_item_requests_in_flight < self.__max_item_requests_in_flight:
+            output = next(self.__page_outputs[0], None)
+            if output is None:
+                self.__page_outputs.popleft()
+                continue
+            if isinstance(output, Request):
+                self.__num_of_item_requests_in_flight += 1
+            released_outputs.append(output)
+        return released_outputs
+
+    def __stop_if_due(self, page: '_Page'):
+        if not self.__is_stop_due(page):
+            return
+        if page.number is None and page.next_page_data.url:
+            page.next_page_data = _NextPageData()
+        elif page.number is not None and self.__next_page_number <= self.__page_count:
+            self.__next_page_number = self.__page_count + 1
+        else:
+            return
+        self.logger.info("[%s] Stopping paging, as the last %d page(s) had mostly seen items.",
+                         self.name, self.__num_of_consecutive_seen_pages)
+
+    def __create_next_item_requests(self, urls_and_kwargs: List[Tuple[str, dict]], page: '_Page',
+                                    skipped_item_urls: AbstractSet[str]) -> List[Request]:
+        num_of_urls = len(urls_and_kwargs)
+        if skipped_item_urls:
+            urls_and_kwargs = [(url, req_kwargs) for url, req_kwargs in urls_and_kwargs
+                               if url not in skipped_item_urls]
+        if self.__item_url_filter is not None:
+            num_of_not_duplicate_urls = len(urls_and_kwargs)
+            urls_and_kwargs = [(url, req_kwargs) for url, req_kwargs in urls_and_kwargs
+                               if url not in self.__item_url_filter]
+            page.items_counter.skipped += num_of_not_duplicate_urls - len(urls_and_kwargs)
+        if self.__seen_item_index is not None and urls_and_kwargs:
+            seen_urls = set(self.__seen_item_index.filter_seen(url for url, _ in urls_and_kwargs))
+            page.num_of_item_urls += len(urls_and_kwargs)
+            page.num_of_seen_item_urls += len(seen_urls)
+            if seen_urls:
+                urls_and_kwargs = [(url, req_kwargs) for url, req_kwargs in urls_and_kwargs if url not in seen_urls]
+        page.num_of_skipped_item_urls += num_of_urls - len(urls_and_kwargs)
+        requests = [self.__create_item_request(url, req_kwargs, page) for url, req_kwargs in urls_and_kwargs]
+        page.items_counter.total += len(requests)
         return requests
 
-    def __process_item(self, response):
-        yield self.__site_page_parsers.item.parse(response)
-        self.__items_counter.success += 1
-        yield self.__on_item_event()
-
-    def __process_item_failure(self, _):
-        self.logger.warning("[%s] Failed to get an item!", self.name)
-        self.__items_counter.failed += 1
-
-    def __on_item_event(self):
-        progress = self.__items_counter.success + self.__items_counter.failed
-        self.logger.info("[%s] Item progress in current page: %3d [OK] / %3d [FAILED] / %3d [TOTAL]",
-                         self.name, self.__items_counter.success, self.__items_counter.failed,
-                         self.__items_counter.total)
-        if progress == self.__items_counter.total:
-            self.logger.info("[%s] All items processed in current page. Checking if there's more work to do.",
-                             self.name)
-            if self.__next_page_data.url:
-                self.logger.info("[%s] Going to next page", self.name)
-                self.__site_page_callbacks.on_page_finished(self.__next_page_data.url)
-                return self.__request_factory.create(
-                    self.__next_page_data.url, self.__process_page, **self.__next_page_data.req_kwargs)
+    def __create_item_request(self, url: str, req_kwargs: dict, page: '_Page', num_of_retries: int = 0) -> Request:
+        # Retried requests were already seen by the duplicate filter. The kwargs of the failure are kept as given, so
+        # they can be saved, and used for the request again.
+        request_kwargs = dict(req_kwargs, dont_filter=True) if num_of_retries > 0 else req_kwargs
+        return self.__request_factory.create(
+            url, functools.partial(self.__process_item, page=page, item_url=url),
+            errback=functools.partial(self.__process_item_failure, page=page, item_url=url, req_kwargs=req_kwargs,
+                                      num_of_retries=num_of_retries),
+            **request_kwargs)
+
+    def __process_item(self, response, page: '_Page', item_url: str):
+        try:
+            item = self.__site_page_parsers.item.parse(response)
+        except Exception:  # pylint: disable=broad-except
+            # Errbacks don't get the errors of callbacks. The same response would fail again, so it's not retried.
+            self.logger.exception("[%s] Failed to parse an item: %s", self.name, item_url)
+            self.__give_up_item(page, item_url)
+        else:
+            # The parser may drop the item by returning None, but the item is still processed.
+            if item is not None:
+                yield item
+            page.items_counter.success += 1
+            if self.__item_url_filter is not None:
+                self.__item_url_filter.add(item_url)
+            if self.__seen_item_index is not None:
+                self.__seen_item_index.add(item_url)
+            self.__site_page_callbacks.on_item_finished(item_url)
+        yield from self.__on_item_request_finished()
+        yield self.__on_item_event(page)
+
+    # pylint: disable=too-many-arguments
+    def __process_item_failure(self, _, page: '_Page', item_url: str, req_kwargs: dict, num_of_retries: int):
+        if self.__can_retry(num_of_retries):
+            self.logger.warning("[%s] Failed to get an item, it will be retried: %s", self.name, item_url)
+            self.__num_of_retries_in_category += 1
+            failed_item = _FailedItem(item_url, req_kwargs, num_of_retries)
+            if self.__retry_policy.retry_at_category_end and not page.is_category_retry_page:
+                page.items_counter.failed += 1
+                self.__category_retry_queue.append(failed_item)
+            else:
+                page.retry_queue.append(failed_item)
+            self.__site_page_callbacks.on_item_failed(item_url, True, req_kwargs, num_of_retries)
+        else:
+            self.logger.warning("[%s] Failed to get an item: %s", self.name, item_url)
+            self.__give_up_item(page, item_url)
+        next_requests = self.__on_item_request_finished()
+        # The page may be finished by the failed item, so its next request is returned right away.
+        next_request = self.__on_item_event(page)
+        if next_request:
+            next_requests.append(next_request)
+        return next_requests
+
+    def __give_up_item(self, page: '_Page', item_url: str):
+        page.items_counter.failed += 1
+        self.retry_stats.num_of_permanent_failures += 1
+        self.__site_page_callbacks.on_item_failed(item_url, False)
+
+    def __request_dropped(self, request: Request, spider):  # pylint: disable=unused-argument
+        # Scrapy's duplicate filter drops requests without calling their callback or errback.
+        callback = request.callback
+        if not isinstance(callback, functools.partial) or callback.func != self.__process_item:
+            return
+        page = callback.keywords["page"]
+        self.logger.info("[%s] Item request dropped as duplicate: %s", self.name, request.url)
+        page.items_counter.total -= 1
+        page.items_counter.skipped += 1
+        outputs = self.__on_item_request_finished()
+        outputs.append(self.__on_item_event(page))
+        # There's no callback to return the outputs from, so the items are passed to the item pipelines right away,
+        # even if paging is finished by this request.
+        for output in outputs:
+            if isinstance(output, Request):
+                self.__spider.crawler.engine.crawl(output)
+            elif output is not None:
+                self.__process_item_without_callback(output)
+
+    def __process_item_without_callback(self, item):
+        scraper = self.__spider.crawler.engine.scraper
+        if hasattr(scraper, "start_itemproc_async"):
+            # Scrapy 2.14 and later.
+            deferred_from_coro(scraper.start_itemproc_async(item, response=None))
+        else:
+            scraper.start_itemproc(item, response=None)
+
+    def __can_retry(self, num_of_retries: int) -> bool:
+        if self.__retry_policy is None or num_of_retries >= self.__retry_policy.max_retries:
+            return False
+        max_retries_per_category = self.__retry_policy.max_retries_per_category
+        return max_retries_per_category is None or self.__num_of_retries_in_category < max_retries_per_category
+
+    def __retry_failed_items_if_due(self, page: '_Page'):
+        # Failed items are retried together, when every other item of the page is processed.
+        counter = page.items_counter
+        if not page.retry_queue or not page.is_parsed \
+                or counter.success + counter.failed + len(page.retry_queue) != counter.total:
+            return
+        # Imported here, so importing this module doesn't install a reactor.
+        from twisted.internet import reactor  # pylint: disable=import-outside-toplevel
+        while page.retry_queue:
+            failed_item = page.retry_queue.popleft()
+            delay = self.__retry_policy.get_delay(failed_item.num_of_retries) if self.__retry_policy else 0
+            self.logger.info("[%s] Retrying item in %.1f second(s): %s", self.name, delay, failed_item.url)
+            self.__num_of_scheduled_retries += 1
+            reactor.callLater(delay, self.__crawl_retry, failed_item, page)
+
+    def __crawl_retry(self, failed_item: '_FailedItem', page: '_Page'):
+        self.__num_of_scheduled_retries -= 1
+        self.retry_stats.num_of_retries += 1
+        if self.__max_item_requests_in_flight is not None:
+            self.__num_of_item_requests_in_flight += 1
+        request = self.__create_item_request(failed_item.url, failed_item.req_kwargs, page,
+                                             failed_item.num_of_retries + 1)
+        self.__spider.crawler.engine.crawl(request)
+
+    def __create_category_retry_page(self) -> '_Page':
+        # The failed items of the category are retried as if they were on an extra page after the last one.
+        page = _Page()
+        page.is_category_retry_page = True
+        page.is_parsed = True
+        page.items_counter.total = len(self.__category_retry_queue)
+        page.retry_queue = self.__category_retry_queue
+        self.__category_retry_queue = deque()
+        self.logger.info("[%s] Retrying %d failed item(s) of the category.", self.name, page.items_counter.total)
+        self.__retry_failed_items_if_due(page)
+        return page
+
+    def __on_item_request_finished(self) -> list:
+        if self.__max_item_requests_in_flight is None:
+            return []
+        self.__num_of_item_requests_in_flight -= 1
+        return self.__release_page_outputs()
+
+    def __on_item_event(self, page: '_Page'):
+        self.__retry_failed_items_if_due(page)
+        self.logger.info("[%s] Item progress in page: %3d [OK] / %3d [FAILED] / %3d [TOTAL] (%d [DUPLICATE])",
+                         self.name, page.items_counter.success, page.items_counter.failed, page.items_counter.total,
+                         page.items_counter.skipped)
+        if self.__site_page_parsers.page_count is not None:
+            # Only this page is finished, so at most one more page can be requested.
+            next_requests = self.__finish_numbered_pages(max_num_of_requests=1)
+            return next_requests[0] if next_requests else None
+        return self.__finish_pages()
+
+    def __is_stop_due(self, page: '_Page') -> bool:
+        if self.__stop_policy is None:
+            return False
+        if self.__stop_policy.is_page_seen(page.num_of_item_urls, page.num_of_seen_item_urls):
+            self.__num_of_consecutive_seen_pages += 1
+        else:
+            self.__num_of_consecutive_seen_pages = 0
+        return self.__num_of_consecutive_seen_pages >= self.__stop_policy.num_of_seen_pages
+
+    def __finish_pages(self):
+        # Pages are finished in page order, even if items of a later page are processed earlier.
+        while self.__pages and self.__pages[0].is_finished():
+            page = self.__pages.popleft()
+            self.logger.info("[%s] All items processed in page. Checking if there's more work to do.", self.name)
+            if page.next_page_data.url:
+                self.__site_page_callbacks.on_page_finished(page.next_page_data.url)
+            elif self.__category_retry_queue:
+                self.__pages.append(self.__create_category_retry_page())
             else:
                 self.logger.info("[%s] No more pages.", self.name)
                 return self.__site_page_callbacks.on_paging_finished()
-        return None
-
-    def __spider_idle(self, spider):
-        # It happens when the last item request fails.
-        self.logger.warning("Got spider idle!")
-        next_req = self.__on_item_event()
-        if next_req:
-            # The request has to be 'manually' inserted.
-            next_req.dont_filter = True
-            spider.crawler.engine.crawl(next_req, spider)
-            raise exceptions.DontCloseSpider("Got spider idle, but there's more work to do!")
-
-    def __set_next_page_data(self, url_data):
+        next_page_request = self.__create_next_page_request_if_possible()
+        if next_page_request:
+            self.logger.info("[%s] Going to next page", self.name)
+        return next_page_request
+
+    def __finish_numbered_pages(self, max_num_of_requests: int = None) -> List[Optional[Request]]:
+        # Pages are finished in any order, the spider keeps track of the finished page numbers.
+        for page in [page for page in self.__pages if page.is_finished()]:
+            self.__pages.remove(page)
+            if not page.is_category_retry_page:
+                self.__site_page_callbacks.on_numbered_page_finished(page.number)
+        next_requests = []
+        while self.__next_page_number <= self.__page_count \
+                and len(self.__pages) + self.__num_of_requested_pages <= self.__max_prefetched_pages \
+                and (max_num_of_requests is None or len(next_requests) < max_num_of_requests):
+            page_number = self.__next_page_number
+            self.__next_page_number += 1
+            if page_number in self.__completed_page_numbers:
+                continue
+            next_page_data = _NextPageData()
+            self.__set_next_page_data(
+                next_page_data, self.__site_page_parsers.page_count.build_url(self.__start_page_url, page_number))
+            next_requests.append(self.__request_factory.create(
+                next_page_data.url, functools.partial(self.__process_page, page_number=page_number),
+                **next_page_data.req_kwargs))
+            self.__num_of_requested_pages += 1
+        if not self.__pages and self.__num_of_requested_pages == 0 and self.__next_page_number > self.__page_count:
+            if self.__category_retry_queue:
+                self.__pages.append(self.__create_category_retry_page())
+                return next_requests
+            self.logger.info("[%s] No more pages.", self.name)
+            return [self.__site_page_callbacks.on_paging_finished()]
+        return next_requests
+
+    def __create_next_page_request_if_possible(self):
+        last_page = self.__last_page
+        if last_page is None or not last_page.is_parsed or last_page.is_next_page_requested \
+                or not last_page.next_page_data.url \
+                or len(self.__pages) > self.__max_prefetched_pages:
+            return None
+        last_page.is_next_page_requested = True
+        return self.__request_factory.create(
+            last_page.next_page_data.url, self.__process_page, **last_page.next_page_data.req_kwargs)
+
+    def __spider_idle(self, spider):  # pylint: disable=unused-argument
+        # Nothing else may be in progress while retries wait for their backoff delay.
+        if self.__num_of_scheduled_retries > 0:
+            raise exceptions.DontCloseSpider("Item retries are scheduled.")
+
+    @staticmethod
+    def __set_next_page_data(next_page_data: '_NextPageData', url_data):
         if isinstance(url_data, tuple):
-            self.__next_page_data.url = url_data[0]
-            self.__next_page_data.req_kwargs = url_data[1]
+            next_page_data.url = url_data[0]
+            next_page_data.req_kwargs = url_data[1]
         else:
-            self.__next_page_data.url = url_data
+            next_page_data.url = url_data
 
 
 class _ItemsCounter:
     def __init__(self):
+        # Duplicate items are not requested, so they are not part of the total.
         self.total = 0
         self.success = 0
         self.failed = 0
+        self.skipped = 0
 
 
 class _NextPageData:
     def __init__(self):
         self.url = None
         self.req_kwargs = {}
+
+
+class _FailedItem:
+    def __init__(self, url: str, req_kwargs: dict, num_of_retries: int):
+        self.url = url
+        self.req_kwargs = req_kwargs
+        self.num_of_retries = num_of_retries
+
+
+class _Page:
+    def __init__(self, number: int = None):
+        self.number = number
+        self.items_counter = _ItemsCounter()
+        self.next_page_data = _NextPageData()
+        self.is_next_page_requested = False
+        self.num_of_item_urls = 0
+        self.num_of_seen_item_urls = 0
+        self.num_of_skipped_item_urls = 0
+        self.is_parsed = False
+        self.is_category_retry_page = False
+        # The failed items of the page waiting to be retried, which are not counted as failed yet.
+        self.retry_queue: Deque[_FailedItem] = deque()
+
+    def is_finished(self) -> bool:
+        return self.is_parsed and self.items_counter.success + self.items_counter.failed == self.items_counter.total
@@ -1,12 +1,13 @@
 """Contains the site structure discoverer spiderling."""
 import logging
-from typing import List, Tuple, Callable, Optional
+from collections import deque
+from typing import List, Tuple, Callable, Optional, Union, Deque, Iterator
 
 from scrapy import Spider, Request
 from scrapy.http import Response
 
 from scrapy_patterns.request_factory import RequestFactory
-from scrapy_patterns.site_structure import SiteStructure
+from scrapy_patterns.site_structure import SiteStructure, Node, visit_state_counts_to_str
 
 
 class CategoryParser:
@@ -23,11 +24,24 @@ class CategoryParser:
 
 
 class SiteStructureDiscoverer:
-    """Discovers the site structure."""
+    """
+    Discovers the site structure. The number of category requests in progress, the number of discovered levels, and
+    the number of discovered categories can be limited. Leaf categories can be reported as soon as they are discovered,
+    so they can be processed while the rest of the structure is still being discovered.
+    With a known structure (e.g. from an earlier crawl), only the upper levels are discovered again, and the
+    sub-categories of the categories that are still there are taken from the known structure. New categories are
+    discovered fully, and removed ones are left out.
+    """
     # pylint: disable=too-many-arguments, too-many-instance-attributes
     def __init__(self, spider: Spider, start_url: str, category_parsers: List[CategoryParser],
                  request_factory: RequestFactory,
-                 on_discovery_complete: Callable[['SiteStructureDiscoverer'], Optional[Request]] = None):
+                 on_discovery_complete: Callable[['SiteStructureDiscoverer'],
+                                                 Union[Optional[Request], List[Request]]] = None,
+                 site_structure_class: type = SiteStructure, max_concurrent_requests: Optional[int] = None,
+                 max_depth: Optional[int] = None, max_categories: Optional[int] = None,
+                 on_leaf_discovered: Callable[['SiteStructureDiscoverer', Node],
+                                              Union[Optional[Request], List[Request]]] = None,
+                 known_structure=None, refresh_depth: int = 1, log_structure: bool = False):
         """
         Args:
             spider: The spider to which this belongs.
@@ -36,16 +50,49 @@ class SiteStructureDiscoverer:
                               parse the leaf categories.
             request_factory: The request factory.
             on_discovery_complete: An optional callback when the discovery is complete. It'll receive this discoverer
-            as its argument. It should return a scrapy request to continue the scraping with.
+            as its argument. It should return a scrapy request, or a list of requests to continue the scraping with.
+            site_structure_class: The class of the discovered structure (e.g. ColumnarSiteStructure for very large
+            sites).
+            max_concurrent_requests: If given, at most this many category requests are in progress at the same time,
+            independently of other requests of the spider.
+            max_depth: If given, at most this many levels of categories are discovered; categories on the last
+            discovered level are leaves.
+            max_categories: If given, at most this many categories are discovered; the rest are ignored.
+            on_leaf_discovered: An optional callback when a leaf category is discovered. It'll receive this discoverer,
+            and the node of the category as its arguments. It should return a scrapy request, or a list of requests to
+            continue the scraping with, as discovery goes on in the meantime.
+            known_structure: If given, the sub-categories below the refreshed levels are taken from it, when it has
+            the same category.
+            refresh_depth: The number of upper levels discovered again when there's a known structure.
+            log_structure: Whether to log the whole structure when discovery is complete. Otherwise only the number of
+            categories is logged, as rendering large structures is slow.
         """
         self.logger = logging.getLogger(self.__class__.__name__)
         self.name = spider.name  # Needed to conform to Scrapy Spiders.
-        self.structure = SiteStructure(self.name)
+        self.structure = site_structure_class(self.name)
         self.__start_url = start_url
         self.__category_parsers = category_parsers
         self.__request_factory = request_factory
         self.__remaining_work = 0
         self.__on_discovery_complete = on_discovery_complete if on_discovery_complete else self.__do_nothing
+        self.__on_leaf_discovered = on_leaf_discovered
+        self.__max_concurrent_requests = max_concurrent_requests
+        self.__num_of_requests_in_flight = 0
+        # The category requests not yet released because of the concurrency limit, in discovery order.
+        self.__pending_requests: Deque[Request] = deque()
+        self.__max_depth = max_depth
+        self.__max_categories = max_categories
+        self.__num_of_categories = 0
+        self.__is_complete = False
+        self.__known_structure = known_structure
+        self.__refresh_depth = refresh_depth
+        self.__num_of_known_categories = 0
+        self.__log_structure = log_structure
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether the discovery is complete."""
+        return self.__is_complete
 
     def create_start_request(self):
         """
@@ -53,22 +100,48 @@ class SiteStructureDiscoverer:
         Returns: The starting request.
         """
         self.__remaining_work += 1
-        return self.__request_factory.create(self.__start_url, self.__process_category_response,
-                                             cb_kwargs={"category_index": 0, "path": None})
+        self.__num_of_requests_in_flight += 1
+        return self.__create_request(self.__start_url, 0, None)
+
+    def __create_request(self, url: str, category_index: int, path: Optional[str]) -> Request:
+        return self.__request_factory.create(url, self.__process_category_response,
+                                             cb_kwargs={"category_index": category_index, "path": path},
+                                             errback=self.__process_category_failure)
 
     def __process_category_response(self, response, category_index: int, path: str):
-        self.__remaining_work -= 1
         category_parser = self.__category_parsers[category_index]
         urls_and_names = self.__get_urls_and_names(response, category_parser)
-        requests = self.__prepare_requests(urls_and_names, path, category_index)
+        requests, leaves = self.__prepare_requests(urls_and_names, path, category_index)
+        if path is not None and not self.structure.get_node_at_path(path).children:
+            # A category without sub-categories is a leaf, even if it's not on the last level.
+            leaves.append(self.structure.get_node_at_path(path))
         self.__remaining_work += len(requests)
+        self.__pending_requests.extend(requests)
+        if self.__on_leaf_discovered is not None:
+            for leaf in leaves:
+                yield from self.__to_list(self.__on_leaf_discovered(self, leaf))
+        yield from self.__on_request_finished()
+
+    def __process_category_failure(self, failure):
+        self.logger.warning("[%s] Failed to get a category: %s", self.name, failure)
+        return list(self.__on_request_finished())
+
+    def __on_request_finished(self) -> Iterator[Request]:
+        self.__remaining_work -= 1
+        self.__num_of_requests_in_flight -= 1
         self.logger.info("[%s] Remaining work(s): %d", self.name, self.__remaining_work)
         if self.__remaining_work == 0:
-            self.logger.info("[%s] Discovery complete.\n"
-                             "%s", self.name, str(self.structure))
-            yield self.__on_discovery_complete(self)
-        for req in requests:
-            yield req
+            self.__is_complete = True
+            self.logger.info("[%s] Discovery complete, %d categories taken from the known structure. Categories: %s",
+                             self.name, self.__num_of_known_categories, visit_state_counts_to_str(self.structure))
+            if self.__log_structure:
+                # The structure is passed as is, so it's only rendered when the record is emitted.
+                self.logger.info("[%s] Discovered structure:\n%s", self.name, self.structure)
+            yield from self.__to_list(self.__on_discovery_complete(self))
+        while self.__pending_requests and (self.__max_concurrent_requests is None
+                                           or self.__num_of_requests_in_flight < self.__max_concurrent_requests):
+            self.__num_of_requests_in_flight += 1
+            yield self.__pending_requests.popleft()
 
     @staticmethod
     def __get_urls_and_names(response: Response, category_parser: CategoryParser):
@@ -78,14 +151,52 @@ class SiteStructureDiscoverer:
     def __do_nothing(_):
         return None
 
-    def __prepare_requests(self, urls_and_names: List[Tuple[str, str]], current_path: str, category_index: int):
+    @staticmethod
+    def __to_list(requests: Union[Optional[Request], List[Request]]) -> List[Request]:
+        if isinstance(requests, list):
+            return requests
+        return [requests] if requests is not None else []
+
+    def __prepare_requests(self, urls_and_names: List[Tuple[str, str]], current_path: str,
+                           category_index: int) -> Tuple[List[Request], List[Node]]:
         requests = []
+        leaves = []
         for url, name in urls_and_names:
             structure_path = self.__determine_structure_path(current_path, name)
-            is_added = self.__try_add_path(structure_path, url)
-            if is_added:
-                self.__append_to_requests_if_not_finished(category_index, requests, (url, structure_path))
-        return requests
+            node = self.__try_add_path(structure_path, url)
+            if node is None:
+                continue
+            if self.__is_last_level(category_index):
+                leaves.append(node)
+            elif not self.__try_add_known_sub_categories(structure_path, category_index, leaves):
+                requests.append(self.__create_request(url, category_index + 1, structure_path))
+        return requests, leaves
+
+    def __try_add_known_sub_categories(self, path: str, category_index: int, leaves: List[Node]) -> bool:
+        if self.__known_structure is None or category_index + 1 < self.__refresh_depth:
+            return False
+        known_node = self.__known_structure.get_node_at_path(path)
+        if known_node is None or not known_node.children:
+            # A new category, or one that may have got sub-categories since.
+            return False
+        known_nodes_to_add = [(child, path) for child in reversed(known_node.children)]
+        while known_nodes_to_add:
+            known_node, parent_path = known_nodes_to_add.pop()
+            node = self.__try_add_path(parent_path + "/" + known_node.name, known_node.url)
+            if node is None:
+                continue
+            self.__num_of_known_categories += 1
+            if known_node.children:
+                known_nodes_to_add.extend((child, node.get_path()) for child in reversed(known_node.children))
+            else:
+                leaves.append(node)
+        return True
+
+    def __is_last_level(self, category_index: int) -> bool:
+        num_of_levels = len(self.__category_parsers)
+        if self.__max_depth is not None:
+            num_of_levels = min(num_of_levels, self.__max_depth)
+        return category_index + 1 >= num_of_levels
 
     @staticmethod
     def __determine_structure_path(current_path, name):
@@ -94,18 +205,12 @@ class SiteStructureDiscoverer:
         else:
             return current_path + "/" + name
 
-    def __try_add_path(self, path: str, url: str) -> bool:
+    def __try_add_path(self, path: str, url: str) -> Optional[Node]:
         if self.structure.get_node_at_path(path) is not None:
-            self.logger.warning("Path \"path\" already exists; path to add is ignored!")
-            return False
-        else:
-            self.structure.add_node_with_path(path, url)
-            return True
-
-    def __append_to_requests_if_not_finished(self, category_index: int, requests: List[Request],
-                                             url_and_path: Tuple[str, str]):
-        if category_index + 1 < len(self.__category_parsers):
-            request = self.__request_factory.create(
-                url_and_path[0], self.__process_category_response,
-                cb_kwargs={"category_index": category_index + 1, "path": url_and_path[1]})
-            requests.append(request)
+            self.logger.warning("Path \"%s\" already exists; path to add is ignored!", path)
+            return None
+        if self.__max_categories is not None and self.__num_of_categories >= self.__max_categories:
+            self.logger.warning("Category limit reached; path \"%s\" is ignored!", path)
+            return None
+        self.__num_of_categories += 1
+        return self.structure.add_node_with_path(path, url)
@@ -0,0 +1,195 @@
+"""Contains the sitemap based site structure discoverer spiderling."""
+import io
+import gzip
+import logging
+from xml.etree import ElementTree
+from typing import List, Tuple, Callable, Optional, Union, Iterator
+
+from scrapy import Spider, Request
+
+from scrapy_patterns.request_factory import RequestFactory
+from scrapy_patterns.site_structure import SiteStructure, visit_state_counts_to_str
+
+
+class SitemapCategoryParser:
+    """Interface used for telling the categories from the URLs listed in sitemaps."""
+    def parse(self, url: str) -> Optional[List[Tuple[str, str]]]:
+        """
+        Args:
+            url: A URL listed in a sitemap.
+
+        Returns: None if the URL is not the URL of a category. Otherwise the categories along the path from the main
+        category to the category of the URL, as tuples, where the first element is the URL of the category, and the
+        second is the name.
+        """
+        raise NotImplementedError()
+
+
+class UrlPathCategoryParser(SitemapCategoryParser):
+    """
+    Tells the categories from the paths of the URLs, for sites where the category pages are under a common prefix. For
+    example with the prefix https://some-shop.com/categories, https://some-shop.com/categories/animals/fish is the
+    category "fish" under the main category "animals".
+    """
+    def __init__(self, url_prefix: str):
+        """
+        Args:
+            url_prefix: The common prefix of the category URLs.
+        """
+        self.__url_prefix = url_prefix.rstrip("/")
+
+    def parse(self, url: str) -> Optional[List[Tuple[str, str]]]:
+        if not url.startswith(self.__url_prefix + "/"):
+            return None
+        path = url[len(self.__url_prefix):].split("?")[0].split("#")[0].strip("/")
+        if not path:
+            return None
+        urls_and_names = []
+        category_url = self.__url_prefix
+        for name in path.split("/"):
+            category_url += "/" + name
+            urls_and_names.append((category_url, name))
+        return urls_and_names
+
+
+class SitemapStructureDiscoverer:
+    """
+    Discovers the site structure from sitemaps, instead of going through the category pages level by level. Sitemap
+    indexes are followed, gzipped sitemaps are decompressed, and sitemaps are parsed incrementally, so neither the
+    decompressed sitemap, nor its XML tree is kept in memory as a whole.
+    """
+    # pylint: disable=too-many-arguments, too-many-instance-attributes
+    def __init__(self, spider: Spider, sitemap_urls: List[str], category_parser: SitemapCategoryParser,
+                 request_factory: RequestFactory,
+                 on_discovery_complete: Callable[['SitemapStructureDiscoverer'],
+                                                 Union[Optional[Request], List[Request]]] = None,
+                 site_structure_class: type = SiteStructure, max_categories: Optional[int] = None,
+                 log_structure: bool = False):
+        """
+        Args:
+            spider: The spider to which this belongs.
+            sitemap_urls: The URLs of the sitemaps, or sitemap indexes.
+            category_parser: Tells the categories from the URLs listed in the sitemaps.
+            request_factory: The request factory.
+            on_discovery_complete: An optional callback when the discovery is complete. It'll receive this discoverer
+            as its argument. It should return a scrapy request, or a list of requests to continue the scraping with.
+            site_structure_class: The class of the discovered structure (e.g. ColumnarSiteStructure for very large
+            sites).
+            max_categories: If given, at most this many categories are discovered; the rest are ignored.
+            log_structure: Whether to log the whole structure when discovery is complete. Otherwise only the number of
+            categories is logged, as rendering large structures is slow.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.name = spider.name  # Needed to conform to Scrapy Spiders.
+        self.structure = site_structure_class(self.name)
+        self.__sitemap_urls = sitemap_urls
+        self.__category_parser = category_parser
+        self.__request_factory = request_factory
+        self.__on_discovery_complete = on_discovery_complete if on_discovery_complete else self.__do_nothing
+        self.__max_categories = max_categories
+        self.__num_of_categories = 0
+        self.__remaining_work = 0
+        self.__is_complete = False
+        self.__log_structure = log_structure
+
+    @property
+    def is_complete(self) -> bool:
+        """Whether the discovery is complete."""
+        return self.__is_complete
+
+    def create_start_requests(self) -> List[Request]:
+        """
+        Creates the starting requests.
+        Returns: The requests of the sitemaps.
+        """
+        self.__remaining_work += len(self.__sitemap_urls)
+        return [self.__create_request(url) for url in self.__sitemap_urls]
+
+    def __create_request(self, url: str) -> Request:
+        return self.__request_factory.create(url, self.__process_sitemap_response,
+                                             errback=self.__process_sitemap_failure)
+
+    def __process_sitemap_response(self, response):
+        requests = []
+        num_of_urls = 0
+        try:
+            for element_name, url in self.__iter_sitemap_urls(response.body):
+                if element_name == "sitemap":
+                    requests.append(self.__create_request(url))
+                else:
+                    num_of_urls += 1
+                    self.__add_categories(url)
+        except (ElementTree.ParseError, OSError, EOFError) as error:
+            # The URLs parsed before the error are kept.
+            self.logger.error("[%s] Failed to parse sitemap %s: %s", self.name, response.url, error)
+        self.logger.info("[%s] Sitemap parsed: %s, %d URL(s), %d sitemap(s).", self.name, response.url, num_of_urls,
+                         len(requests))
+        self.__remaining_work += len(requests)
+        yield from self.__on_request_finished()
+        yield from requests
+
+    def __process_sitemap_failure(self, failure):
+        self.logger.warning("[%s] Failed to get a sitemap: %s", self.name, failure)
+        return list(self.__on_request_finished())
+
+    def __on_request_finished(self) -> Iterator[Request]:
+        self.__remaining_work -= 1
+        if self.__remaining_work > 0:
+            return
+        self.__is_complete = True
+        self.logger.info("[%s] Discovery complete. Categories: %s", self.name,
+                         visit_state_counts_to_str(self.structure))
+        if self.__log_structure:
+            # The structure is passed as is, so it's only rendered when the record is emitted.
+            self.logger.info("[%s] Discovered structure:\n%s", self.name, self.structure)
+        next_requests = self.__on_discovery_complete(self)
+        if isinstance(next_requests, list):
+            yield from next_requests
+        elif next_requests is not None:
+            yield next_requests
+
+    @staticmethod
+    def __iter_sitemap_urls(body: bytes) -> Iterator[Tuple[str, str]]:
+        # Yields the name of the element ("url", or "sitemap" in sitemap indexes), and its location.
+        stream = io.BytesIO(body)
+        if body[:2] == b"\x1f\x8b":
+            stream = gzip.GzipFile(fileobj=stream)
+        root = None
+        for event, element in ElementTree.iterparse(stream, events=("start", "end")):
+            if root is None:
+                root = element
+            if event != "end":
+                continue
+            element_name = _local_name(element.tag)
+            if element_name not in ("url", "sitemap"):
+                continue
+            for child in element:
+                if _local_name(child.tag) == "loc" and child.text:
+                    yield element_name, child.text.strip()
+                    break
+            # The processed elements are dropped, so the tree doesn't grow.
+            root.clear()
+
+    def __add_categories(self, url: str):
+        urls_and_names = self.__category_parser.parse(url)
+        if not urls_and_names:
+            return
+        path = None
+        for category_url, name in urls_and_names:
+            path = name if path is None else path + "/" + name
+            if self.structure.get_node_at_path(path) is not None:
+                continue
+            if self.__max_categories is not None and self.__num_of_categories >= self.__max_categories:
+                self.logger.warning("Category limit reached; path \"%s\" is ignored!", path)
+                return
+            self.structure.add_node_with_path(path, category_url)
+            self.__num_of_categories += 1
+
+    @staticmethod
+    def __do_nothing(_):
+        return None
+
+
+def _local_name(tag: str) -> str:
+    # Sitemaps use a namespace, which is not needed to tell the elements.
+    return tag.rpartition("}")[2]
@@ -1,25 +1,173 @@
 """Contains the category based spider."""
-from typing import List, Optional, Generator
+import os
+import time
+import functools
+from collections import deque
+from typing import List, Optional, Generator, Tuple, Deque, Any
 from scrapy import Spider, Request
 from scrapy_patterns.spiders.private.category_based_spider_state import CategoryBasedSpiderState
 from scrapy_patterns.request_factory import RequestFactory
 from scrapy_patterns.spiderlings.site_structure_discoverer import SiteStructureDiscoverer, CategoryParser
-from scrapy_patterns.spiderlings.site_pager import SitePager, SitePageParsers, SitePageCallbacks
-from scrapy_patterns.site_structure import VisitState, Node
+from scrapy_patterns.spiderlings.sitemap_structure_discoverer import SitemapStructureDiscoverer, SitemapCategoryParser
+from scrapy_patterns.spiderlings.site_pager import SitePager, SitePageParsers, SitePageCallbacks, PagingStopPolicy, \
+    ItemRetryPolicy
+from scrapy_patterns.site_structure import VisitState, Node, SiteStructure
+from scrapy_patterns.site_structure_cache import SiteStructureCache
+from scrapy_patterns.seen_item_index import SeenItemIndex
+from scrapy_patterns.bloom_filter import BloomFilter
+
+
+class CheckpointPolicy:
+    """
+    Decides when the progress of a category based spider is saved. A checkpoint is made when any of the enabled
+    conditions is met. The default policy saves after every page, and at every category change. The progress is also
+    saved when site structure discovery is complete, when there are no more categories, and when the spider is closed.
+    """
+    def __init__(self, every_n_pages: Optional[int] = 1, every_seconds: Optional[float] = None,
+                 on_category_change: bool = True, every_n_items: Optional[int] = None):
+        """
+        Args:
+            every_n_pages: Save after this many finished pages. None disables it.
+            every_seconds: Save when a page is finished, and at least this many seconds passed since the last
+            checkpoint. None disables it.
+            on_category_change: Whether to save when paging of a category is finished and the next one starts.
+            every_n_items: Save after this many processed items, so they are not requested again after a restart.
+            None disables it.
+        """
+        self.every_n_pages = every_n_pages
+        self.every_seconds = every_seconds
+        self.on_category_change = on_category_change
+        self.every_n_items = every_n_items
+        self.__num_of_pages_since_checkpoint = 0
+        self.__num_of_items_since_checkpoint = 0
+        self.__last_checkpoint_time = time.monotonic()
+
+    def is_due_on_page_finished(self) -> bool:
+        """
+        Called when a page is finished.
+        Returns: True if a checkpoint should be made.
+        """
+        self.__num_of_pages_since_checkpoint += 1
+        if self.every_n_pages and self.__num_of_pages_since_checkpoint >= self.every_n_pages:
+            return True
+        return self.every_seconds is not None and \
+            time.monotonic() - self.__last_checkpoint_time >= self.every_seconds
+
+    def is_due_on_item_finished(self) -> bool:
+        """
+        Called when an item is processed.
+        Returns: True if a checkpoint should be made.
+        """
+        self.__num_of_items_since_checkpoint += 1
+        return bool(self.every_n_items) and self.__num_of_items_since_checkpoint >= self.every_n_items
+
+    def is_due_on_category_change(self) -> bool:
+        """
+        Called when the next category starts.
+        Returns: True if a checkpoint should be made.
+        """
+        return self.on_category_change
+
+    def on_checkpoint(self):
+        """Called when a checkpoint is made."""
+        self.__num_of_pages_since_checkpoint = 0
+        self.__num_of_items_since_checkpoint = 0
+        self.__last_checkpoint_time = time.monotonic()
 
 
 class CategoryBasedSpiderData:
     """Stores data needed for category based spider."""
-    def __init__(self, progress_file_dir: str, name: str = None, start_url: str = None):
+    # pylint: disable=too-many-arguments
+    def __init__(self, progress_file_dir: str, name: str = None, start_url: str = None,
+                 use_progress_journal: bool = False, progress_journal_compaction_threshold: int = 1000,
+                 use_async_checkpoints: bool = False, checkpoint_policy: CheckpointPolicy = None,
+                 full_structure_log_interval: Optional[int] = None, site_structure_class: type = SiteStructure,
+                 max_concurrent_categories: int = 1, max_prefetched_pages: int = 0,
+                 seen_item_index: SeenItemIndex = None, paging_stop_policy: PagingStopPolicy = None,
+                 deduplicate_items: bool = False, item_dedup_capacity: int = 1000000,
+                 item_dedup_false_positive_rate: float = 0.001, max_item_requests_in_flight: Optional[int] = None,
+                 item_retry_policy: ItemRetryPolicy = None, stream_discovered_categories: bool = False,
+                 max_concurrent_discovery_requests: Optional[int] = None, max_discovery_depth: Optional[int] = None,
+                 max_discovered_categories: Optional[int] = None, site_structure_cache_ttl: Optional[float] = None,
+                 site_structure_refresh_depth: Optional[int] = None,
+                 sitemap_category_parser: SitemapCategoryParser = None, sitemap_urls: Optional[List[str]] = None):
         """
         Args:
             progress_file_dir: A path to a directory where the progress file will be stored
             name: Name of the spider (optional as it can be an attribute)
             start_url: The starting URL (optional as it can be an attribute)
+            use_progress_journal: If True, only the changes are saved at checkpoints into a journal next to the
+            progress file, instead of rewriting the whole progress file.
+            progress_journal_compaction_threshold: The number of journal entries after which the journal is compacted
+            into the progress file.
+            use_async_checkpoints: If True, the progress is written by a background thread instead of the reactor's
+            thread. Successive checkpoints are coalesced while a previous one is being written. It turns on
+            use_progress_journal, as the whole progress is still copied on the reactor's thread for each progress file.
+            checkpoint_policy: Decides when the progress is saved. By default it's saved after every page, and at
+            every category change.
+            full_structure_log_interval: The state is logged after every page, and category change, but only the
+            number of categories per visit state. The whole site structure is logged after every
+            full_structure_log_interval-th page or category change. None means never.
+            site_structure_class: The class of the site structure. Use ColumnarSiteStructure for very large sites.
+            max_concurrent_categories: The number of leaf categories paged at the same time, each by its own pager.
+            max_prefetched_pages: The number of pages of a category that can be requested ahead of the first page
+            which still has items in progress. Progress is still saved in page order.
+            seen_item_index: If given, items scraped in earlier crawls are skipped. It's closed with the spider.
+            paging_stop_policy: If given, paging of a category is stopped when its pages have mostly items scraped in
+            earlier crawls. Needs a seen item index.
+            deduplicate_items: If True, items found in more categories are requested only once per crawl. Parsed item
+            URLs are kept in a Bloom filter, which is saved next to the progress file with every snapshot of it.
+            item_dedup_capacity: The expected number of items in the crawl.
+            item_dedup_false_positive_rate: The ratio of items that may be wrongly skipped as duplicates, when the
+            number of items is at the capacity.
+            max_item_requests_in_flight: If given, at most this many item requests are in progress at the same time
+            per category, which keeps the scheduler queue, and memory usage small on huge pages.
+            item_retry_policy: If given, failed items are retried according to it. The items waiting for a retry are
+            saved with the progress (with their request keyword arguments, which must be JSON serializable, and their
+            number of retries), so they are retried after a restart too.
+            stream_discovered_categories: If True, leaf categories are paged as soon as they are discovered, instead
+            of waiting for the whole site structure. The progress is saved only when the discovery is complete.
+            max_concurrent_discovery_requests: If given, at most this many category requests of the site structure
+            discovery are in progress at the same time, so paging gets its share of the concurrent requests.
+            max_discovery_depth: If given, at most this many levels of categories are discovered.
+            max_discovered_categories: If given, at most this many categories are discovered.
+            site_structure_cache_ttl: If given, the discovered site structure is cached next to the progress file, and
+            crawls started without progress within this many seconds use it (with every category being NEW) instead
+            of discovering the structure again.
+            site_structure_refresh_depth: If given, an expired cached structure is refreshed by discovering only this
+            many upper levels again; the sub-categories of the categories that are still there are taken from the
+            cache. Otherwise the whole structure is discovered again. Needs site_structure_cache_ttl.
+            sitemap_category_parser: If given, the site structure is discovered from the sitemaps of the site instead
+            of the category pages, and the categories are told from the listed URLs by this parser. Category selectors
+            are not needed then.
+            sitemap_urls: The URLs of the sitemaps, or sitemap indexes. By default the start URL.
         """
         self.progress_file_dir = progress_file_dir
         self.name = name
         self.start_url = start_url
+        self.use_progress_journal = use_progress_journal
+        self.progress_journal_compaction_threshold = progress_journal_compaction_threshold
+        self.use_async_checkpoints = use_async_checkpoints
+        self.checkpoint_policy = checkpoint_policy if checkpoint_policy else CheckpointPolicy()
+        self.full_structure_log_interval = full_structure_log_interval
+        self.site_structure_class = site_structure_class
+        self.max_concurrent_categories = max_concurrent_categories
+        self.max_prefetched_pages = max_prefetched_pages
+        self.seen_item_index = seen_item_index
+        self.paging_stop_policy = paging_stop_policy
+        self.deduplicate_items = deduplicate_items
+        self.item_dedup_capacity = item_dedup_capacity
+        self.item_dedup_false_positive_rate = item_dedup_false_positive_rate
+        self.max_item_requests_in_flight = max_item_requests_in_flight
+        self.item_retry_policy = item_retry_policy
+        self.stream_discovered_categories = stream_discovered_categories
+        self.max_concurrent_discovery_requests = max_concurrent_discovery_requests
+        self.max_discovery_depth = max_discovery_depth
+        self.max_discovered_categories = max_discovered_categories
+        self.site_structure_cache_ttl = site_structure_cache_ttl
+        self.site_structure_refresh_depth = site_structure_refresh_depth
+        self.sitemap_category_parser = sitemap_category_parser
+        self.sitemap_urls = sitemap_urls
 
 
 class CategoryBasedSpider(Spider):
@@ -43,32 +191,82 @@ class CategoryBasedSpider(Spider):
         if data is None:
             raise ValueError("{} must have data".format(type(self).__name__))
         super().__init__(data.name, **kwargs)
-        if category_selectors is None:
+        if category_selectors is None and data.sitemap_category_parser is None:
             raise ValueError("{} must have category selectors".format(type(self).__name__))
         if data.start_url is not None:
             self.start_url = data.start_url
         elif not getattr(self, "start_url", None):
             raise ValueError("{} must have start URL".format(type(self).__name__))
+        if data.paging_stop_policy is not None and data.seen_item_index is None:
+            raise ValueError("{} must have seen item index for paging stop policy".format(type(self).__name__))
+        if data.max_concurrent_categories < 1:
+            raise ValueError("{} must page at least one category at a time".format(type(self).__name__))
+        if data.site_structure_refresh_depth is not None and data.site_structure_cache_ttl is None:
+            raise ValueError("{} must have site structure cache TTL for refreshing".format(type(self).__name__))
+        if data.site_structure_refresh_depth is not None and data.site_structure_refresh_depth < 1:
+            raise ValueError("{} must refresh at least one level of the site structure".format(type(self).__name__))
         self.__category_selectors = category_selectors
-        self.__spider_state = CategoryBasedSpiderState(self.name, data.progress_file_dir)
+        item_url_filter = None
+        if data.deduplicate_items:
+            item_url_filter = BloomFilter(data.item_dedup_capacity, data.item_dedup_false_positive_rate)
+        self.__spider_state = CategoryBasedSpiderState(
+            self.name, data.progress_file_dir, use_journal=data.use_progress_journal,
+            journal_compaction_threshold=data.progress_journal_compaction_threshold,
+            use_async_writer=data.use_async_checkpoints, full_log_interval=data.full_structure_log_interval,
+            site_structure_class=data.site_structure_class, item_url_filter=item_url_filter)
         self.__site_page_parsers = site_page_parsers
-        self.__site_pager: Optional[SitePager] = None
+        self.__max_concurrent_categories = data.max_concurrent_categories
+        self.__max_prefetched_pages = data.max_prefetched_pages
+        self.__seen_item_index = data.seen_item_index
+        self.__paging_stop_policy = data.paging_stop_policy
+        self.__max_item_requests_in_flight = data.max_item_requests_in_flight
+        self.__item_retry_policy = data.item_retry_policy
+        self.__stream_discovered_categories = data.stream_discovered_categories
+        self.__max_concurrent_discovery_requests = data.max_concurrent_discovery_requests
+        self.__max_discovery_depth = data.max_discovery_depth
+        self.__max_discovered_categories = data.max_discovered_categories
+        self.__site_structure_cache: Optional[SiteStructureCache] = None
+        if data.site_structure_cache_ttl is not None:
+            self.__site_structure_cache = SiteStructureCache(
+                os.path.join(data.progress_file_dir, self.name + "_structure.json"), data.site_structure_class)
+        self.__site_structure_cache_ttl = data.site_structure_cache_ttl
+        self.__site_structure_refresh_depth = data.site_structure_refresh_depth
+        self.__sitemap_category_parser = data.sitemap_category_parser
+        self.__sitemap_urls = data.sitemap_urls
+        self.__is_discovering = False
+        # The discovered leaf categories which can be paged before the discovery is complete, in discovery order.
+        self.__discovered_leaves: Deque[Node] = deque()
+        self.__site_pagers: List[SitePager] = []
+        # The site path of the category each pager is paging, or None if the pager is free.
+        self.__pager_category_paths: List[Optional[str]] = []
+        self.__categories_to_resume: List[Tuple[str, str]] = []
+        self.__checkpoint_policy = data.checkpoint_policy
+        self.__site_structure_class = data.site_structure_class
 
     def start_requests(self) -> Generator[Request, None, None]:
         """
         See Scrapy Spider start_requests()
 
-        Returns: If saved progress exists, the next request to continue with, otherwise the starting request for site
+        Returns: If saved progress exists, the next requests to continue with, otherwise the starting request for site
         structure discovery.
         """
         # Must be created here because some attributes are available after from_crawler()
-        self.__site_pager = self.__create_site_pager()
+        self.__site_pagers = [self.__create_site_pager(pager_index)
+                              for pager_index in range(self.__max_concurrent_categories)]
+        self.__pager_category_paths = [None] * self.__max_concurrent_categories
         if self.__spider_state.is_loaded:
-            yield self.__site_pager.start(self.__spider_state.current_page_url)
+            self.__categories_to_resume = list(self.__spider_state.current_pages.items())
+            yield from self.__start_next_categories()
+            return
+        cached_structure, is_cache_expired = self.__load_cached_site_structure()
+        if cached_structure is not None and not is_cache_expired:
+            self.logger.info("Using cached site structure.")
+            self.__spider_state.site_structure = cached_structure
+            self.__save_progress()
+            yield from self.__start_next_categories()
         else:
-            site_discoverer = SiteStructureDiscoverer(self, self.start_url, self.__category_selectors,
-                                                      self.request_factory, self._on_site_structure_discovery_complete)
-            yield site_discoverer.create_start_request()
+            self.__is_discovering = True
+            yield from self.__start_site_structure_discovery(cached_structure)
 
     def parse(self, response):
         """
@@ -76,32 +274,156 @@ class CategoryBasedSpider(Spider):
         """
         yield None
 
+    def closed(self, _reason):
+        """
+        Called by Scrapy when the spider is closed. Saves the progress, and writes the pending checkpoints.
+        """
+        if self.__spider_state.site_structure is not None:
+            self.__save_progress()
+        self.__spider_state.close()
+        if self.__seen_item_index is not None:
+            self.__seen_item_index.close()
+        self.__record_checkpoint_stats()
+        self.__record_seen_item_index_stats()
+        self.__record_item_retry_stats()
+
     def _on_site_structure_discovery_complete(self, discoverer):
+        self.__is_discovering = False
+        self.__discovered_leaves.clear()
         self.__spider_state.site_structure = discoverer.structure
-        self.__spider_state.save()
-        return self.__progress_to_next_category()
+        self.__save_progress()
+        if self.__site_structure_cache is not None:
+            self.__site_structure_cache.save(discoverer.structure)
+        return self.__start_next_categories()
+
+    def _on_leaf_category_discovered(self, discoverer, leaf: Node):
+        if self.__spider_state.site_structure is None:
+            # The structure is completed while it's paged.
+            self.__spider_state.site_structure = discoverer.structure
+        self.__discovered_leaves.append(leaf)
+        return self.__start_next_categories()
+
+    def __start_site_structure_discovery(self, expired_structure=None) -> List[Request]:
+        if self.__sitemap_category_parser is not None:
+            # Leaves are known only when every sitemap is parsed, so they are not streamed, and there's nothing to
+            # refresh incrementally.
+            site_discoverer = SitemapStructureDiscoverer(
+                self, self.__sitemap_urls or [self.start_url], self.__sitemap_category_parser, self.request_factory,
+                self._on_site_structure_discovery_complete, site_structure_class=self.__site_structure_class,
+                max_categories=self.__max_discovered_categories)
+            return site_discoverer.create_start_requests()
+        known_structure = expired_structure if self.__site_structure_refresh_depth is not None else None
+        on_leaf_discovered = self._on_leaf_category_discovered if self.__stream_discovered_categories else None
+        site_discoverer = SiteStructureDiscoverer(
+            self, self.start_url, self.__category_selectors, self.request_factory,
+            self._on_site_structure_discovery_complete, site_structure_class=self.__site_structure_class,
+            max_concurrent_requests=self.__max_concurrent_discovery_requests, max_depth=self.__max_discovery_depth,
+            max_categories=self.__max_discovered_categories, on_leaf_discovered=on_leaf_discovered,
+            known_structure=known_structure,
+            refresh_depth=self.__site_structure_refresh_depth if known_structure is not None else 1)
+        return [site_discoverer.create_start_request()]
+
+    def __load_cached_site_structure(self) -> Tuple[Any, bool]:
+        # Returns the cached structure, and whether it's expired.
+        if self.__site_structure_cache is None:
+            return None, False
+        structure_and_age = self.__site_structure_cache.load_with_age()
+        if structure_and_age is None:
+            return None, False
+        structure, age_seconds = structure_and_age
+        if age_seconds <= self.__site_structure_cache_ttl:
+            return structure, False
+        self.logger.info("Cached site structure is expired.")
+        return structure, True
 
-    def __create_site_pager(self) -> SitePager:
-        callbacks = SitePageCallbacks(self.__on_paging_finished, self.__on_page_finished)
-        return SitePager(self, self.request_factory, self.__site_page_parsers, callbacks)
+    def __create_site_pager(self, pager_index: int) -> SitePager:
+        callbacks = SitePageCallbacks(functools.partial(self.__on_paging_finished, pager_index),
+                                      functools.partial(self.__on_page_finished, pager_index),
+                                      functools.partial(self.__on_item_finished, pager_index),
+                                      functools.partial(self.__on_numbered_page_finished, pager_index),
+                                      functools.partial(self.__on_item_failed, pager_index))
+        return SitePager(self, self.request_factory, self.__site_page_parsers, callbacks,
+                         max_prefetched_pages=self.__max_prefetched_pages, seen_item_index=self.__seen_item_index,
+                         stop_policy=self.__paging_stop_policy,
+                         item_url_filter=self.__spider_state.item_url_filter,
+                         max_item_requests_in_flight=self.__max_item_requests_in_flight,
+                         retry_policy=self.__item_retry_policy)
 
-    def __on_page_finished(self, next_page_url):
+    def __record_checkpoint_stats(self):
+        stats = self.__spider_state.checkpoint_writer_stats
+        crawler = getattr(self, "crawler", None)
+        if stats is None or crawler is None:
+            return
+        crawler.stats.set_value("checkpoint/saves", stats.num_of_saves)
+        crawler.stats.set_value("checkpoint/coalesced_saves", stats.num_of_coalesced_saves)
+        crawler.stats.set_value("checkpoint/writes", stats.num_of_writes)
+        crawler.stats.set_value("checkpoint/total_write_seconds", stats.total_write_seconds)
+        crawler.stats.set_value("checkpoint/max_write_seconds", stats.max_write_seconds)
+
+    def __record_seen_item_index_stats(self):
+        crawler = getattr(self, "crawler", None)
+        if self.__seen_item_index is None or crawler is None:
+            return
+        crawler.stats.set_value("seen_items/hits", self.__seen_item_index.stats.num_of_hits)
+        crawler.stats.set_value("seen_items/misses", self.__seen_item_index.stats.num_of_misses)
+
+    def __record_item_retry_stats(self):
+        crawler = getattr(self, "crawler", None)
+        if self.__item_retry_policy is None or crawler is None:
+            return
+        crawler.stats.set_value("item_retries/retries",
+                                sum(pager.retry_stats.num_of_retries for pager in self.__site_pagers))
+        crawler.stats.set_value("item_retries/permanent_failures",
+                                sum(pager.retry_stats.num_of_permanent_failures for pager in self.__site_pagers))
+
+    def __on_page_finished(self, pager_index: int, next_page_url: str):
         # Category is not changed when a page is finished.
-        self.__spider_state.current_page_url = next_page_url
-        self.__spider_state.save()
+        self.__spider_state.set_current_page(self.__pager_category_paths[pager_index], next_page_url)
+        if self.__checkpoint_policy.is_due_on_page_finished():
+            self.__save_progress()
         self.__spider_state.log()
 
-    def __on_paging_finished(self):
-        current_category_path = self.__spider_state.current_page_site_path
+    def __on_numbered_page_finished(self, pager_index: int, page_number: int):
+        self.__spider_state.add_completed_page_number(self.__pager_category_paths[pager_index], page_number)
+        if self.__checkpoint_policy.is_due_on_page_finished():
+            self.__save_progress()
+        self.__spider_state.log()
+
+    def __on_item_finished(self, pager_index: int, item_url: str):
+        category_path = self.__pager_category_paths[pager_index]
+        self.__spider_state.add_completed_item(category_path, item_url)
+        # The item may have succeeded on a retry.
+        self.__spider_state.remove_failed_item(category_path, item_url)
+        if self.__checkpoint_policy.is_due_on_item_finished():
+            self.__save_progress()
+
+    # pylint: disable=too-many-arguments
+    def __on_item_failed(self, pager_index: int, item_url: str, will_be_retried: bool, req_kwargs: dict = None,
+                         num_of_retries: int = 0):
+        category_path = self.__pager_category_paths[pager_index]
+        if will_be_retried:
+            try:
+                self.__spider_state.add_failed_item(category_path, item_url, req_kwargs, num_of_retries)
+                return
+            except ValueError as error:
+                # Retrying it with other request arguments after a restart would be a different request.
+                self.logger.warning("Failed item is not saved, so it's not retried after a restart: %s", error)
+        self.__spider_state.remove_failed_item(category_path, item_url)
+
+    def __on_paging_finished(self, pager_index: int):
+        current_category_path = self.__pager_category_paths[pager_index]
         current_category_node = self.__spider_state.site_structure.get_node_at_path(current_category_path)
         current_category_node.set_visit_state(VisitState.VISITED, propagate=False)
         self.__propagate_visited_if_siblings_visited(current_category_node)
-        return self.__progress_to_next_category()
+        self.__spider_state.remove_current_page(current_category_path)
+        self.__pager_category_paths[pager_index] = None
+        next_requests = self.__start_next_categories([pager_index])
+        return next_requests[0] if next_requests else None
 
     def __propagate_visited_if_siblings_visited(self, category_node: Node):
-        if category_node.parent and self.__are_category_children_visited(category_node.parent):
+        while category_node.parent and self.__are_category_children_visited(category_node.parent):
             category_node.parent.set_visit_state(VisitState.VISITED)
-            self.__propagate_visited_if_siblings_visited(category_node.parent)
+            category_node = category_node.parent
 
     @staticmethod
     def __are_category_children_visited(category_node: Node):
@@ -110,14 +432,55 @@ class CategoryBasedSpider(Spider):
                 return False
         return True
 
-    def __progress_to_next_category(self):
-        next_category = self.__spider_state.site_structure.find_leaf_with_visit_state(VisitState.NEW)
-        next_request = None
-        if next_category:
+    def __start_next_categories(self, pager_indices: List[int] = None) -> List[Request]:
+        if pager_indices is None:
+            pager_indices = [pager_index for pager_index, category_path in enumerate(self.__pager_category_paths)
+                             if category_path is None]
+        next_requests = []
+        for pager_index in pager_indices:
+            next_request = self.__start_next_category(pager_index)
+            if next_request is None:
+                break
+            next_requests.append(next_request)
+        # Saved also when there are no more categories to start.
+        if len(next_requests) < len(pager_indices) or self.__checkpoint_policy.is_due_on_category_change():
+            self.__save_progress()
+        self.__spider_state.log()
+        return next_requests
+
+    def __start_next_category(self, pager_index: int) -> Optional[Request]:
+        completed_item_urls = frozenset()
+        completed_page_numbers = frozenset()
+        failed_items = {}
+        if self.__categories_to_resume:
+            category_path, page_url = self.__categories_to_resume.pop(0)
+            completed_item_urls = self.__spider_state.get_completed_items(category_path)
+            completed_page_numbers = self.__spider_state.get_completed_page_numbers(category_path)
+            failed_items = self.__spider_state.get_failed_items(category_path)
+        else:
+            next_category = self.__find_next_category()
+            if next_category is None:
+                return None
             next_category.set_visit_state(VisitState.IN_PROGRESS, propagate=True)
-            self.__spider_state.current_page_url = next_category.url
-            self.__spider_state.current_page_site_path = next_category.get_path()
-            next_request = self.__site_pager.start(next_category.url)
+            category_path, page_url = next_category.get_path(), next_category.url
+            self.__spider_state.set_current_page(category_path, page_url)
+        self.__pager_category_paths[pager_index] = category_path
+        return self.__site_pagers[pager_index].start(page_url, completed_item_urls, completed_page_numbers,
+                                                     failed_items)
+
+    def __find_next_category(self) -> Optional[Node]:
+        if not self.__is_discovering:
+            return self.__spider_state.site_structure.find_leaf_with_visit_state(VisitState.NEW)
+        # Categories which are not discovered yet are leaves of the structure as well.
+        while self.__discovered_leaves:
+            leaf = self.__discovered_leaves.popleft()
+            if leaf.visit_state == VisitState.NEW:
+                return leaf
+        return None
+
+    def __save_progress(self):
+        if self.__is_discovering:
+            # An incomplete structure would be taken as complete after a restart.
+            return
         self.__spider_state.save()
-        self.__spider_state.log()
-        return next_request
+        self.__checkpoint_policy.on_checkpoint()
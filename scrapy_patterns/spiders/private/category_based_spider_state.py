@@ -1,61 +1,628 @@
 """This is a private module containing state handling for category based spider."""
 import os
+import re
 import json
+import hashlib
 import logging
-from typing import Optional
-from scrapy_patterns.site_structure import SiteStructure
+from typing import Optional, Dict, List, Iterable, Iterator, Set, AbstractSet, Tuple, Mapping
+from scrapy_patterns.site_structure import SiteStructure, Node, VisitState, visit_state_counts_to_str, \
+    tree_to_json_chunks, load_deep_json
+from scrapy_patterns.bloom_filter import BloomFilter
+from scrapy_patterns.spiders.private.checkpoint_writer import CheckpointWriter, CheckpointWriterStats
 
 
 # pylint: disable=too-many-instance-attributes
 class CategoryBasedSpiderState:
-    """The class holding the state."""
-    def __init__(self, spider_name: str, progress_file_dir: str):
+    """
+    The class holding the state. In journaled mode, saving appends only the changes since the last save to a journal
+    file next to the progress file, and the progress file (the snapshot) is rewritten only when the journal grows
+    beyond the compaction threshold. The journal is replayed on load.
+    Snapshots are written atomically (to a temporary file, which then replaces the progress file), and the previous
+    snapshot is kept. Snapshots contain a checksum; if the progress file is invalid on load, the previous one is used.
+    Each snapshot has a generation id, which is written on the journal entries too, so only the entries made on top of
+    the loaded snapshot are replayed (e.g. not the ones of a journal that was not removed because of a crash).
+    In asynchronous mode, the checkpoints are written by a background thread, so close() must be called at the end. The
+    site structure of a snapshot is still copied on the calling thread, which takes time proportional to its size, so
+    asynchronous mode is always journaled: snapshots (and copies) are made only when the journal is compacted. If a
+    checkpoint fails to be written, a snapshot is saved at the next save.
+    The state tracks the current page of every category that is being paged, so more categories can be in progress at
+    the same time. For the current page of each category, the URLs of the already processed items are tracked too, so
+    they can be skipped after a restart. For categories with numbered pages, the numbers of the processed pages are
+    tracked instead of the current page. The failed items of each category that wait for a retry are tracked until the
+    category is finished. The optional filter of parsed item URLs is saved next to the progress file, but only with
+    snapshots, as it's large.
+    """
+    # pylint: disable=too-many-arguments
+    def __init__(self, spider_name: str, progress_file_dir: str, use_journal: bool = False,
+                 journal_compaction_threshold: int = 1000, use_async_writer: bool = False,
+                 full_log_interval: Optional[int] = None, site_structure_class: type = SiteStructure,
+                 item_url_filter: Optional[BloomFilter] = None):
+        """
+        Args:
+            spider_name: The name of the spider.
+            progress_file_dir: The directory of the progress file.
+            use_journal: Whether to use journaled mode.
+            journal_compaction_threshold: In journaled mode, the number of journal entries after which the journal is
+            compacted into the snapshot.
+            use_async_writer: Whether to write the checkpoints on a background thread. It turns on journaled mode, as
+            the site structure of each snapshot is copied on the calling thread, which takes time proportional to the
+            size of the structure.
+            full_log_interval: Every full_log_interval-th log() logs the whole site structure. None means only when
+            requested explicitly.
+            site_structure_class: The class used to restore the site structure from the progress file.
+            item_url_filter: The filter of parsed item URLs to use when there's no saved one.
+        """
         self.logger = logging.getLogger(self.__class__.__name__)
-        self.site_structure: Optional[SiteStructure] = None
-        self.current_page_url = None
-        self.current_page_site_path = None
+        self.__site_structure: Optional[SiteStructure] = None
+        self.__current_pages: Dict[str, str] = {}
+        self.__completed_items: Dict[str, Set[str]] = {}
+        self.__completed_page_numbers: Dict[str, Set[int]] = {}
+        # The request keyword arguments, and the number of retries by URL, by the site path of each category.
+        self.__failed_items: Dict[str, Dict[str, Tuple[dict, int]]] = {}
         self.is_loaded = False
         self.__spider_name = spider_name
         self.__progress_file_dir = progress_file_dir
+        self.__journal_file_path = os.path.join(progress_file_dir, spider_name + "_progress.journal")
         self.__json_file_path = os.path.join(progress_file_dir, spider_name + "_progress.json")
+        self.__previous_json_file_path = self.__json_file_path + ".prev"
+        self.__temp_json_file_path = self.__json_file_path + ".tmp"
+        self.__item_url_filter_file_path = os.path.join(progress_file_dir, spider_name + "_progress.bloom")
+        self.__item_url_filter = item_url_filter
+        self.__num_of_saved_item_urls = len(item_url_filter) if item_url_filter is not None else 0
+        self.__use_journal = use_journal or use_async_writer
+        self.__journal_compaction_threshold = journal_compaction_threshold
+        self.__num_of_journal_entries = 0
+        self.__is_snapshot_needed = True
+        self.__generation: Optional[str] = None
+        self.__changed_nodes: Dict[Node, None] = {}
+        self.__changed_pages: Dict[str, None] = {}
+        self.__new_completed_items: Dict[str, List[str]] = {}
+        self.__new_completed_page_numbers: Dict[str, List[int]] = {}
+        self.__changed_failed_items: Dict[Tuple[str, str], None] = {}
+        self.__full_log_interval = full_log_interval
+        self.__site_structure_class = site_structure_class
+        self.__num_of_logs = 0
+        self.__checkpoint_writer: Optional[CheckpointWriter] = None
+        if use_async_writer:
+            self.__checkpoint_writer = CheckpointWriter(spider_name, self.__write_json_state,
+                                                        self.__write_journal_entries)
 
-        if self.__does_file_exist():
-            self.__load()
-            self.logger.info("[%s] State loaded from file: %s", self.__spider_name, self.__json_file_path)
-            self.log()
-            self.is_loaded = True
+        for file_path in [self.__json_file_path, self.__previous_json_file_path]:
+            if os.path.isfile(file_path) and self.__try_load(file_path):
+                self.logger.info("[%s] State loaded from file: %s", self.__spider_name, file_path)
+                self.log()
+                self.is_loaded = True
+                self.__load_item_url_filter()
+                break
+
+    @property
+    def site_structure(self) -> Optional[SiteStructure]:
+        """The site structure."""
+        return self.__site_structure
+
+    @site_structure.setter
+    def site_structure(self, site_structure: Optional[SiteStructure]):
+        # The same structure may be set again (e.g. when its streamed discovery is complete), which mustn't add the
+        # listener again, otherwise every change would be recorded more than once.
+        if site_structure is not self.__site_structure:
+            if self.__site_structure is not None:
+                self.__site_structure.remove_visit_state_listener(self.__on_visit_state_changed)
+            if site_structure is not None:
+                site_structure.add_visit_state_listener(self.__on_visit_state_changed)
+        self.__site_structure = site_structure
+        self.__is_snapshot_needed = True
+        self.__changed_nodes = {}
+
+    @property
+    def item_url_filter(self) -> Optional[BloomFilter]:
+        """The filter of parsed item URLs, restored from its file if the state is loaded."""
+        return self.__item_url_filter
+
+    @property
+    def current_pages(self) -> Dict[str, str]:
+        """The URL of the current page by the site path of each category in progress. Shouldn't be modified."""
+        return self.__current_pages
+
+    def set_current_page(self, site_path: str, url: str):
+        """
+        Sets the current page of a category. The completed items of the previous page are forgotten.
+        Args:
+            site_path: The site path of the category.
+            url: The URL of the page.
+        """
+        self.__current_pages[site_path] = url
+        self.__changed_pages[site_path] = None
+        self.__forget_completed_items(site_path)
+
+    def remove_current_page(self, site_path: str):
+        """
+        Removes the current page of a category, when its paging is finished.
+        Args:
+            site_path: The site path of the category.
+        """
+        if self.__current_pages.pop(site_path, None) is not None:
+            self.__changed_pages[site_path] = None
+        self.__forget_completed_items(site_path)
+        self.__failed_items.pop(site_path, None)
+        self.__changed_failed_items = {key: None for key in self.__changed_failed_items if key[0] != site_path}
+
+    def add_completed_item(self, site_path: str, item_url: str):
+        """
+        Adds a processed item of the current page of a category.
+        Args:
+            site_path: The site path of the category.
+            item_url: The URL of the item.
+        """
+        completed_items = self.__completed_items.setdefault(site_path, set())
+        if item_url not in completed_items:
+            completed_items.add(item_url)
+            self.__new_completed_items.setdefault(site_path, []).append(item_url)
+
+    def add_completed_page_number(self, site_path: str, page_number: int):
+        """
+        Adds a processed page of a category with numbered pages.
+        Args:
+            site_path: The site path of the category.
+            page_number: The number of the page.
+        """
+        completed_page_numbers = self.__completed_page_numbers.setdefault(site_path, set())
+        if page_number not in completed_page_numbers:
+            completed_page_numbers.add(page_number)
+            self.__new_completed_page_numbers.setdefault(site_path, []).append(page_number)
+
+    def get_completed_page_numbers(self, site_path: str) -> AbstractSet[int]:
+        """
+        Args:
+            site_path: The site path of the category.
+
+        Returns: The numbers of the processed pages of the category.
+        """
+        return frozenset(self.__completed_page_numbers.get(site_path, ()))
+
+    def add_failed_item(self, site_path: str, item_url: str, req_kwargs: Optional[dict] = None,
+                        num_of_retries: int = 0):
+        """
+        Adds a failed item of a category, which waits for a retry, or updates it when it fails again. It's kept when the
+        current page changes.
+        Args:
+            site_path: The site path of the category.
+            item_url: The URL of the item.
+            req_kwargs: The request keyword arguments of the item. They are saved as JSON.
+            num_of_retries: The number of retries of the item so far.
+
+        Raises:
+            ValueError: If the request keyword arguments would change when saved as JSON. The item is not added then.
+        """
+        req_kwargs = req_kwargs if req_kwargs is not None else {}
+        try:
+            saved_req_kwargs = json.loads(json.dumps(req_kwargs))
+        except (TypeError, ValueError) as error:
+            raise ValueError("Request keyword arguments of {} can't be saved: {}".format(item_url, error)) from error
+        if saved_req_kwargs != req_kwargs:
+            raise ValueError("Request keyword arguments of {} are changed when saved".format(item_url))
+        failed_items = self.__failed_items.setdefault(site_path, {})
+        failed_item = (saved_req_kwargs, num_of_retries)
+        if failed_items.get(item_url) != failed_item:
+            failed_items[item_url] = failed_item
+            self.__changed_failed_items[(site_path, item_url)] = None
+
+    def remove_failed_item(self, site_path: str, item_url: str):
+        """
+        Removes a failed item of a category, when it's processed, or given up.
+        Args:
+            site_path: The site path of the category.
+            item_url: The URL of the item.
+        """
+        failed_items = self.__failed_items.get(site_path)
+        if failed_items and item_url in failed_items:
+            del failed_items[item_url]
+            self.__changed_failed_items[(site_path, item_url)] = None
+
+    def get_failed_items(self, site_path: str) -> Mapping[str, Tuple[dict, int]]:
+        """
+        Args:
+            site_path: The site path of the category.
+
+        Returns: The request keyword arguments, and the number of retries of the failed items of the category, which
+        wait for a retry, by their URLs.
+        """
+        return dict(self.__failed_items.get(site_path, {}))
+
+    def get_completed_items(self, site_path: str) -> AbstractSet[str]:
+        """
+        Args:
+            site_path: The site path of the category.
+
+        Returns: The URLs of the processed items on the current page of the category.
+        """
+        return frozenset(self.__completed_items.get(site_path, ()))
 
     def save(self):
-        """Saves the state to the progress file."""
+        """Saves the state to the progress file, or in journaled mode, to the journal when possible."""
         if self.site_structure is None:
             raise RuntimeError("[{}] Site structure doesn't exist!".format(self.__spider_name))
-        self.logger.info("[%s] Saving state.", self.__spider_name)
         if not os.path.isdir(self.__progress_file_dir):
             os.mkdir(self.__progress_file_dir)
-        with open(self.__json_file_path, "w") as json_file:
-            json_state = {
-                "site_structure": self.site_structure.to_dict(),
-                "current_page_url": self.current_page_url,
-                "current_page_site_path": self.current_page_site_path
-            }
-
-            json.dump(json_state, json_file)
-
-    def log(self):
-        """Logs the state."""
-        self.logger.info("[%s] state:\n"
-                         "current_page_url = %s\n"
-                         "current_page_site_path = %s\n"
-                         "site_structure =\n%s",
-                         self.__spider_name, self.current_page_url, self.current_page_site_path,
-                         str(self.site_structure))
-
-    def __does_file_exist(self):
-        return os.path.isfile(self.__json_file_path)
-
-    def __load(self):
-        with open(self.__json_file_path, "r") as json_file:
-            json_state = json.load(json_file)
-            self.site_structure = SiteStructure.from_dict(json_state["site_structure"])
-            self.current_page_url = json_state["current_page_url"]
-            self.current_page_site_path = json_state["current_page_site_path"]
+        if self.__checkpoint_writer is not None and self.__checkpoint_writer.pop_write_failure():
+            # The changes of the failed checkpoint are only in the memory, so they are written with a snapshot.
+            self.logger.warning("[%s] A checkpoint failed to be written; saving a snapshot.", self.__spider_name)
+            self.__is_snapshot_needed = True
+            self.__num_of_saved_item_urls = None
+        if self.__use_journal and not self.__is_snapshot_needed \
+                and self.__num_of_journal_entries < self.__journal_compaction_threshold:
+            self.__append_to_journal()
+        else:
+            self.__save_snapshot()
+
+    def close(self):
+        """Writes the checkpoints that are still pending in asynchronous mode."""
+        if self.__checkpoint_writer is not None:
+            self.__checkpoint_writer.close()
+
+    @property
+    def checkpoint_writer_stats(self) -> Optional[CheckpointWriterStats]:
+        """Statistics of checkpoint writing in asynchronous mode, otherwise None."""
+        return self.__checkpoint_writer.stats if self.__checkpoint_writer is not None else None
+
+    def log(self, full: bool = False):
+        """
+        Logs the state. By default only the number of categories per visit state is logged, not the whole structure.
+        Args:
+            full: Whether to log the whole site structure.
+        """
+        self.__num_of_logs += 1
+        if self.__full_log_interval and self.__num_of_logs % self.__full_log_interval == 0:
+            full = True
+        if full:
+            # The structure is passed as is, so it's only rendered when the record is emitted.
+            self.logger.info("[%s] state:\n"
+                             "current_pages = %s\n"
+                             "site_structure =\n%s",
+                             self.__spider_name, self.__current_pages, self.site_structure)
+        else:
+            self.logger.info("[%s] state:\n"
+                             "current_pages = %s\n"
+                             "categories = %s",
+                             self.__spider_name, self.__current_pages, self.__create_visit_state_counts_msg())
+
+    def __save_snapshot(self):
+        self.logger.info("[%s] Saving state.", self.__spider_name)
+        generation = os.urandom(8).hex()
+        # Kept if the snapshot is not written, so the next save doesn't append to the journal of the previous one.
+        self.__is_snapshot_needed = True
+        num_of_item_urls = len(self.__item_url_filter) if self.__item_url_filter is not None else 0
+        if self.__checkpoint_writer is not None:
+            # The writer thread can't read the structure while it changes, so it gets a copy.
+            self.__checkpoint_writer.submit_snapshot(self.__create_snapshot(generation,
+                                                                            _copy_tree(self.site_structure.root_node)))
+        else:
+            self.__write_json_state(self.__create_snapshot(generation, self.site_structure.root_node))
+        self.__num_of_saved_item_urls = num_of_item_urls
+        # Journal entries are made on top of this snapshot from now on.
+        self.__generation = generation
+        self.__num_of_journal_entries = 0
+        self.__is_snapshot_needed = False
+        self.__changed_nodes = {}
+        self.__changed_pages = {}
+        self.__new_completed_items = {}
+        self.__new_completed_page_numbers = {}
+        self.__changed_failed_items = {}
+
+    def __append_to_journal(self):
+        entries = [{"path": node.get_path(), "visit_state": node.visit_state.name} for node in self.__changed_nodes]
+        # A page URL of None means that the paging of the category is finished.
+        entries.extend({"current_page_site_path": site_path, "current_page_url": self.__current_pages.get(site_path)}
+                       for site_path in self.__changed_pages)
+        # After the pages, as setting a page forgets the completed items of the category.
+        entries.extend({"completed_item_site_path": site_path, "completed_item_url": item_url}
+                       for site_path, item_urls in self.__new_completed_items.items() for item_url in item_urls)
+        entries.extend({"completed_page_site_path": site_path, "completed_page_number": page_number}
+                       for site_path, page_numbers in self.__new_completed_page_numbers.items()
+                       for page_number in page_numbers)
+        entries.extend(self.__create_failed_item_entry(site_path, item_url)
+                       for site_path, item_url in self.__changed_failed_items)
+        if not entries:
+            return
+        for entry in entries:
+            entry["generation"] = self.__generation
+        self.logger.info("[%s] Saving %d state change(s) to journal.", self.__spider_name, len(entries))
+        if self.__checkpoint_writer is not None:
+            self.__checkpoint_writer.submit_journal_entries(entries)
+        else:
+            self.__write_journal_entries(entries)
+        self.__num_of_journal_entries += len(entries)
+        self.__changed_nodes = {}
+        self.__changed_pages = {}
+        self.__new_completed_items = {}
+        self.__new_completed_page_numbers = {}
+        self.__changed_failed_items = {}
+
+    def __forget_completed_items(self, site_path: str):
+        self.__completed_items.pop(site_path, None)
+        self.__new_completed_items.pop(site_path, None)
+        self.__completed_page_numbers.pop(site_path, None)
+        self.__new_completed_page_numbers.pop(site_path, None)
+
+    def __create_completed_items_dict(self) -> Dict[str, List[str]]:
+        return {site_path: sorted(item_urls) for site_path, item_urls in self.__completed_items.items() if item_urls}
+
+    def __create_completed_page_numbers_dict(self) -> Dict[str, List[int]]:
+        return {site_path: sorted(page_numbers)
+                for site_path, page_numbers in self.__completed_page_numbers.items() if page_numbers}
+
+    def __create_failed_item_entry(self, site_path: str, item_url: str) -> dict:
+        failed_item = self.__failed_items.get(site_path, {}).get(item_url)
+        entry = {"failed_item_site_path": site_path, "failed_item_url": item_url, "is_failed": failed_item is not None}
+        if failed_item is not None:
+            entry["req_kwargs"], entry["num_of_retries"] = failed_item
+        return entry
+
+    def __create_failed_items_dict(self) -> Dict[str, Dict[str, dict]]:
+        return {site_path: {item_url: {"req_kwargs": req_kwargs, "num_of_retries": num_of_retries}
+                            for item_url, (req_kwargs, num_of_retries) in failed_items.items()}
+                for site_path, failed_items in self.__failed_items.items() if failed_items}
+
+    def __create_visit_state_counts_msg(self):
+        if self.site_structure is None:
+            return None
+        return visit_state_counts_to_str(self.site_structure)
+
+    def __create_snapshot(self, generation: str, root_node) -> dict:
+        return {
+            "completed_items": self.__create_completed_items_dict(),
+            "completed_page_numbers": self.__create_completed_page_numbers_dict(),
+            "current_pages": dict(self.__current_pages),
+            "failed_items": self.__create_failed_items_dict(),
+            "generation": generation,
+            "site_structure": root_node,
+            "item_url_filter": self.__create_item_url_filter_bytes()
+        }
+
+    def __create_item_url_filter_bytes(self) -> Optional[bytes]:
+        # The filter is written only if it changed, and it's copied as it changes while it's written.
+        if self.__item_url_filter is None or len(self.__item_url_filter) == self.__num_of_saved_item_urls:
+            return None
+        return self.__item_url_filter.to_bytes()
+
+    @staticmethod
+    def __iter_json_state(snapshot: dict) -> Iterator[str]:
+        # The JSON of the state dict with sorted keys. The structure is written without recursion (and its dict), so
+        # long category chains can be saved too.
+        yield '{{"completed_items": {}, "completed_page_numbers": {}, "current_pages": {}, "failed_items": {}, ' \
+              '"generation": {}, "site_structure": '.format(
+                  json.dumps(snapshot["completed_items"], sort_keys=True),
+                  json.dumps(snapshot["completed_page_numbers"], sort_keys=True),
+                  json.dumps(snapshot["current_pages"], sort_keys=True),
+                  json.dumps(snapshot["failed_items"], sort_keys=True), json.dumps(snapshot["generation"]))
+        yield from tree_to_json_chunks(snapshot["site_structure"])
+        yield "}"
+
+    def __write_json_state(self, snapshot: dict):
+        self.__write_snapshot(self.__iter_json_state(snapshot), snapshot["item_url_filter"])
+
+    def __write_snapshot(self, json_state_chunks: Iterable[str], item_url_filter_bytes: Optional[bytes]):
+        checksum = hashlib.sha256()
+        with open(self.__temp_json_file_path, "w") as json_file:
+            json_file.write('{"state": ')
+            for json_state_str in _join_chunks(json_state_chunks):
+                checksum.update(json_state_str.encode("utf-8"))
+                json_file.write(json_state_str)
+            # The checksum is written last, so the state can be written while it's computed.
+            json_file.write(', "checksum": "{}"}}'.format(checksum.hexdigest()))
+            json_file.flush()
+            os.fsync(json_file.fileno())
+        if os.path.isfile(self.__json_file_path):
+            os.replace(self.__json_file_path, self.__previous_json_file_path)
+        os.replace(self.__temp_json_file_path, self.__json_file_path)
+        if item_url_filter_bytes is not None:
+            # Written after the snapshot, so the filter doesn't lag behind it. Items in the filter but not in the
+            # snapshot are skipped after a restart, but they were processed anyway.
+            self.__write_item_url_filter(item_url_filter_bytes)
+        self.__sync_progress_file_dir()
+        # The snapshot contains everything, so the journal is obsolete.
+        if os.path.isfile(self.__journal_file_path):
+            os.remove(self.__journal_file_path)
+
+    def __write_item_url_filter(self, item_url_filter_bytes: bytes):
+        temp_file_path = self.__item_url_filter_file_path + ".tmp"
+        with open(temp_file_path, "wb") as filter_file:
+            filter_file.write(item_url_filter_bytes)
+            filter_file.flush()
+            os.fsync(filter_file.fileno())
+        os.replace(temp_file_path, self.__item_url_filter_file_path)
+
+    def __load_item_url_filter(self):
+        if self.__item_url_filter is None or not os.path.isfile(self.__item_url_filter_file_path):
+            return
+        with open(self.__item_url_filter_file_path, "rb") as filter_file:
+            try:
+                self.__item_url_filter = BloomFilter.from_bytes(filter_file.read())
+            except ValueError as error:
+                self.logger.error("[%s] Failed to load item URL filter: %s", self.__spider_name, error)
+                return
+        self.__num_of_saved_item_urls = len(self.__item_url_filter)
+
+    def __write_journal_entries(self, entries: List[dict]):
+        with open(self.__journal_file_path, "a") as journal_file:
+            journal_file.write("".join(json.dumps(entry) + "\n" for entry in entries))
+
+    def __on_visit_state_changed(self, node: Node):
+        self.__changed_nodes[node] = None
+
+    def __sync_progress_file_dir(self):
+        # Makes the renames durable on platforms where directories can be opened.
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        dir_fd = os.open(self.__progress_file_dir, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    @staticmethod
+    def __checksum(json_state_str: str) -> str:
+        return hashlib.sha256(json_state_str.encode("utf-8")).hexdigest()
+
+    def __parse_json_state(self, json_str: str) -> dict:
+        # The checksum is computed over the state as it's written, so it's checked before parsing.
+        checksum_match = _CHECKSUM_LAST.match(json_str) or _CHECKSUM_FIRST.match(json_str)
+        if checksum_match is not None:
+            if self.__checksum(checksum_match.group("state")) != checksum_match.group("checksum"):
+                raise ValueError("Checksum mismatch")
+            return load_deep_json(checksum_match.group("state"))
+        json_state = load_deep_json(json_str)
+        if "checksum" in json_state:
+            raise ValueError("Invalid checksummed state")
+        # Progress files of earlier versions don't have a checksum.
+        return json_state
+
+    def __try_load(self, file_path: str) -> bool:
+        try:
+            self.__load(file_path)
+            return True
+        except (ValueError, KeyError, TypeError, AttributeError, RecursionError, OSError) as error:
+            self.logger.error("[%s] Failed to load state from file %s: %s", self.__spider_name, file_path, error)
+            # Nothing of a partially loaded file is kept.
+            self.__site_structure = None
+            self.__current_pages = {}
+            self.__completed_items = {}
+            self.__completed_page_numbers = {}
+            self.__failed_items = {}
+            self.__generation = None
+            self.__num_of_journal_entries = 0
+            return False
+
+    def __load(self, file_path: str):
+        with open(file_path, "r") as json_file:
+            json_state = self.__parse_json_state(json_file.read())
+        self.site_structure = self.__site_structure_class.from_dict(json_state["site_structure"])
+        self.__current_pages = self.__load_current_pages(json_state)
+        self.__completed_items = {site_path: set(item_urls)
+                                  for site_path, item_urls in json_state.get("completed_items", {}).items()}
+        self.__completed_page_numbers = {
+            site_path: set(page_numbers)
+            for site_path, page_numbers in json_state.get("completed_page_numbers", {}).items()}
+        self.__failed_items = {site_path: self.__load_failed_items(failed_items)
+                               for site_path, failed_items in json_state.get("failed_items", {}).items()}
+        # Progress files of earlier versions don't have a generation, and neither do their journal entries.
+        self.__generation = json_state.get("generation")
+        is_journal_valid = True
+        if os.path.isfile(self.__journal_file_path):
+            is_journal_valid = self.__replay_journal()
+        # An invalid journal can't be appended to, so it's replaced by a snapshot at the next save.
+        self.__is_snapshot_needed = not is_journal_valid
+        self.__changed_nodes = {}
+        self.__changed_pages = {}
+        self.__new_completed_items = {}
+        self.__new_completed_page_numbers = {}
+        self.__changed_failed_items = {}
+
+    @staticmethod
+    def __load_failed_items(failed_items) -> Dict[str, Tuple[dict, int]]:
+        if isinstance(failed_items, list):
+            # Progress files of earlier versions contain only the URLs.
+            return {item_url: ({}, 0) for item_url in failed_items}
+        return {item_url: (dict(failed_item["req_kwargs"]), int(failed_item["num_of_retries"]))
+                for item_url, failed_item in failed_items.items()}
+
+    @staticmethod
+    def __load_current_pages(json_state: dict) -> Dict[str, str]:
+        if "current_pages" in json_state:
+            return dict(json_state["current_pages"])
+        # Progress files of earlier versions contain only one category in progress.
+        site_path = json_state["current_page_site_path"]
+        return {site_path: json_state["current_page_url"]} if site_path is not None else {}
+
+    def __replay_journal(self) -> bool:
+        num_of_stale_entries = 0
+        with open(self.__journal_file_path, "r") as journal_file:
+            for line in journal_file:
+                try:
+                    entry = json.loads(line)
+                    if entry.get("generation") != self.__generation:
+                        # Made on top of another snapshot, e.g. the journal wasn't removed because of a crash.
+                        num_of_stale_entries += 1
+                        continue
+                    self.__replay_journal_entry(entry)
+                except (ValueError, KeyError, TypeError, AttributeError):
+                    # Most likely the last entry was cut by an interrupted write.
+                    self.logger.warning("[%s] Invalid journal entry; ignoring the rest of the journal.",
+                                        self.__spider_name)
+                    return False
+                self.__num_of_journal_entries += 1
+        if num_of_stale_entries:
+            self.logger.warning("[%s] %d journal entries of another snapshot are ignored.", self.__spider_name,
+                                num_of_stale_entries)
+        return num_of_stale_entries == 0
+
+    def __replay_journal_entry(self, entry: dict):
+        if "visit_state" in entry:
+            path = entry["path"]
+            node = self.site_structure.get_node_at_path(path) if path else self.site_structure.root_node
+            if node is None:
+                raise KeyError(path)
+            node.visit_state = VisitState[entry["visit_state"]]
+        elif "completed_item_url" in entry:
+            self.__completed_items.setdefault(entry["completed_item_site_path"], set()).add(entry["completed_item_url"])
+        elif "failed_item_url" in entry:
+            failed_items = self.__failed_items.setdefault(entry["failed_item_site_path"], {})
+            if entry["is_failed"]:
+                failed_items[entry["failed_item_url"]] = (dict(entry.get("req_kwargs", {})),
+                                                          int(entry.get("num_of_retries", 0)))
+            else:
+                failed_items.pop(entry["failed_item_url"], None)
+        elif "completed_page_number" in entry:
+            self.__completed_page_numbers.setdefault(entry["completed_page_site_path"], set()).add(
+                int(entry["completed_page_number"]))
+        else:
+            site_path = entry["current_page_site_path"]
+            url = entry["current_page_url"]
+            if url is not None:
+                self.__current_pages[site_path] = url
+            else:
+                self.__current_pages.pop(site_path, None)
+                self.__failed_items.pop(site_path, None)
+            self.__completed_items.pop(site_path, None)
+            self.__completed_page_numbers.pop(site_path, None)
+
+
+# The layouts of checksummed progress files: the checksum is written after the state, or before it by earlier versions.
+_CHECKSUM_LAST = re.compile(r'\{"state": (?P<state>.*), "checksum": "(?P<checksum>[0-9a-f]{64})"\}\s*\Z', re.DOTALL)
+_CHECKSUM_FIRST = re.compile(r'\{"checksum": "(?P<checksum>[0-9a-f]{64})", "state": (?P<state>.*)\}\s*\Z', re.DOTALL)
+
+
+class _NodeCopy:
+    # A copy of a node with only the attributes needed to write it.
+    __slots__ = ("name", "url", "visit_state", "children")
+
+    def __init__(self, node):
+        self.name = node.name
+        self.url = node.url
+        self.visit_state = node.visit_state
+        self.children = []
+
+
+def _copy_tree(root_node) -> _NodeCopy:
+    root_copy = _NodeCopy(root_node)
+    nodes_to_copy = [(root_node, root_copy)]
+    while nodes_to_copy:
+        node, node_copy = nodes_to_copy.pop()
+        for child in node.children:
+            child_copy = _NodeCopy(child)
+            node_copy.children.append(child_copy)
+            nodes_to_copy.append((child, child_copy))
+    return root_copy
+
+
+def _join_chunks(chunks: Iterable[str], min_size: int = 64 * 1024) -> Iterator[str]:
+    batch = []
+    batch_size = 0
+    for chunk in chunks:
+        batch.append(chunk)
+        batch_size += len(chunk)
+        if batch_size >= min_size:
+            yield "".join(batch)
+            batch = []
+            batch_size = 0
+    if batch:
+        yield "".join(batch)
@@ -0,0 +1,141 @@
+"""This is a private module containing the background writer of category based spider state checkpoints."""
+import logging
+import threading
+import time
+from typing import Callable, List, Optional
+
+
+class CheckpointWriterStats:
+    """
+    Statistics of a checkpoint writer.
+    Attributes:
+        num_of_saves (int): The number of submitted checkpoints.
+        num_of_coalesced_saves (int): The number of checkpoints that were merged into a later one before writing.
+        num_of_writes (int): The number of writes.
+        total_write_seconds (float): The total time spent with writing.
+        max_write_seconds (float): The longest write.
+    """
+    def __init__(self):
+        self.num_of_saves = 0
+        self.num_of_coalesced_saves = 0
+        self.num_of_writes = 0
+        self.total_write_seconds = 0.0
+        self.max_write_seconds = 0.0
+
+
+class CheckpointWriter:
+    """
+    Writes checkpoints on a dedicated thread, so file I/O and JSON encoding don't block the reactor. Checkpoints that
+    are submitted while a previous one waits for writing are coalesced: a snapshot supersedes everything pending
+    before it, and journal entries are appended to the pending ones. Failed writes are only logged on the writer thread,
+    so the submitter should check pop_write_failure() to recover from them (e.g. by writing a snapshot again).
+    """
+    def __init__(self, name: str, write_snapshot: Callable[[dict], None],
+                 append_to_journal: Callable[[List[dict]], None]):
+        """
+        Args:
+            name: Name used in logs and as the name of the thread.
+            write_snapshot: Writes a snapshot. Called on the writer thread.
+            append_to_journal: Appends entries to the journal. Called on the writer thread.
+        """
+        self.logger = logging.getLogger(self.__class__.__name__)
+        self.stats = CheckpointWriterStats()
+        self.__name = name
+        self.__write_snapshot = write_snapshot
+        self.__append_to_journal = append_to_journal
+        self.__condition = threading.Condition()
+        self.__pending: Optional[_PendingCheckpoint] = None
+        self.__is_writing = False
+        self.__has_write_failed = False
+        self.__is_closed = False
+        self.__thread = threading.Thread(target=self.__run, name="{}-checkpoint-writer".format(name), daemon=True)
+        self.__thread.start()
+
+    def submit_snapshot(self, json_state: dict):
+        """
+        Submits a snapshot for writing.
+        Args:
+            json_state: The state to write. It shouldn't be modified after submitting.
+        """
+        with self.__condition:
+            self.__count_save()
+            self.__pending = _PendingCheckpoint(json_state)
+            self.__condition.notify_all()
+
+    def submit_journal_entries(self, entries: List[dict]):
+        """
+        Submits journal entries for writing.
+        Args:
+            entries: The entries to append to the journal.
+        """
+        with self.__condition:
+            self.__count_save()
+            if self.__pending is None:
+                self.__pending = _PendingCheckpoint()
+            self.__pending.journal_entries.extend(entries)
+            self.__condition.notify_all()
+
+    def pop_write_failure(self) -> bool:
+        """
+        Returns: True if a write failed since the last call.
+        """
+        with self.__condition:
+            has_write_failed = self.__has_write_failed
+            self.__has_write_failed = False
+            return has_write_failed
+
+    def flush(self):
+        """Blocks until every submitted checkpoint is written."""
+        with self.__condition:
+            self.__condition.wait_for(lambda: self.__pending is None and not self.__is_writing)
+
+    def close(self):
+        """Writes the remaining checkpoints, and stops the writer thread."""
+        with self.__condition:
+            self.__is_closed = True
+            self.__condition.notify_all()
+        self.__thread.join()
+
+    def __count_save(self):
+        if self.__is_closed:
+            raise RuntimeError("[{}] Checkpoint writer is closed!".format(self.__name))
+        self.stats.num_of_saves += 1
+        if self.__pending is not None:
+            self.stats.num_of_coalesced_saves += 1
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                self.__condition.wait_for(lambda: self.__pending is not None or self.__is_closed)
+                if self.__pending is None:
+                    return
+                checkpoint = self.__pending
+                self.__pending = None
+                self.__is_writing = True
+            start = time.perf_counter()
+            has_write_failed = False
+            try:
+                self.__write(checkpoint)
+            except Exception:  # pylint: disable=broad-except
+                self.logger.exception("[%s] Failed to write checkpoint!", self.__name)
+                has_write_failed = True
+            write_seconds = time.perf_counter() - start
+            with self.__condition:
+                self.__has_write_failed = self.__has_write_failed or has_write_failed
+                self.__is_writing = False
+                self.stats.num_of_writes += 1
+                self.stats.total_write_seconds += write_seconds
+                self.stats.max_write_seconds = max(self.stats.max_write_seconds, write_seconds)
+                self.__condition.notify_all()
+
+    def __write(self, checkpoint: '_PendingCheckpoint'):
+        if checkpoint.json_state is not None:
+            self.__write_snapshot(checkpoint.json_state)
+        if checkpoint.journal_entries:
+            self.__append_to_journal(checkpoint.journal_entries)
+
+
+class _PendingCheckpoint:
+    def __init__(self, json_state: dict = None):
+        self.json_state = json_state
+        self.journal_entries: List[dict] = []
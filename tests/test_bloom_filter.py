@@ -0,0 +1,40 @@
+"""Contains Bloom filter tests."""
+import pytest
+from scrapy_patterns.bloom_filter import BloomFilter
+
+
+def test_add_and_contains():
+    """Tests that added strings are contained, and adding them again is reported."""
+    bloom_filter = BloomFilter(100)
+    assert "http://item1.url" not in bloom_filter
+    assert bloom_filter.add("http://item1.url")
+    assert not bloom_filter.add("http://item1.url")
+    assert "http://item1.url" in bloom_filter
+    assert len(bloom_filter) == 1
+
+
+def test_false_positive_rate():
+    """Tests that the false positive rate is around the given one at capacity, and the size doesn't depend on usage."""
+    bloom_filter = BloomFilter(10000, 0.01)
+    for i in range(10000):
+        bloom_filter.add("http://item{}.url".format(i))
+    false_positives = sum("http://other{}.url".format(i) in bloom_filter for i in range(10000))
+    assert false_positives < 200
+    assert bloom_filter.num_of_bits < 10000 * 10
+
+
+def test_serialization():
+    """Tests restoring a serialized filter."""
+    bloom_filter = BloomFilter(100)
+    bloom_filter.add("http://item1.url")
+    restored_filter = BloomFilter.from_bytes(bloom_filter.to_bytes())
+    assert "http://item1.url" in restored_filter
+    assert "http://item2.url" not in restored_filter
+    assert len(restored_filter) == 1
+
+    with pytest.raises(ValueError):
+        BloomFilter.from_bytes(bloom_filter.to_bytes()[:-1])
+    with pytest.raises(ValueError):
+        BloomFilter(0)
+    with pytest.raises(ValueError):
+        BloomFilter(100, 1.0)
@@ -1,10 +1,14 @@
 """Contains category based spider tests"""
+import os
 from unittest.mock import Mock, patch
 
 import pytest
 
-from scrapy_patterns.site_structure import VisitState
-from scrapy_patterns.spiders.category_based_spider import CategoryBasedSpider, CategoryBasedSpiderData
+from scrapy_patterns.site_structure import VisitState, SiteStructure, load_deep_json
+from scrapy_patterns.spiders.private.category_based_spider_state import CategoryBasedSpiderState
+from scrapy_patterns.spiders.category_based_spider import CategoryBasedSpider, CategoryBasedSpiderData, \
+    CheckpointPolicy
+from scrapy_patterns.spiderlings.site_pager import ItemRetryPolicy
 
 
 @patch("scrapy_patterns.spiders.category_based_spider.SiteStructureDiscoverer")
@@ -108,6 +112,243 @@ def test_with_progress_start_requests_not_all_visited(mock_spider_state_cls, moc
     mock_current_category_parent.set_visit_state.assert_not_called()
 
 
+@patch("scrapy_patterns.spiders.category_based_spider.CategoryBasedSpiderState")
+def test_closed(mock_spider_state_cls):
+    """Tests that closing the spider closes the state, and records checkpoint stats."""
+    data = CategoryBasedSpiderData("some-progress-file-dir", "some-spider-name", "http://some-recipes.com",
+                                   use_async_checkpoints=True)
+    mock_spider_state_instance = __prepare_mock_spider_instance(False)
+    mock_spider_state_instance.checkpoint_writer_stats.num_of_coalesced_saves = 3
+    mock_spider_state_cls.return_value = mock_spider_state_instance
+
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    spider.crawler = Mock()
+    spider.closed("finished")
+    mock_spider_state_instance.close.assert_called()
+    spider.crawler.stats.set_value.assert_any_call("checkpoint/coalesced_saves", 3)
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SiteStructureDiscoverer")
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+@patch("scrapy_patterns.spiders.category_based_spider.CategoryBasedSpiderState")
+def test_checkpoint_policy_every_n_pages(mock_spider_state_cls, mock_site_pager_cls, _):
+    """Tests that pages are saved according to the checkpoint policy."""
+    data = CategoryBasedSpiderData("some-progress-file-dir", "some-spider-name", "http://some-recipes.com",
+                                   checkpoint_policy=CheckpointPolicy(every_n_pages=3, on_category_change=False))
+    mock_spider_state_instance = __prepare_mock_spider_instance(True)
+    mock_spider_state_instance.site_structure.get_node_at_path.return_value.parent = None
+    mock_spider_state_cls.return_value = mock_spider_state_instance
+
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    site_page_callbacks = mock_site_pager_cls.call_args[0][3]
+    for page in range(7):
+        site_page_callbacks.on_page_finished("http://some-recipes.com/page{}".format(page))
+    assert mock_spider_state_instance.save.call_count == 2
+
+    # Category change isn't saved, unless there are no more categories.
+    site_page_callbacks.on_paging_finished()
+    assert mock_spider_state_instance.save.call_count == 2
+    mock_spider_state_instance.site_structure.find_leaf_with_visit_state.return_value = None
+    site_page_callbacks.on_paging_finished()
+    assert mock_spider_state_instance.save.call_count == 3
+
+    spider.closed("finished")
+    assert mock_spider_state_instance.save.call_count == 4
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_concurrent_categories(mock_site_pager_cls, tmp_path):
+    """Tests paging more categories at the same time, each with its own pager."""
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com",
+                                   max_concurrent_categories=2)
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    assert mock_site_pager_cls.call_count == 2
+    mock_site_pager_cls.return_value.start.side_effect = lambda url, *_: url
+
+    discoverer = Mock()
+    discoverer.structure = __create_test_structure()
+    assert spider._on_site_structure_discovery_complete(discoverer) == ["fish_url", "birds_url"]
+    first_pager_callbacks = mock_site_pager_cls.call_args_list[0][0][3]
+    second_pager_callbacks = mock_site_pager_cls.call_args_list[1][0][3]
+    second_pager_callbacks.on_page_finished("birds_url/page2")
+    assert first_pager_callbacks.on_paging_finished() == "plants_url"
+    assert discoverer.structure.get_node_at_path("animals/fish").visit_state == VisitState.VISITED
+    assert discoverer.structure.get_node_at_path("animals").visit_state == VisitState.IN_PROGRESS
+
+    # Resumes the categories in progress, then continues with the new ones.
+    resumed_spider = CategoryBasedSpider(Mock(), Mock(), data)
+    assert list(resumed_spider.start_requests()) == ["birds_url/page2", "plants_url"]
+    resumed_pager_callbacks = mock_site_pager_cls.call_args_list[2][0][3]
+    assert resumed_pager_callbacks.on_paging_finished() is None
+    saved_state = CategoryBasedSpiderState("some-spider-name", str(tmp_path))
+    assert saved_state.current_pages == {"/plants": "plants_url"}
+    assert saved_state.site_structure.get_node_at_path("animals").visit_state == VisitState.VISITED
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_resume_with_completed_items(mock_site_pager_cls, tmp_path):
+    """Tests that the completed items of the current page are saved, and skipped after a restart."""
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com",
+                                   checkpoint_policy=CheckpointPolicy(every_n_items=2))
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    discoverer = Mock()
+    discoverer.structure = __create_test_structure()
+    spider._on_site_structure_discovery_complete(discoverer)
+    site_page_callbacks = mock_site_pager_cls.call_args[0][3]
+    site_page_callbacks.on_item_finished("item1_url")
+    site_page_callbacks.on_item_finished("item2_url")
+    site_page_callbacks.on_item_finished("item3_url")
+
+    resumed_spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(resumed_spider.start_requests())
+    mock_site_pager_cls.return_value.start.assert_called_with(
+        "fish_url", frozenset(["item1_url", "item2_url"]), frozenset(), {})
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_resume_with_failed_items(mock_site_pager_cls, tmp_path):
+    """Tests that the failed items waiting for a retry are saved, and retried after a restart."""
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com",
+                                   item_retry_policy=ItemRetryPolicy())
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    assert mock_site_pager_cls.call_args[1]["retry_policy"] is data.item_retry_policy
+    discoverer = Mock()
+    discoverer.structure = __create_test_structure()
+    spider._on_site_structure_discovery_complete(discoverer)
+    site_page_callbacks = mock_site_pager_cls.call_args[0][3]
+    site_page_callbacks.on_item_failed("item1_url", True, {"meta": {"some": "meta"}}, 0)
+    site_page_callbacks.on_item_failed("item1_url", True, {"meta": {"some": "meta"}}, 1)
+    site_page_callbacks.on_item_failed("item2_url", True, {}, 0)
+    site_page_callbacks.on_item_failed("item2_url", False)
+    site_page_callbacks.on_item_failed("item3_url", True, {}, 0)
+    # Retried with other request keyword arguments after a restart, it would be a different request.
+    site_page_callbacks.on_item_failed("item4_url", True, {"body": b"some-body"}, 0)
+    site_page_callbacks.on_item_finished("item3_url")
+    site_page_callbacks.on_page_finished("fish_url/page2")
+    mock_site_pager_cls.return_value.retry_stats.num_of_retries = 3
+    mock_site_pager_cls.return_value.retry_stats.num_of_permanent_failures = 1
+    spider.crawler = Mock()
+    spider.closed("finished")
+    spider.crawler.stats.set_value.assert_any_call("item_retries/permanent_failures", 1)
+
+    resumed_spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(resumed_spider.start_requests())
+    mock_site_pager_cls.return_value.start.assert_called_with(
+        "fish_url/page2", frozenset(), frozenset(), {"item1_url": ({"meta": {"some": "meta"}}, 1)})
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SiteStructureDiscoverer")
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_stream_discovered_categories(mock_site_pager_cls, mock_site_structure_discoverer_cls, tmp_path):
+    """Tests that leaf categories are paged while discovery goes on, and progress is saved when it's complete."""
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com",
+                                   max_concurrent_categories=2, stream_discovered_categories=True,
+                                   max_concurrent_discovery_requests=3)
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    discoverer_kwargs = mock_site_structure_discoverer_cls.call_args[1]
+    assert discoverer_kwargs["max_concurrent_requests"] == 3
+    assert discoverer_kwargs["on_leaf_discovered"] is not None
+    mock_site_pager_cls.return_value.start.side_effect = lambda url, *_: url
+
+    discoverer = Mock()
+    discoverer.structure = SiteStructure("some-recipes")
+    discoverer.structure.add_node_with_path("animals", "animals_url")
+    discoverer.structure.add_node_with_path("plants", "plants_url")
+    fish = discoverer.structure.add_node_with_path("animals/fish", "fish_url")
+    assert discoverer_kwargs["on_leaf_discovered"](discoverer, fish) == ["fish_url"]
+    first_pager_callbacks = mock_site_pager_cls.call_args_list[0][0][3]
+    first_pager_callbacks.on_page_finished("fish_url/page2")
+    # Categories not discovered yet are not paged.
+    assert first_pager_callbacks.on_paging_finished() is None
+    assert not os.path.exists(os.path.join(str(tmp_path), "some-spider-name_progress.json"))
+
+    birds = discoverer.structure.add_node_with_path("animals/birds", "birds_url")
+    assert discoverer_kwargs["on_leaf_discovered"](discoverer, birds) == ["birds_url"]
+    assert mock_site_structure_discoverer_cls.call_args[0][4](discoverer) == ["plants_url"]
+    saved_state = CategoryBasedSpiderState("some-spider-name", str(tmp_path))
+    assert saved_state.current_pages == {"/animals/birds": "birds_url", "/plants": "plants_url"}
+    assert saved_state.site_structure.get_node_at_path("animals/fish").visit_state == VisitState.VISITED
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SiteStructureDiscoverer")
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_cached_site_structure(mock_site_pager_cls, mock_site_structure_discoverer_cls, tmp_path):
+    """Tests that new crawls use the cached site structure, or refresh it when it's expired."""
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com",
+                                   site_structure_cache_ttl=3600)
+    spider = CategoryBasedSpider(Mock(), Mock(), data)
+    list(spider.start_requests())
+    assert mock_site_structure_discoverer_cls.call_args[1]["known_structure"] is None
+    mock_site_pager_cls.return_value.start.side_effect = lambda url, *_: url
+    discoverer = Mock()
+    discoverer.structure = __create_test_structure()
+    spider._on_site_structure_discovery_complete(discoverer)
+
+    # A new crawl without progress.
+    __remove_progress(str(tmp_path), "some-spider-name")
+    new_spider = CategoryBasedSpider(Mock(), Mock(), data)
+    assert list(new_spider.start_requests()) == ["fish_url"]
+    assert mock_site_structure_discoverer_cls.call_count == 1
+
+    __remove_progress(str(tmp_path), "some-spider-name")
+    # The cached structure is expired.
+    data.site_structure_cache_ttl = -1
+    data.site_structure_refresh_depth = 2
+    refreshing_spider = CategoryBasedSpider(Mock(), Mock(), data)
+    with patch("scrapy_patterns.site_structure_cache.load_deep_json", wraps=load_deep_json) as mock_load_deep_json:
+        list(refreshing_spider.start_requests())
+    # The cache file is read only once, for both checking its age, and refreshing it.
+    mock_load_deep_json.assert_called_once()
+    assert mock_site_structure_discoverer_cls.call_count == 2
+    discoverer_kwargs = mock_site_structure_discoverer_cls.call_args[1]
+    assert discoverer_kwargs["known_structure"].get_node_at_path("animals/fish").visit_state == VisitState.NEW
+    assert discoverer_kwargs["refresh_depth"] == 2
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.SiteStructureDiscoverer")
+@patch("scrapy_patterns.spiders.category_based_spider.SitemapStructureDiscoverer")
+@patch("scrapy_patterns.spiders.category_based_spider.SitePager")
+def test_sitemap_discovery(mock_site_pager_cls, mock_sitemap_discoverer_cls, mock_site_structure_discoverer_cls,
+                           tmp_path):
+    """Tests that the site structure is discovered from the sitemaps, when there's a sitemap category parser."""
+    mock_sitemap_category_parser = Mock()
+    data = CategoryBasedSpiderData(str(tmp_path), "some-spider-name", "http://some-recipes.com/sitemap.xml",
+                                   sitemap_category_parser=mock_sitemap_category_parser)
+    mock_sitemap_discoverer_cls.return_value.create_start_requests.return_value = ["sitemap_request"]
+    spider = CategoryBasedSpider(Mock(), None, data)
+    assert list(spider.start_requests()) == ["sitemap_request"]
+    mock_site_structure_discoverer_cls.assert_not_called()
+    assert mock_sitemap_discoverer_cls.call_args[0][1] == ["http://some-recipes.com/sitemap.xml"]
+    assert mock_sitemap_discoverer_cls.call_args[0][2] is mock_sitemap_category_parser
+
+    mock_site_pager_cls.return_value.start.side_effect = lambda url, *_: url
+    discoverer = Mock()
+    discoverer.structure = __create_test_structure()
+    assert mock_sitemap_discoverer_cls.call_args[0][4](discoverer) == ["fish_url"]
+    saved_state = CategoryBasedSpiderState("some-spider-name", str(tmp_path))
+    assert saved_state.current_pages == {"/animals/fish": "fish_url"}
+
+
+@patch("scrapy_patterns.spiders.category_based_spider.time")
+def test_checkpoint_policy_every_seconds(time_mock):
+    """Tests the time based checkpoint policy."""
+    time_mock.monotonic.return_value = 100.0
+    policy = CheckpointPolicy(every_n_pages=None, every_seconds=60.0)
+    time_mock.monotonic.return_value = 130.0
+    assert not policy.is_due_on_page_finished()
+    time_mock.monotonic.return_value = 160.0
+    assert policy.is_due_on_page_finished()
+    policy.on_checkpoint()
+    time_mock.monotonic.return_value = 200.0
+    assert not policy.is_due_on_page_finished()
+    assert policy.is_due_on_category_change()
+
+
 def test_missing_values():
     """Tests missing values when constructing the spider."""
     data = CategoryBasedSpiderData("some-progress-file-dir", "some-spider-name", "http://some-recipes.com")
@@ -118,6 +359,15 @@ def test_missing_values():
     with pytest.raises(ValueError):
         CategoryBasedSpider(Mock(), None, data)
 
+    with pytest.raises(ValueError):
+        CategoryBasedSpider(Mock(), Mock(), CategoryBasedSpiderData(
+            "some-progress-file-dir", "some-spider-name", "http://some-recipes.com", max_concurrent_categories=0))
+
+    with pytest.raises(ValueError):
+        CategoryBasedSpider(Mock(), Mock(), CategoryBasedSpiderData(
+            "some-progress-file-dir", "some-spider-name", "http://some-recipes.com", site_structure_cache_ttl=3600,
+            site_structure_refresh_depth=0))
+
     with pytest.raises(ValueError):
         data.start_url = None
         CategoryBasedSpider(Mock(), Mock(), data)
@@ -126,4 +376,20 @@ def test_missing_values():
 def __prepare_mock_spider_instance(is_loaded: bool):
     mock_spider_state_instance = Mock()
     mock_spider_state_instance.is_loaded = is_loaded
+    mock_spider_state_instance.current_pages = {"/some-category": "http://some-recipes.com/some-category/page2"}
     return mock_spider_state_instance
+
+
+def __remove_progress(progress_file_dir: str, spider_name: str):
+    for file_name in os.listdir(progress_file_dir):
+        if file_name.startswith(spider_name + "_progress"):
+            os.remove(os.path.join(progress_file_dir, file_name))
+
+
+def __create_test_structure():
+    structure = SiteStructure("some-recipes")
+    structure.add_node_with_path("animals", "animals_url")
+    structure.add_node_with_path("animals/fish", "fish_url")
+    structure.add_node_with_path("animals/birds", "birds_url")
+    structure.add_node_with_path("plants", "plants_url")
+    return structure
@@ -1,26 +1,26 @@
 """Contains tests for category based spider state."""
-from unittest.mock import Mock, patch, mock_open
+import json
+import sys
+import time
+import logging
+from unittest.mock import patch, mock_open
 import pytest
-from scrapy_patterns.spiders.private.category_based_spider_state import CategoryBasedSpiderState
-from scrapy_patterns.site_structure import SiteStructure
+from scrapy_patterns.spiders.private.category_based_spider_state import CategoryBasedSpiderState, _copy_tree
+from scrapy_patterns.site_structure import SiteStructure, VisitState
+from scrapy_patterns.columnar_site_structure import ColumnarSiteStructure
+from scrapy_patterns.bloom_filter import BloomFilter
 
 
-@patch("scrapy_patterns.spiders.private.category_based_spider_state.json")
-@patch("scrapy_patterns.spiders.private.category_based_spider_state.os")
-def test_save_file_and_path_doesnt_exist(os_mock, json_mock):
+def test_save_file_and_path_doesnt_exist(tmp_path):
     """Tests state saving with not existing progress file, and path."""
-    os_mock.path.isfile.return_value = False
-    os_mock.path.isdir.return_value = False
-    state = CategoryBasedSpiderState("some_spider_name", "some_spider_path")
-    state.site_structure = Mock()
-    state.current_page_url = "http://some-recipe-site.com/some-category/page1"
-    state.current_page_site_path = "Some Category"
-    os_mock.path.join.assert_called_with("some_spider_path", "some_spider_name_progress.json")
+    progress_file_dir = tmp_path / "some_spider_path"
+    state = CategoryBasedSpiderState("some_spider_name", str(progress_file_dir))
+    state.site_structure = SiteStructure("some-struct")
+    state.set_current_page("Some Category", "http://some-recipe-site.com/some-category/page1")
 
-    with patch("builtins.open", mock_open(read_data="some_data")):
-        state.save()
-        os_mock.mkdir.assert_called()
-        json_mock.dump.assert_called()
+    state.save()
+    assert (progress_file_dir / "some_spider_name_progress.json").is_file()
+    assert not (progress_file_dir / "some_spider_name_progress.json.tmp").exists()
 
 
 @patch("scrapy_patterns.spiders.private.category_based_spider_state.os")
@@ -35,17 +35,459 @@ def test_site_structure_is_none(os_mock):
         state.save()
 
 
-@patch("scrapy_patterns.spiders.private.category_based_spider_state.json")
+@patch("scrapy_patterns.spiders.private.category_based_spider_state.load_deep_json")
 @patch("scrapy_patterns.spiders.private.category_based_spider_state.os")
-def test_progress_file_exists(os_mock, json_mock):
+def test_progress_file_exists(os_mock, load_json_mock):
     """Tests state creation when progress file exists."""
     os_mock.path.isfile.return_value = True
     os_mock.path.isdir.return_value = True
     with patch("builtins.open", mock_open(read_data="some_data")):
-        json_mock.load.return_value = {
+        load_json_mock.return_value = {
             "site_structure": SiteStructure("some-struct").to_dict(),
             "current_page_url": "http://some-recipe-site.com/some-category/page1",
             "current_page_site_path": "Some Category"
         }
         CategoryBasedSpiderState("some_spider_name", "some_spider_path")
-        json_mock.load.assert_called()
+        load_json_mock.assert_called()
+
+
+def test_journal_save_and_load(tmp_path):
+    """Tests that journaled changes are restored on load."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.save()
+    snapshot_size = (tmp_path / "some_spider_name_progress.json").stat().st_size
+
+    state.site_structure.get_node_at_path("animals/fish").set_visit_state(VisitState.IN_PROGRESS, True)
+    state.set_current_page("/animals/fish", "http://some-recipe-site.com/fish/page2")
+    state.save()
+    state.site_structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED)
+    state.save()
+    assert (tmp_path / "some_spider_name_progress.json").stat().st_size == snapshot_size
+    assert len((tmp_path / "some_spider_name_progress.journal").read_text().splitlines()) == 5
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    assert loaded_state.is_loaded
+    assert loaded_state.current_pages == {"/animals/fish": "http://some-recipe-site.com/fish/page2"}
+    assert loaded_state.site_structure.get_node_at_path("animals/fish").visit_state == VisitState.VISITED
+    assert loaded_state.site_structure.get_node_at_path("animals").visit_state == VisitState.IN_PROGRESS
+    assert loaded_state.site_structure.root_node.visit_state == VisitState.IN_PROGRESS
+    assert loaded_state.site_structure.find_leaf_with_visit_state(VisitState.NEW).name == "plants"
+
+
+def test_multiple_current_pages(tmp_path):
+    """Tests that the current pages of more categories in progress are restored, from the journal, and snapshot."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/animals/fish", "http://some-recipe-site.com/fish/page1")
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page1")
+    state.save()
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page2")
+    state.remove_current_page("/animals/fish")
+    state.save()
+
+    expected_current_pages = {"/plants": "http://some-recipe-site.com/plants/page2"}
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.current_pages == expected_current_pages
+    loaded_state.save()
+    assert not (tmp_path / "some_spider_name_progress.journal").exists()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).current_pages == expected_current_pages
+
+
+def test_completed_items(tmp_path):
+    """Tests that the completed items are restored, and forgotten when the next page of the category is set."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page1")
+    state.add_completed_item("/plants", "http://some-recipe-site.com/rose")
+    state.save()
+    state.add_completed_item("/plants", "http://some-recipe-site.com/tulip")
+    state.set_current_page("/animals/fish", "http://some-recipe-site.com/fish/page1")
+    state.add_completed_item("/animals/fish", "http://some-recipe-site.com/shark")
+    state.save()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).get_completed_items("/plants") == {
+        "http://some-recipe-site.com/rose", "http://some-recipe-site.com/tulip"}
+
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page2")
+    state.save()
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.get_completed_items("/plants") == set()
+    assert loaded_state.get_completed_items("/animals/fish") == {"http://some-recipe-site.com/shark"}
+    loaded_state.save()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).get_completed_items("/animals/fish") == {
+        "http://some-recipe-site.com/shark"}
+
+
+def test_completed_page_numbers(tmp_path):
+    """Tests that the completed page numbers are restored from the journal, and the snapshot."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants")
+    state.add_completed_page_number("/plants", 3)
+    state.save()
+    state.add_completed_page_number("/plants", 1)
+    state.save()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.get_completed_page_numbers("/plants") == {1, 3}
+    loaded_state.save()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).get_completed_page_numbers("/plants") == {1, 3}
+    loaded_state.remove_current_page("/plants")
+    assert loaded_state.get_completed_page_numbers("/plants") == set()
+
+
+def test_failed_items(tmp_path):
+    """Tests that the failed items are kept when the page changes, and forgotten when the category is finished."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page1")
+    state.add_failed_item("/plants", "http://some-recipe-site.com/rose", {"method": "POST", "body": "a=1"})
+    state.add_failed_item("/plants", "http://some-recipe-site.com/tulip")
+    state.save()
+    state.add_failed_item("/plants", "http://some-recipe-site.com/rose", {"method": "POST", "body": "a=1"}, 1)
+    state.remove_failed_item("/plants", "http://some-recipe-site.com/tulip")
+    state.set_current_page("/plants", "http://some-recipe-site.com/plants/page2")
+    state.save()
+    with pytest.raises(ValueError):
+        state.add_failed_item("/plants", "http://some-recipe-site.com/daisy", {"body": b"a=1"})
+    with pytest.raises(ValueError):
+        state.add_failed_item("/plants", "http://some-recipe-site.com/daisy", {"flags": ("some-flag",)})
+    expected_failed_items = {"http://some-recipe-site.com/rose": ({"method": "POST", "body": "a=1"}, 1)}
+    assert state.get_failed_items("/plants") == expected_failed_items
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.get_failed_items("/plants") == expected_failed_items
+    loaded_state.save()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).get_failed_items("/plants") == \
+        expected_failed_items
+
+    loaded_state.remove_current_page("/plants")
+    loaded_state.save()
+    assert CategoryBasedSpiderState("some_spider_name", str(tmp_path)).get_failed_items("/plants") == {}
+
+
+def test_item_url_filter(tmp_path):
+    """Tests that the item URL filter is saved, and restored only together with the state."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), item_url_filter=BloomFilter(100))
+    state.site_structure = __create_test_structure()
+    state.item_url_filter.add("http://some-recipe-site.com/rose")
+    state.save()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), item_url_filter=BloomFilter(100))
+    assert "http://some-recipe-site.com/rose" in loaded_state.item_url_filter
+    (tmp_path / "some_spider_name_progress.json").unlink()
+    (tmp_path / "some_spider_name_progress.json.prev").touch()
+    new_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), item_url_filter=BloomFilter(100))
+    assert "http://some-recipe-site.com/rose" not in new_state.item_url_filter
+
+
+def test_item_url_filter_saved_with_snapshots(tmp_path):
+    """Tests that the item URL filter is written only with snapshots, also asynchronously."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True, use_async_writer=True,
+                                     item_url_filter=BloomFilter(100))
+    state.site_structure = __create_test_structure()
+    state.item_url_filter.add("http://some-recipe-site.com/rose")
+    state.save()
+    state.item_url_filter.add("http://some-recipe-site.com/tulip")
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    state.save()
+    state.close()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True,
+                                            item_url_filter=BloomFilter(100))
+    assert loaded_state.current_pages == {"/plants": "http://some-recipe-site.com/page2"}
+    assert "http://some-recipe-site.com/rose" in loaded_state.item_url_filter
+    assert "http://some-recipe-site.com/tulip" not in loaded_state.item_url_filter
+    assert not (tmp_path / "some_spider_name_progress.bloom.tmp").exists()
+
+
+def test_load_single_current_page(tmp_path):
+    """Tests loading a progress file that has only one current page, without checksum."""
+    (tmp_path / "some_spider_name_progress.json").write_text(json.dumps({
+        "site_structure": __create_test_structure().to_dict(),
+        "current_page_url": "http://some-recipe-site.com/plants/page3",
+        "current_page_site_path": "/plants"
+    }))
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert state.current_pages == {"/plants": "http://some-recipe-site.com/plants/page3"}
+
+
+def test_site_structure_set_again(tmp_path):
+    """Tests that each visit state change is journaled once, when the same structure is set again, or replaced."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    structure = __create_test_structure()
+    state.site_structure = structure
+    state.site_structure = structure
+    state.save()
+    structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED)
+    state.save()
+    journal_path = tmp_path / "some_spider_name_progress.journal"
+    assert [json.loads(line)["path"] for line in journal_path.read_text().splitlines()] == ["/animals/fish"]
+
+    state.site_structure = __create_test_structure()
+    state.save()
+    structure.get_node_at_path("plants").set_visit_state(VisitState.VISITED)
+    state.site_structure.get_node_at_path("animals").set_visit_state(VisitState.VISITED)
+    state.save()
+    assert [json.loads(line)["path"] for line in journal_path.read_text().splitlines()] == ["/animals"]
+
+
+def test_journal_compaction(tmp_path):
+    """Tests that the journal is compacted into the snapshot when it reaches the threshold."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True,
+                                     journal_compaction_threshold=2)
+    state.site_structure = __create_test_structure()
+    state.save()
+    journal_path = tmp_path / "some_spider_name_progress.journal"
+    state.site_structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED)
+    state.site_structure.get_node_at_path("plants").set_visit_state(VisitState.VISITED)
+    state.save()
+    assert journal_path.exists()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    state.save()
+    assert not journal_path.exists()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.current_pages["/plants"] == "http://some-recipe-site.com/page2"
+    assert loaded_state.site_structure.get_node_at_path("plants").visit_state == VisitState.VISITED
+
+
+def test_journal_of_another_snapshot(tmp_path):
+    """Tests that a journal left behind by a crash during compaction is not replayed over the newer snapshot."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True,
+                                     journal_compaction_threshold=1)
+    state.site_structure = __create_test_structure()
+    state.save()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    state.save()
+    state.remove_current_page("/plants")
+    with patch("scrapy_patterns.spiders.private.category_based_spider_state.os.remove", side_effect=OSError()):
+        with pytest.raises(OSError):
+            state.save()
+    assert (tmp_path / "some_spider_name_progress.journal").exists()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    assert loaded_state.current_pages == {}
+    loaded_state.save()
+    assert not (tmp_path / "some_spider_name_progress.journal").exists()
+
+
+def test_journal_with_interrupted_entry(tmp_path):
+    """Tests that a cut journal entry is ignored, and the journal is replaced by a snapshot at the next save."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.save()
+    state.site_structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED)
+    state.save()
+    journal_path = tmp_path / "some_spider_name_progress.journal"
+    with open(str(journal_path), "a") as journal_file:
+        journal_file.write('{"path": "/plants", "visit_')
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    assert loaded_state.site_structure.get_node_at_path("animals/fish").visit_state == VisitState.VISITED
+    assert loaded_state.site_structure.get_node_at_path("plants").visit_state == VisitState.NEW
+    loaded_state.save()
+    assert not journal_path.exists()
+
+
+def test_save_keeps_previous_generation(tmp_path):
+    """Tests that the previous progress file is kept, and used when the current one is corrupted."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page1")
+    state.save()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    state.save()
+    progress_file_path = tmp_path / "some_spider_name_progress.json"
+    assert (tmp_path / "some_spider_name_progress.json.prev").is_file()
+
+    progress_file_path.write_text(progress_file_path.read_text()[:50])
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.is_loaded
+    assert loaded_state.current_pages["/plants"] == "http://some-recipe-site.com/page1"
+
+
+def test_previous_generation_without_newer_journal(tmp_path):
+    """Tests that the journal made on top of a corrupted progress file is not replayed over the previous one."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page1")
+    state.save()
+    state.site_structure = state.site_structure
+    state.save()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    state.save()
+    progress_file_path = tmp_path / "some_spider_name_progress.json"
+    progress_file_path.write_text(progress_file_path.read_text()[:50])
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True)
+    assert loaded_state.is_loaded
+    assert loaded_state.current_pages["/plants"] == "http://some-recipe-site.com/page1"
+
+
+def test_load_with_recursion_error(tmp_path):
+    """Tests that the previous progress file is used when loading the current one hits the recursion limit."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    state.site_structure = __create_test_structure()
+    state.save()
+    state.save()
+    with patch.object(SiteStructure, "from_dict", side_effect=[RecursionError(), __create_test_structure()]):
+        loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.is_loaded
+
+
+def test_load_with_checksum_mismatch(tmp_path):
+    """Tests that a progress file with wrong checksum is not used."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page1")
+    state.save()
+    progress_file_path = tmp_path / "some_spider_name_progress.json"
+    progress_file_path.write_text(progress_file_path.read_text().replace("page1", "page9"))
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert not loaded_state.is_loaded
+    assert loaded_state.site_structure is None
+
+
+def test_interrupted_save(tmp_path):
+    """Tests that an interrupted save leaves the last progress file intact."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    state.site_structure = __create_test_structure()
+    state.set_current_page("/plants", "http://some-recipe-site.com/page1")
+    state.save()
+
+    state.set_current_page("/plants", "http://some-recipe-site.com/page2")
+    with patch("scrapy_patterns.spiders.private.category_based_spider_state.os.fsync", side_effect=OSError()):
+        with pytest.raises(OSError):
+            state.save()
+    (tmp_path / "some_spider_name_progress.json.tmp").write_text('{"checksum": "abc", "sta')
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.is_loaded
+    assert loaded_state.current_pages["/plants"] == "http://some-recipe-site.com/page1"
+
+
+def test_async_writer(tmp_path):
+    """Tests that checkpoints written by the background writer can be loaded after closing."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True, use_async_writer=True)
+    state.site_structure = __create_test_structure()
+    for page in range(1, 11):
+        state.set_current_page("/plants", "http://some-recipe-site.com/page{}".format(page))
+        state.save()
+    state.site_structure.get_node_at_path("plants").set_visit_state(VisitState.VISITED)
+    state.save()
+    state.close()
+    assert state.checkpoint_writer_stats.num_of_saves == 11
+    assert state.checkpoint_writer_stats.num_of_writes + state.checkpoint_writer_stats.num_of_coalesced_saves == 11
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.current_pages["/plants"] == "http://some-recipe-site.com/page10"
+    assert loaded_state.site_structure.get_node_at_path("plants").visit_state == VisitState.VISITED
+    assert loaded_state.checkpoint_writer_stats is None
+
+
+def test_async_writer_is_journaled(tmp_path):
+    """Tests that the background writer gets only the changes after the first snapshot, even without journaled mode."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_async_writer=True)
+    state.site_structure = __create_test_structure()
+    with patch("scrapy_patterns.spiders.private.category_based_spider_state._copy_tree",
+               wraps=_copy_tree) as mock_copy_tree:
+        for page in range(1, 4):
+            state.set_current_page("/plants", "http://some-recipe-site.com/page{}".format(page))
+            state.save()
+        state.close()
+    mock_copy_tree.assert_called_once()
+    assert (tmp_path / "some_spider_name_progress.journal").exists()
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.current_pages == {"/plants": "http://some-recipe-site.com/page3"}
+
+
+def test_async_writer_failure(tmp_path):
+    """Tests that a snapshot is saved again after a checkpoint fails to be written."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True, use_async_writer=True)
+    state.site_structure = __create_test_structure()
+    with patch("scrapy_patterns.spiders.private.category_based_spider_state.os.fsync", side_effect=OSError()):
+        state.save()
+        __wait_for_writes(state, 1)
+    state.set_current_page("/plants", "http://some-recipe-site.com/page1")
+    state.save()
+    state.close()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    assert loaded_state.current_pages == {"/plants": "http://some-recipe-site.com/page1"}
+
+
+def test_deep_category_chain(tmp_path):
+    """Tests that a category chain deeper than the recursion limit is saved and loaded, also asynchronously."""
+    structure = SiteStructure("some-struct")
+    path = "level0"
+    structure.add_node_with_path(path, "level0_url")
+    for level in range(1, sys.getrecursionlimit()):
+        path += "/level{}".format(level)
+        structure.add_node_with_path(path, "level{}_url".format(level))
+    for use_async_writer in [False, True]:
+        state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_async_writer=use_async_writer)
+        state.site_structure = structure
+        state.set_current_page("/" + path, "http://some-recipe-site.com/page{}".format(int(use_async_writer)))
+        state.save()
+        state.close()
+
+        loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+        assert loaded_state.current_pages == {"/" + path: "http://some-recipe-site.com/page{}".format(
+            int(use_async_writer))}
+        assert loaded_state.site_structure.get_node_at_path(path).url == "level{}_url".format(
+            sys.getrecursionlimit() - 1)
+
+
+def test_log_summary_and_full(tmp_path, caplog):
+    """Tests that the whole structure is logged only when requested, or at the given interval."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), full_log_interval=3)
+    state.site_structure = __create_test_structure()
+    with caplog.at_level(logging.INFO):
+        state.log()
+        assert "categories = 3 NEW, 0 IN_PROGRESS, 0 VISITED" in caplog.text
+        assert "(root) some-struct" not in caplog.text
+        state.log(full=True)
+        assert "(root) some-struct" in caplog.text
+        caplog.clear()
+        state.log()
+        assert "(root) some-struct" in caplog.text
+
+
+def test_log_is_lazy(tmp_path, caplog):
+    """Tests that the structure is not rendered when the log record is not emitted."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path))
+    state.site_structure = __create_test_structure()
+    with caplog.at_level(logging.WARNING):
+        with patch.object(SiteStructure, "__str__") as str_mock:
+            state.log(full=True)
+            str_mock.assert_not_called()
+
+
+def test_journal_with_columnar_site_structure(tmp_path):
+    """Tests journaled saving, and loading with the columnar site structure."""
+    state = CategoryBasedSpiderState("some_spider_name", str(tmp_path), use_journal=True,
+                                     site_structure_class=ColumnarSiteStructure)
+    state.site_structure = ColumnarSiteStructure.from_dict(__create_test_structure().to_dict())
+    state.save()
+    state.site_structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED)
+    state.save()
+
+    loaded_state = CategoryBasedSpiderState("some_spider_name", str(tmp_path),
+                                            site_structure_class=ColumnarSiteStructure)
+    assert isinstance(loaded_state.site_structure, ColumnarSiteStructure)
+    assert loaded_state.site_structure.get_node_at_path("animals/fish").visit_state == VisitState.VISITED
+
+
+def __create_test_structure():
+    structure = SiteStructure("some-struct")
+    structure.add_node_with_path("animals", "animals_url")
+    structure.add_node_with_path("animals/fish", "fish_url")
+    structure.add_node_with_path("plants", "plants_url")
+    return structure
+
+
+def __wait_for_writes(state: CategoryBasedSpiderState, num_of_writes: int):
+    while state.checkpoint_writer_stats.num_of_writes < num_of_writes:
+        time.sleep(0.01)
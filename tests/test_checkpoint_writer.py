@@ -0,0 +1,64 @@
+"""Contains checkpoint writer tests."""
+import threading
+from unittest.mock import Mock
+import pytest
+from scrapy_patterns.spiders.private.checkpoint_writer import CheckpointWriter
+
+
+def test_write_snapshot_and_journal_entries():
+    """Tests that submitted checkpoints are written in order."""
+    written = []
+    writer = CheckpointWriter("some_spider_name", lambda state: written.append(("snapshot", state)),
+                              lambda entries: written.append(("journal", entries)))
+    writer.submit_snapshot({"some": "state"})
+    writer.flush()
+    writer.submit_journal_entries([{"some": "entry"}])
+    writer.close()
+    assert written == [("snapshot", {"some": "state"}), ("journal", [{"some": "entry"}])]
+    assert writer.stats.num_of_saves == 2
+    assert writer.stats.num_of_writes == 2
+
+
+def test_coalesce_while_writing():
+    """Tests that checkpoints submitted while a write is in progress are coalesced."""
+    write_started = threading.Event()
+    write_allowed = threading.Event()
+    written = []
+
+    def write_snapshot(json_state):
+        write_started.set()
+        write_allowed.wait()
+        written.append(("snapshot", json_state))
+
+    writer = CheckpointWriter("some_spider_name", write_snapshot, lambda entries: written.append(("journal", entries)))
+    writer.submit_snapshot({"generation": 1})
+    write_started.wait()
+    writer.submit_snapshot({"generation": 2})
+    writer.submit_journal_entries([{"entry": 1}])
+    writer.submit_snapshot({"generation": 3})
+    writer.submit_journal_entries([{"entry": 2}])
+    writer.submit_journal_entries([{"entry": 3}])
+    write_allowed.set()
+    writer.close()
+
+    assert written == [("snapshot", {"generation": 1}), ("snapshot", {"generation": 3}),
+                       ("journal", [{"entry": 2}, {"entry": 3}])]
+    assert writer.stats.num_of_saves == 6
+    assert writer.stats.num_of_coalesced_saves == 4
+    assert writer.stats.num_of_writes == 2
+
+
+def test_write_failure_and_submit_after_close():
+    """Tests that the writer survives a failed write, and rejects checkpoints after closing."""
+    append_to_journal = Mock()
+    writer = CheckpointWriter("some_spider_name", Mock(side_effect=OSError()), append_to_journal)
+    writer.submit_snapshot({"some": "state"})
+    writer.flush()
+    assert writer.pop_write_failure()
+    assert not writer.pop_write_failure()
+    writer.submit_journal_entries([{"some": "entry"}])
+    writer.close()
+    append_to_journal.assert_called_with([{"some": "entry"}])
+    assert not writer.pop_write_failure()
+    with pytest.raises(RuntimeError):
+        writer.submit_snapshot({"some": "state"})
@@ -0,0 +1,84 @@
+"""Columnar site structure tests"""
+import json
+import pytest
+
+from scrapy_patterns.columnar_site_structure import ColumnarSiteStructure
+from scrapy_patterns.site_structure import SiteStructure, VisitState
+
+
+def test_same_as_site_structure():
+    """Tests that the columnar structure has the same dict, and text representation as the linked one."""
+    structure = __create_test_structure(SiteStructure)
+    columnar_structure = __create_test_structure(ColumnarSiteStructure)
+    assert columnar_structure.to_dict() == structure.to_dict()
+    assert str(columnar_structure) == str(structure)
+    restored_structure = ColumnarSiteStructure.from_dict(structure.to_dict())
+    assert restored_structure.to_dict() == structure.to_dict()
+    assert SiteStructure.from_dict(restored_structure.to_dict()).to_dict() == structure.to_dict()
+    assert "".join(columnar_structure.iter_json()) == json.dumps(structure.to_dict(), sort_keys=True)
+
+
+def test_nodes():
+    """Tests navigating the nodes."""
+    structure = __create_test_structure(ColumnarSiteStructure)
+    node_salmon = structure.get_node_at_path("/animals/fish/salmon")
+    assert node_salmon.name == "salmon"
+    assert node_salmon.url == "salmon_url"
+    assert node_salmon.get_path() == "/animals/fish/salmon"
+    assert node_salmon.parent == structure.get_node_at_path("animals/fish")
+    assert node_salmon.parent.parent.parent == structure.root_node
+    assert structure.root_node.parent is None
+    assert [child.name for child in structure.get_node_at_path("animals").children] == ["fish", "insect"]
+    assert structure.get_node_at_path("animals").get_child("insect").url == "insect_url"
+    assert structure.get_node_at_path("animals/worm") is None
+    assert node_salmon.to_dict() == {"name": "salmon", "url": "salmon_url", "visit_state": "NEW", "children": []}
+
+
+def test_add_node_errors():
+    """Tests adding existing nodes, and nodes without parent."""
+    structure = __create_test_structure(ColumnarSiteStructure)
+    with pytest.raises(RuntimeError):
+        structure.add_node_with_path("animals/fish", "fish_url")
+    with pytest.raises(RuntimeError):
+        structure.add_node_with_path("/animals/worm/earthworm", "worm_url")
+
+
+def test_visit_states():
+    """Tests setting visit states, counting them, and finding leaves by them."""
+    structure = __create_test_structure(ColumnarSiteStructure)
+    changed_nodes = []
+    structure.add_visit_state_listener(changed_nodes.append)
+
+    visited_names = []
+    next_leaf = structure.find_leaf_with_visit_state(VisitState.NEW)
+    while next_leaf is not None:
+        visited_names.append(next_leaf.name)
+        next_leaf.set_visit_state(VisitState.IN_PROGRESS, propagate=True)
+        next_leaf.visit_state = VisitState.VISITED
+        next_leaf = structure.find_leaf_with_visit_state(VisitState.NEW)
+    assert visited_names == ["salmon", "insect", "carrot"]
+    assert structure.root_node.visit_state == VisitState.IN_PROGRESS
+    assert structure.get_visit_state_counts() == {VisitState.NEW: 0, VisitState.IN_PROGRESS: 3,
+                                                  VisitState.VISITED: 3}
+    assert structure.get_node_at_path("animals/fish") in changed_nodes
+
+    structure.get_node_at_path("animals/insect").visit_state = VisitState.NEW
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    assert structure.find_leaf_with_visit_state([VisitState.NEW, VisitState.VISITED]).name == "salmon"
+    structure.add_node_with_path("animals/fish/tuna", "tuna_url")
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "tuna"
+    with pytest.raises(TypeError):
+        structure.find_leaf_with_visit_state(None)
+    with pytest.raises(ValueError):
+        structure.find_leaf_with_visit_state([])
+
+
+def __create_test_structure(structure_cls):
+    structure = structure_cls("root_name")
+    structure.add_node_with_path("animals", "animals_url")
+    structure.add_node_with_path("animals/fish", "fish_url")
+    structure.add_node_with_path("animals/fish/salmon", "salmon_url")
+    structure.add_node_with_path("animals/insect", "insect_url")
+    structure.add_node_with_path("plants", "plant_url")
+    structure.add_node_with_path("plants/carrot", "carrot_url")
+    return structure
@@ -0,0 +1,47 @@
+"""Contains seen item index tests."""
+from unittest.mock import patch
+from scrapy_patterns.seen_item_index import SeenItemIndex
+
+
+def test_add_and_filter_seen(tmp_path):
+    """Tests that added URLs are seen, also after reopening the index."""
+    index = SeenItemIndex(str(tmp_path / "seen.db"), commit_interval=2)
+    index.add("http://item1.url")
+    index.add("http://item2.url")
+    index.add("http://item1.url")
+    assert index.filter_seen(["http://item3.url", "http://item2.url", "http://item1.url"]) == [
+        "http://item2.url", "http://item1.url"]
+    assert index.stats.num_of_hits == 2
+    assert index.stats.num_of_misses == 1
+    index.close()
+
+    reopened_index = SeenItemIndex(str(tmp_path / "seen.db"))
+    assert len(reopened_index) == 2
+    assert reopened_index.is_seen("http://item1.url")
+    assert not reopened_index.is_seen("http://item3.url")
+    reopened_index.close()
+
+
+def test_many_urls(tmp_path):
+    """Tests looking up more URLs than the lookup batch size."""
+    index = SeenItemIndex(str(tmp_path / "seen.db"))
+    urls = ["http://item{}.url".format(i) for i in range(1200)]
+    for url in urls[::2]:
+        index.add(url)
+    assert index.filter_seen(urls) == urls[::2]
+    index.close()
+
+
+@patch("scrapy_patterns.seen_item_index.time")
+def test_max_age(time_mock, tmp_path):
+    """Tests that URLs seen too long ago are treated as not seen, until they are added again."""
+    index = SeenItemIndex(str(tmp_path / "seen.db"), max_age_seconds=3600)
+    time_mock.time.return_value = 1000.0
+    index.add("http://item1.url")
+    time_mock.time.return_value = 4000.0
+    assert index.is_seen("http://item1.url")
+    time_mock.time.return_value = 5000.0
+    assert not index.is_seen("http://item1.url")
+    index.add("http://item1.url")
+    assert index.is_seen("http://item1.url")
+    index.close()
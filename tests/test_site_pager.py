@@ -1,8 +1,11 @@
 """Contains site pager tests"""
-from unittest.mock import Mock, ANY, call
+from unittest.mock import Mock, ANY, call, patch
 import pytest
+from scrapy import Request, signals
 from scrapy.exceptions import DontCloseSpider
-from scrapy_patterns.spiderlings.site_pager import SitePager, SitePageParsers
+from scrapy_patterns.spiderlings.site_pager import SitePager, SitePageParsers, PagingStopPolicy, ItemRetryPolicy
+from scrapy_patterns.seen_item_index import SeenItemIndex
+from scrapy_patterns.bloom_filter import BloomFilter
 
 
 def test_create():
@@ -65,7 +68,7 @@ def test_process_page_has_no_next():
 
 
 def test_request_item_failures_with_next_page():
-    """Tests item request failure."""
+    """Tests that a failed item finishes its page, and the next page is requested right away."""
 
     mock_request_factory = Mock()
     parser = __create_mock_site_page_parser()
@@ -76,12 +79,455 @@ def test_request_item_failures_with_next_page():
     __simulate_page_response_with_items(mock_request_factory, parser, True, 1, "http://some-next-page-url.com")
 
     failure_callback = mock_request_factory.create.call_args[1]["errback"]
-    failure_callback(Mock())
-    # Since the last item failed,spider_idle signal will be triggered.
-    spider_idle_callback = mock_spider.crawler.signals.connect.call_args[0][0]
-    with pytest.raises(DontCloseSpider):
+    next_requests = failure_callback(Mock())
+    mock_request_factory.create.assert_called_with("http://some-next-page-url.com", ANY)
+    assert next_requests == [mock_request_factory.create.return_value]
+    assert pager.retry_stats.num_of_permanent_failures == 1
+
+
+def test_item_failure_at_tail_of_last_page():
+    """Tests that paging is finished right away when the last item of the last page fails."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, max_prefetched_pages=1)
+    pager.start("http://page1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 2)
+
+    list(__find_callback(mock_request_factory, "http://item1.url")(Mock()))
+    next_requests = __find_errback(mock_request_factory, "http://item2.url")(Mock())
+    assert next_requests == [mock_callbacks.on_paging_finished.return_value]
+
+
+def test_item_failure_at_tail_of_numbered_page():
+    """Tests that the next numbered page is requested right away when the last item of a page fails."""
+    mock_request_factory = Mock()
+    parser = __create_mock_numbered_site_page_parser(2)
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks)
+    pager.start("http://page1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    assert __find_callback(mock_request_factory, "http://page2.url") is None
+
+    next_requests = __find_errback(mock_request_factory, "http://item1.url")(Mock())
+    mock_callbacks.on_numbered_page_finished.assert_called_once_with(1)
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+    assert next_requests == [mock_request_factory.create.return_value]
+
+
+def test_item_parse_failure():
+    """Tests that an item which can't be parsed is given up, and its page is finished."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks)
+    pager.start("http://page1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 1, "http://page2.url")
+
+    parser.item.parse.side_effect = ValueError("Some parse error")
+    next_requests = __simulate_items_response(mock_request_factory)
+    assert next_requests == [mock_request_factory.create.return_value]
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+    mock_callbacks.on_item_failed.assert_called_once_with("http://item1.url", False)
+    mock_callbacks.on_item_finished.assert_not_called()
+
+    # An item dropped by the parser is processed, but not returned.
+    parser.item.parse.side_effect = None
+    parser.item.parse.return_value = None
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    assert __simulate_items_response(mock_request_factory) == [mock_callbacks.on_paging_finished.return_value]
+    mock_callbacks.on_item_finished.assert_called_once_with("http://item1.url")
+
+
+def test_item_request_dropped_by_duplicate_filter():
+    """Tests that an item request dropped by the duplicate filter doesn't block its page."""
+    mock_request_factory = Mock()
+    mock_request_factory.create.side_effect = lambda url, callback, **kwargs: Request(url, callback=callback,
+                                                                                     errback=kwargs.get("errback"))
+    parser = __create_mock_site_page_parser()
+    mock_spider = Mock()
+    mock_callbacks = Mock()
+    pager = SitePager(mock_spider, mock_request_factory, parser, mock_callbacks)
+    pager.start("http://page1.url")
+    item_requests = __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://page2.url")
+
+    request_dropped_callback = __find_signal_handler(mock_spider, signals.request_dropped)
+    request_dropped_callback(Request("http://other.url"), mock_spider)
+    list(item_requests[0].callback(Mock()))
+    mock_callbacks.on_page_finished.assert_not_called()
+    request_dropped_callback(item_requests[1], mock_spider)
+    mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+    assert mock_spider.crawler.engine.crawl.call_args[0][0].url == "http://page2.url"
+
+
+def test_item_request_dropped_at_tail_of_page_with_listing_items():
+    """Tests that items released by an item request dropped at the tail of the last page are still emitted."""
+    mock_request_factory = Mock()
+    mock_request_factory.create.side_effect = lambda url, callback, **kwargs: Request(url, callback=callback,
+                                                                                     errback=kwargs.get("errback"))
+    parser = SitePageParsers(Mock(), None, Mock(), listing_items=Mock())
+    mock_spider = Mock()
+    mock_callbacks = Mock()
+    mock_callbacks.on_paging_finished.return_value = None
+    pager = SitePager(mock_spider, mock_request_factory, parser, mock_callbacks, max_item_requests_in_flight=1)
+    pager.start("http://page1.url")
+
+    process_page_callback = mock_request_factory.create.call_args[0][1]
+    parser.next_page_url.has_next.return_value = False
+    # The items follow a full batch of item URLs, so they are released only when the last item request is finished.
+    parser.listing_items.parse.return_value = ["http://item{}.url".format(i + 1) for i in range(100)] + [
+        {"name": "item101"}, {"name": "item102"}]
+    item_request = list(process_page_callback(Mock()))[0]
+    for i in range(99):
+        item_request = [output for output in item_request.callback(Mock()) if isinstance(output, Request)][0]
+    assert item_request.url == "http://item100.url"
+
+    __find_signal_handler(mock_spider, signals.request_dropped)(item_request, mock_spider)
+    mock_callbacks.on_paging_finished.assert_called_once()
+    # The items are passed to the item pipelines, without a request.
+    mock_spider.crawler.engine.crawl.assert_not_called()
+    assert mock_spider.crawler.engine.scraper.start_itemproc_async.call_args_list == [
+        call({"name": "item101"}, response=None), call({"name": "item102"}, response=None)]
+
+
+def test_spider_idle_after_paging_finished():
+    """Tests that spider idle is ignored when no retry is scheduled."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_spider = Mock()
+    mock_callbacks = Mock()
+    pager = SitePager(mock_spider, mock_request_factory, parser, mock_callbacks)
+    pager.start("http://some-starting-url.com")
+
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    __simulate_items_response(mock_request_factory)
+    mock_callbacks.on_paging_finished.assert_called_once()
+
+    spider_idle_callback = __find_signal_handler(mock_spider, signals.spider_idle)
+    spider_idle_callback(mock_spider)
+    mock_callbacks.on_paging_finished.assert_called_once()
+    mock_spider.crawler.engine.crawl.assert_not_called()
+
+
+def test_prefetch_next_page():
+    """Tests that the next page is requested before the items are processed, and pages are finished in order."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, max_prefetched_pages=1)
+    pager.start("http://page1.url")
+
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://page2.url")
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+    first_page_item_callbacks = [__find_callback(mock_request_factory, "http://item1.url"),
+                                 __find_callback(mock_request_factory, "http://item2.url")]
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 1, "http://page3.url")
+    assert __find_callback(mock_request_factory, "http://page3.url") is None
+
+    # The second page is finished first, but it's reported after the first one.
+    list(mock_request_factory.create.call_args[0][1](Mock()))
+    mock_callbacks.on_page_finished.assert_not_called()
+    list(first_page_item_callbacks[0](Mock()))
+    next_requests = list(first_page_item_callbacks[1](Mock()))
+    assert mock_callbacks.on_page_finished.call_args_list == [call("http://page2.url"), call("http://page3.url")]
+    assert next_requests[1] is mock_request_factory.create.return_value
+    mock_request_factory.create.assert_called_with("http://page3.url", ANY)
+
+
+def test_start_with_completed_items():
+    """Tests that the completed items of the start page are not requested again."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks)
+    pager.start("http://some-starting-url.com", {"http://item1.url", "http://item3.url"})
+
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 3, "http://some-next-page-url.com")
+    assert __find_callback(mock_request_factory, "http://item1.url") is None
+    __simulate_items_response(mock_request_factory)
+    mock_callbacks.on_item_finished.assert_called_once_with("http://item2.url")
+    mock_callbacks.on_page_finished.assert_called_once_with("http://some-next-page-url.com")
+
+    # Only the start page is affected.
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 3)
+    assert __find_callback(mock_request_factory, "http://item3.url") is not None
+
+
+def test_seen_item_index(tmp_path):
+    """Tests that items in the seen item index are not requested, and parsed items are added to it."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    seen_item_index = SeenItemIndex(str(tmp_path / "seen.db"))
+    seen_item_index.add("http://item1.url")
+    pager = SitePager(Mock(), mock_request_factory, parser, seen_item_index=seen_item_index)
+    pager.start("http://some-starting-url.com")
+
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://some-next-page-url.com")
+    assert __find_callback(mock_request_factory, "http://item1.url") is None
+    __simulate_items_response(mock_request_factory)
+    mock_request_factory.create.assert_called_with("http://some-next-page-url.com", ANY)
+    assert seen_item_index.is_seen("http://item2.url")
+    seen_item_index.close()
+
+
+def test_stop_policy(tmp_path):
+    """Tests that paging is stopped after the given number of pages with mostly seen items."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    seen_item_index = SeenItemIndex(str(tmp_path / "seen.db"))
+    seen_item_index.add("http://item1.url")
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, seen_item_index=seen_item_index,
+                      stop_policy=PagingStopPolicy(num_of_seen_pages=2, min_seen_ratio=0.5))
+    pager.start("http://page1.url")
+
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://page2.url")
+    __simulate_items_response(mock_request_factory)
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+    next_requests = __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://page3.url")
+    assert next_requests == [mock_callbacks.on_paging_finished.return_value]
+    assert __find_callback(mock_request_factory, "http://page3.url") is None
+    seen_item_index.close()
+
+    with pytest.raises(ValueError):
+        SitePager(Mock(), mock_request_factory, parser, stop_policy=PagingStopPolicy())
+
+
+def test_item_url_filter():
+    """Tests that items parsed by another pager are not requested, and the page still finishes."""
+    parser = __create_mock_site_page_parser()
+    item_url_filter = BloomFilter(100)
+    first_request_factory = Mock()
+    first_pager = SitePager(Mock(), first_request_factory, parser, item_url_filter=item_url_filter)
+    first_pager.start("http://some-category-url.com")
+    __simulate_page_response_with_items(first_request_factory, parser, False, 1)
+    __simulate_items_response(first_request_factory)
+    assert "http://item1.url" in item_url_filter
+
+    second_request_factory = Mock()
+    second_callbacks = Mock()
+    second_pager = SitePager(Mock(), second_request_factory, parser, second_callbacks, item_url_filter=item_url_filter)
+    second_pager.start("http://other-category-url.com")
+    next_requests = __simulate_page_response_with_items(second_request_factory, parser, False, 2)
+    assert __find_callback(second_request_factory, "http://item1.url") is None
+    assert len(next_requests) == 1
+    __simulate_items_response(second_request_factory)
+    second_callbacks.on_paging_finished.assert_called_once()
+
+
+def test_numbered_pages():
+    """Tests that numbered pages are requested without waiting for the previous ones, as far as allowed."""
+    mock_request_factory = Mock()
+    parser = __create_mock_numbered_site_page_parser(3)
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, max_prefetched_pages=1)
+    pager.start("http://page1.url")
+
+    next_requests = __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    assert len(next_requests) == 2
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+    first_page_item_callback = __find_callback(mock_request_factory, "http://item1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    assert __find_callback(mock_request_factory, "http://page3.url") is None
+
+    # Pages are finished in any order.
+    __simulate_items_response(mock_request_factory)
+    mock_callbacks.on_numbered_page_finished.assert_called_once_with(2)
+    mock_request_factory.create.assert_called_with("http://page3.url", ANY)
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 0)
+    mock_callbacks.on_paging_finished.assert_not_called()
+    assert list(first_page_item_callback(Mock()))[1] is mock_callbacks.on_paging_finished.return_value
+    assert mock_callbacks.on_numbered_page_finished.call_args_list == [call(2), call(3), call(1)]
+
+
+def test_numbered_pages_with_completed_pages():
+    """Tests that completed pages are not processed again, except for reading the number of pages."""
+    mock_request_factory = Mock()
+    parser = __create_mock_numbered_site_page_parser(3)
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, max_prefetched_pages=2)
+    pager.start("http://page1.url", completed_page_numbers={1, 2})
+
+    next_requests = __simulate_page_response_with_items(mock_request_factory, parser, False, 2)
+    assert next_requests == [mock_request_factory.create.return_value]
+    mock_request_factory.create.assert_called_with("http://page3.url", ANY)
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 1)
+    __simulate_items_response(mock_request_factory)
+    mock_callbacks.on_paging_finished.assert_called_once()
+
+
+def test_listing_items():
+    """Tests that items are parsed from the page, and only incomplete ones are requested."""
+    mock_request_factory = Mock()
+    parser = SitePageParsers(Mock(), None, Mock(), listing_items=Mock())
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks)
+    pager.start("http://page1.url")
+
+    process_page_callback = mock_request_factory.create.call_args[0][1]
+    parser.next_page_url.has_next.return_value = True
+    parser.next_page_url.parse.return_value = "http://page2.url"
+    parser.listing_items.parse.return_value = [{"name": "item1"}, "http://item2.url", {"name": "item3"}]
+    next_items_or_reqs = list(process_page_callback(Mock()))
+    assert next_items_or_reqs[:2] == [{"name": "item1"}, {"name": "item3"}]
+    mock_request_factory.create.assert_called_with("http://item2.url", ANY, errback=ANY)
+    __simulate_items_response(mock_request_factory)
+    mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+
+    # A page without incomplete items is finished right away.
+    process_page_callback = mock_request_factory.create.call_args[0][1]
+    parser.next_page_url.has_next.return_value = False
+    parser.listing_items.parse.return_value = [{"name": "item4"}]
+    assert list(process_page_callback(Mock())) == [{"name": "item4"}, mock_callbacks.on_paging_finished.return_value]
+
+
+def test_streaming_item_urls():
+    """Tests that item URLs from a generator are requested while the page is parsed, and the page still finishes."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks)
+    pager.start("http://page1.url")
+    num_of_parsed_urls = []
+
+    def parse_item_urls(_):
+        for i in range(150):
+            num_of_parsed_urls.append(i)
+            yield "http://item{}.url".format(i + 1)
+
+    process_page_callback = mock_request_factory.create.call_args[0][1]
+    parser.next_page_url.has_next.return_value = True
+    parser.next_page_url.parse.return_value = "http://page2.url"
+    parser.item_urls.parse.side_effect = parse_item_urls
+    page_output = process_page_callback(Mock())
+    next(page_output)
+    assert len(num_of_parsed_urls) < 150
+
+    # Items finished before the page is parsed don't finish the page.
+    for i in range(1, 101):
+        assert list(__find_callback(mock_request_factory, "http://item{}.url".format(i))(Mock()))[1] is None
+    assert len(list(page_output)) == 99 + 50
+    for i in range(101, 151):
+        list(__find_callback(mock_request_factory, "http://item{}.url".format(i))(Mock()))
+    mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+    mock_request_factory.create.assert_called_with("http://page2.url", ANY)
+
+
+def test_max_item_requests_in_flight():
+    """Tests that item requests are created only when earlier ones are finished, and the page still finishes."""
+    mock_request_factory = Mock()
+    mock_request_factory.create.side_effect = lambda url, *args, **kwargs: Request(url)
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks, max_item_requests_in_flight=2)
+    pager.start("http://page1.url")
+
+    next_requests = __simulate_page_response_with_items(mock_request_factory, parser, True, 5, "http://page2.url")
+    assert [request.url for request in next_requests] == ["http://item1.url", "http://item2.url"]
+    assert [request.url for request in __find_errback(mock_request_factory, "http://item1.url")(Mock())] == [
+        "http://item3.url"]
+    for i in range(2, 5):
+        next_requests = list(__find_callback(mock_request_factory, "http://item{}.url".format(i))(Mock()))
+        expected_urls = ["http://item{}.url".format(i + 2)] if i < 4 else []
+        assert [request.url for request in next_requests[1:-1]] == expected_urls
+    mock_callbacks.on_page_finished.assert_not_called()
+    next_requests = list(__find_callback(mock_request_factory, "http://item5.url")(Mock()))
+    mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+    assert next_requests[-1].url == "http://page2.url"
+
+
+def test_retry_failed_items_at_page_end():
+    """Tests that failed items are retried with backoff when the rest of the page is processed."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_spider = Mock()
+    mock_callbacks = Mock()
+    pager = SitePager(mock_spider, mock_request_factory, parser, mock_callbacks,
+                      retry_policy=ItemRetryPolicy(max_retries=2, backoff_seconds=1.0, backoff_factor=3.0))
+    pager.start("http://page1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 2, "http://page2.url")
+
+    with patch("twisted.internet.reactor.callLater") as mock_call_later:
+        assert __find_errback(mock_request_factory, "http://item1.url")(Mock()) == []
+        mock_call_later.assert_not_called()
+        list(__find_callback(mock_request_factory, "http://item2.url")(Mock()))
+        mock_call_later.assert_called_once_with(1.0, ANY, ANY, ANY)
+        mock_callbacks.on_item_failed.assert_called_once_with("http://item1.url", True, {}, 0)
+        spider_idle_callback = __find_signal_handler(mock_spider, signals.spider_idle)
+        with pytest.raises(DontCloseSpider):
+            spider_idle_callback(mock_spider)
+
+        # The retry fails again, and is retried with a longer delay.
+        __run_scheduled_retry(mock_call_later)
+        mock_spider.crawler.engine.crawl.assert_called_once_with(mock_request_factory.create.return_value)
+        mock_request_factory.create.assert_called_with("http://item1.url", ANY, errback=ANY, dont_filter=True)
+        assert mock_request_factory.create.call_args[1]["errback"](Mock()) == []
+        mock_call_later.assert_called_with(3.0, ANY, ANY, ANY)
+        mock_callbacks.on_item_failed.assert_called_with("http://item1.url", True, {}, 1)
+        mock_callbacks.on_page_finished.assert_not_called()
+
+        __run_scheduled_retry(mock_call_later)
         spider_idle_callback(mock_spider)
-        mock_spider.crawler.engine.crawl.assert_called()
+        next_requests = list(mock_request_factory.create.call_args[0][1](Mock()))
+    mock_callbacks.on_item_finished.assert_called_with("http://item1.url")
+    mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+    assert next_requests[-1] is mock_request_factory.create.return_value
+    assert pager.retry_stats.num_of_retries == 2
+    assert pager.retry_stats.num_of_permanent_failures == 0
+
+
+def test_retry_budget_per_category():
+    """Tests that failed items are given up when the retry budget of the category is used up."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks,
+                      retry_policy=ItemRetryPolicy(max_retries=2, max_retries_per_category=1))
+    pager.start("http://page1.url")
+    __simulate_page_response_with_items(mock_request_factory, parser, False, 2)
+
+    with patch("twisted.internet.reactor.callLater") as mock_call_later:
+        __find_errback(mock_request_factory, "http://item1.url")(Mock())
+        next_requests = __find_errback(mock_request_factory, "http://item2.url")(Mock())
+        mock_call_later.assert_called_once()
+        assert mock_callbacks.on_item_failed.call_args_list == [call("http://item1.url", True, {}, 0),
+                                                                call("http://item2.url", False)]
+        mock_callbacks.on_paging_finished.assert_not_called()
+        __run_scheduled_retry(mock_call_later)
+        next_requests = mock_request_factory.create.call_args[1]["errback"](Mock())
+    assert next_requests == [mock_callbacks.on_paging_finished.return_value]
+    assert pager.retry_stats.num_of_retries == 1
+    assert pager.retry_stats.num_of_permanent_failures == 2
+
+
+def test_retry_failed_items_at_category_end():
+    """Tests that pages don't wait for failed items, which are retried after the last page."""
+    mock_request_factory = Mock()
+    parser = __create_mock_site_page_parser()
+    mock_callbacks = Mock()
+    pager = SitePager(Mock(), mock_request_factory, parser, mock_callbacks,
+                      retry_policy=ItemRetryPolicy(retry_at_category_end=True))
+    pager.start("http://page1.url", failed_items={"http://item5.url": ({"meta": {"some": "meta"}}, 1)})
+    __simulate_page_response_with_items(mock_request_factory, parser, True, 1, "http://page2.url")
+
+    with patch("twisted.internet.reactor.callLater") as mock_call_later:
+        __find_errback(mock_request_factory, "http://item1.url")(Mock())
+        mock_callbacks.on_page_finished.assert_called_once_with("http://page2.url")
+        mock_callbacks.on_item_failed.assert_called_once_with("http://item1.url", True, {}, 0)
+        __simulate_page_response_with_items(mock_request_factory, parser, False, 0)
+        assert mock_call_later.call_count == 2
+        # The item failed before a restart keeps its number of retries, and its request keyword arguments.
+        assert mock_call_later.call_args_list[0][0][0] == 2.0
+        mock_callbacks.on_paging_finished.assert_not_called()
+        __run_scheduled_retry(mock_call_later, 0)
+        mock_request_factory.create.assert_called_with("http://item5.url", ANY, errback=ANY, meta={"some": "meta"},
+                                                       dont_filter=True)
+        __run_scheduled_retry(mock_call_later, 1)
+    list(__find_callback(mock_request_factory, "http://item5.url")(Mock()))
+    mock_callbacks.on_paging_finished.assert_not_called()
+    next_requests = list(mock_request_factory.create.call_args[0][1](Mock()))
+    assert next_requests[-1] is mock_callbacks.on_paging_finished.return_value
+    mock_callbacks.on_numbered_page_finished.assert_not_called()
 
 
 def test_page_and_items_with_request_kwargs():
@@ -115,6 +561,13 @@ def __create_mock_site_page_parser():
     return parser
 
 
+def __create_mock_numbered_site_page_parser(page_count: int):
+    parser = SitePageParsers(Mock(), Mock(), Mock(), Mock())
+    parser.page_count.parse.return_value = page_count
+    parser.page_count.build_url.side_effect = lambda _, page_number: "http://page{}.url".format(page_number)
+    return parser
+
+
 def __simulate_page_response_with_items(mock_req_factory: Mock, mock_site_parser: SitePageParsers,
                                         has_next_page: bool, num_of_items=1, next_page_url: str = None):
     process_page_callback = mock_req_factory.create.call_args[0][1]
@@ -129,3 +582,29 @@ def __simulate_items_response(mock_req_factory: Mock):
     process_item_callback = mock_req_factory.create.call_args[0][1]
     mock_item_response = Mock()
     return list(process_item_callback(mock_item_response))  # Next item, and next page
+
+
+def __run_scheduled_retry(mock_call_later: Mock, call_index: int = -1):
+    _, scheduled_function, *args = mock_call_later.call_args_list[call_index][0]
+    scheduled_function(*args)
+
+
+def __find_signal_handler(mock_spider: Mock, signal):
+    for connect_call in mock_spider.crawler.signals.connect.call_args_list:
+        if connect_call[1]["signal"] is signal:
+            return connect_call[0][0]
+    return None
+
+
+def __find_callback(mock_req_factory: Mock, url: str):
+    for create_call in mock_req_factory.create.call_args_list:
+        if create_call[0][0] == url:
+            return create_call[0][1]
+    return None
+
+
+def __find_errback(mock_req_factory: Mock, url: str):
+    for create_call in mock_req_factory.create.call_args_list:
+        if create_call[0][0] == url:
+            return create_call[1]["errback"]
+    return None
@@ -1,7 +1,9 @@
 """Site structure tests"""
+import json
+from unittest.mock import patch
 import pytest
 
-from scrapy_patterns.site_structure import SiteStructure, VisitState
+from scrapy_patterns.site_structure import SiteStructure, VisitState, Node, load_deep_json
 
 
 def test_create_site_structure():
@@ -145,6 +147,162 @@ def test_add_duplicate():
         structure.add_node_with_path("animals", "animals_url")
 
 
+def test_get_node_at_path_after_from_dict():
+    """Tests that paths of a restored structure can be looked up, and extended."""
+    structure = SiteStructure.from_dict(__create_test_structure().to_dict())
+    node_salmon = structure.get_node_at_path("/animals/fish/salmon")
+    assert node_salmon is not None
+    assert node_salmon.get_path() == "/animals/fish/salmon"
+    assert structure.get_node_at_path("animals/fish/tuna") is None
+    node_tuna = structure.add_node_with_path("animals/fish/tuna", "tuna_url")
+    assert node_tuna.parent is node_salmon.parent
+    with pytest.raises(RuntimeError):
+        structure.add_node_with_path("plants/carrot", "carrot_url")
+
+
+def test_get_child():
+    """Tests getting a direct child of a node by its name."""
+    structure = __create_test_structure()
+    node_animals = structure.get_node_at_path("animals")
+    assert node_animals.get_child("fish") is structure.get_node_at_path("animals/fish")
+    assert node_animals.get_child("salmon") is None
+
+
+def test_find_leaf_follows_visit_state_changes():
+    """Tests that finding leaves repeatedly follows the DFS order as visit states change."""
+    structure = __create_test_structure()
+    visited_names = []
+    next_leaf = structure.find_leaf_with_visit_state(VisitState.NEW)
+    while next_leaf is not None:
+        visited_names.append(next_leaf.name)
+        next_leaf.set_visit_state(VisitState.VISITED)
+        next_leaf = structure.find_leaf_with_visit_state(VisitState.NEW)
+    assert visited_names == ["salmon", "insect", "carrot"]
+
+    structure.get_node_at_path("animals/insect").visit_state = VisitState.NEW
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    structure.get_node_at_path("animals/fish/salmon").set_visit_state(VisitState.NEW)
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "salmon"
+
+
+def test_find_leaf_after_structure_changes():
+    """Tests finding leaves after adding nodes, and after restoring the structure from a dict."""
+    structure = __create_test_structure()
+    structure.get_node_at_path("animals/fish/salmon").set_visit_state(VisitState.VISITED)
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    structure.add_node_with_path("animals/fish/tuna", "tuna_url")
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "tuna"
+
+    restored_structure = SiteStructure.from_dict(structure.to_dict())
+    assert restored_structure.find_leaf_with_visit_state(VisitState.NEW).name == "tuna"
+    restored_structure.get_node_at_path("animals/fish/tuna").set_visit_state(VisitState.IN_PROGRESS)
+    assert restored_structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    searched_node = restored_structure.find_leaf_with_visit_state([VisitState.IN_PROGRESS, VisitState.VISITED])
+    assert searched_node.name == "salmon"
+
+
+def test_leaves_are_compact():
+    """Tests that leaves don't have children containers of their own, and that nodes don't have a __dict__."""
+    structure = SiteStructure.from_dict(__create_test_structure().to_dict())
+    node_salmon = structure.get_node_at_path("animals/fish/salmon")
+    node_carrot = structure.get_node_at_path("plants/carrot")
+    assert len(node_salmon.children) == 0
+    assert node_salmon.children is node_carrot.children
+    assert node_salmon.get_child("anything") is None
+    assert not hasattr(node_salmon, "__dict__")
+
+
+def test_children_are_read_only():
+    """Tests that children can only be added through add_child(), so they can be found by their name."""
+    structure = __create_test_structure()
+    node_fish = structure.get_node_at_path("animals/fish")
+    for node in [node_fish, structure.get_node_at_path("animals/fish/salmon")]:
+        with pytest.raises(AttributeError):
+            node.children.append(Node("tuna", "tuna_url"))
+        with pytest.raises(TypeError):
+            node.children[0] = Node("tuna", "tuna_url")
+        with pytest.raises(AttributeError):
+            node.children = []
+    node_fish.add_child(Node("tuna", "tuna_url"))
+    assert [child.name for child in node_fish.children] == ["salmon", "tuna"]
+    assert [child.name for child in reversed(node_fish.children)] == ["tuna", "salmon"]
+    assert node_fish.children[-1] is structure.get_node_at_path("animals/fish/tuna")
+
+
+def test_get_visit_state_counts():
+    """Tests counting nodes per visit state."""
+    structure = __create_test_structure()
+    assert structure.get_visit_state_counts() == {VisitState.NEW: 6, VisitState.IN_PROGRESS: 0, VisitState.VISITED: 0}
+    structure.get_node_at_path("animals/fish/salmon").set_visit_state(VisitState.IN_PROGRESS, True)
+    structure.get_node_at_path("plants/carrot").set_visit_state(VisitState.VISITED)
+    expected_counts = {VisitState.NEW: 2, VisitState.IN_PROGRESS: 3, VisitState.VISITED: 1}
+    assert structure.get_visit_state_counts() == expected_counts
+    assert SiteStructure.from_dict(structure.to_dict()).get_visit_state_counts() == expected_counts
+
+
+def test_add_child_to_structure():
+    """Tests that children added to the nodes of a structure are found as leaves, and counted."""
+    structure = __create_test_structure()
+    structure.get_node_at_path("animals/fish/salmon").set_visit_state(VisitState.VISITED)
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    node_shark = Node("shark", "shark_url")
+    node_shark.add_child(Node("hammerhead", "hammerhead_url"))
+    structure.get_node_at_path("animals/fish").add_child(node_shark)
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).get_path() == "/animals/fish/shark/hammerhead"
+    assert structure.get_visit_state_counts() == {VisitState.NEW: 7, VisitState.IN_PROGRESS: 0, VisitState.VISITED: 1}
+    structure.get_node_at_path("animals/fish/shark/hammerhead").set_visit_state(VisitState.VISITED)
+    assert structure.find_leaf_with_visit_state(VisitState.NEW).name == "insect"
+    assert structure.get_visit_state_counts() == {VisitState.NEW: 6, VisitState.IN_PROGRESS: 0, VisitState.VISITED: 2}
+
+
+def test_deep_structure():
+    """Tests that structures deeper than the recursion limit can be converted, and traversed."""
+    structure = SiteStructure("root_name")
+    node = structure.root_node
+    for depth in range(5000):
+        child = Node("level{}".format(depth), "url{}".format(depth))
+        node.add_child(child)
+        node = child
+    deepest_node = node
+    assert deepest_node.get_path().endswith("/level4998/level4999")
+    restored_structure = SiteStructure.from_dict(structure.to_dict())
+    restored_leaf = restored_structure.find_leaf_with_visit_state(VisitState.NEW)
+    assert restored_leaf.get_path() == deepest_node.get_path()
+    restored_leaf.set_visit_state(VisitState.VISITED, propagate=True)
+    assert restored_structure.root_node.visit_state == VisitState.VISITED
+    assert len(str(restored_structure).splitlines()) == 5001
+    assert "".join(restored_structure.iter_json()).count('"children"') == 5001
+    reloaded_structure = SiteStructure.from_dict(load_deep_json("".join(restored_structure.iter_json())))
+    assert reloaded_structure.get_node_at_path(deepest_node.get_path()).url == "url4999"
+
+
+def test_load_deep_json():
+    """Tests that JSON is parsed the same way as by json.loads(), even when it's nested deeper than the limit."""
+    json_str = '{"a": [1, -2.5, 3e2, true, false, null, "x\\u00e9\\n\\""], "b": {"c": {}}, "d": [[], {"e": ""}]}'
+    expected_value = json.loads(json_str)
+    assert load_deep_json(json_str) == expected_value
+    with patch("scrapy_patterns.site_structure.json.loads", side_effect=RecursionError()):
+        assert load_deep_json(" " + json_str + "\n") == expected_value
+        for invalid_json_str in ["{", "[1,]", '{"a" 1}', "[1 2]", '{"a": 1,}', "[]x", "nul"]:
+            with pytest.raises(ValueError):
+                load_deep_json(invalid_json_str)
+    value = load_deep_json("[" * 5000 + "]" * 5000)
+    depth = 1
+    while value:
+        value = value[0]
+        depth += 1
+    assert depth == 5000
+
+
+def test_iter_json():
+    """Tests that the JSON chunks of the structure are the same as the JSON of its dict."""
+    structure = __create_test_structure()
+    structure.add_node_with_path("plants/\"quoted\" ünicode", "http://some-plants.com/?a=1&b=\\")
+    structure.get_node_at_path("animals/insect").set_visit_state(VisitState.IN_PROGRESS)
+    assert "".join(structure.iter_json()) == json.dumps(structure.to_dict(), sort_keys=True)
+    assert json.loads("".join(structure.iter_json())) == structure.to_dict()
+
+
 def __create_test_structure():
     structure = SiteStructure("root_name")
     structure.add_node_with_path("animals", "animals_url")
@@ -0,0 +1,54 @@
+"""Contains site structure cache tests."""
+from unittest.mock import patch
+from scrapy_patterns.site_structure import SiteStructure, VisitState
+from scrapy_patterns.columnar_site_structure import ColumnarSiteStructure
+from scrapy_patterns.site_structure_cache import SiteStructureCache
+
+
+def test_save_and_load(tmp_path):
+    """Tests that the structure is restored with every category being NEW."""
+    structure = __create_test_structure()
+    structure.get_node_at_path("animals/fish").set_visit_state(VisitState.VISITED, propagate=True)
+    cache = SiteStructureCache(str(tmp_path / "structure.json"))
+    assert cache.load() is None
+    cache.save(structure)
+
+    loaded_structure = cache.load()
+    assert loaded_structure.get_node_at_path("animals/fish").url == "fish_url"
+    assert loaded_structure.get_visit_state_counts()[VisitState.NEW] == 4
+    assert loaded_structure.root_node.visit_state == VisitState.NEW
+    columnar_structure = SiteStructureCache(str(tmp_path / "structure.json"), ColumnarSiteStructure).load()
+    assert columnar_structure.to_dict() == loaded_structure.to_dict()
+
+
+@patch("scrapy_patterns.site_structure_cache.time")
+def test_expiry(time_mock, tmp_path):
+    """Tests that a structure saved longer ago than the maximum age is not loaded."""
+    cache = SiteStructureCache(str(tmp_path / "structure.json"))
+    time_mock.time.return_value = 1000.0
+    cache.save(__create_test_structure())
+    time_mock.time.return_value = 1060.0
+    assert cache.load(max_age_seconds=60) is not None
+    time_mock.time.return_value = 1061.0
+    assert cache.load(max_age_seconds=60) is None
+    assert cache.load() is not None
+    structure, age_seconds = cache.load_with_age()
+    assert structure.get_node_at_path("animals/fish") is not None
+    assert age_seconds == 61.0
+
+
+def test_invalid_file(tmp_path):
+    """Tests that an invalid cache file is ignored."""
+    (tmp_path / "structure.json").write_text('{"saved_at": "yesterday", "site_structure": {}}')
+    assert SiteStructureCache(str(tmp_path / "structure.json")).load() is None
+    (tmp_path / "structure.json").write_text('{"saved_at": 1000.0, "site_str')
+    assert SiteStructureCache(str(tmp_path / "structure.json")).load() is None
+
+
+def __create_test_structure():
+    structure = SiteStructure("some-recipes")
+    structure.add_node_with_path("animals", "animals_url")
+    structure.add_node_with_path("animals/fish", "fish_url")
+    structure.add_node_with_path("animals/birds", "birds_url")
+    structure.add_node_with_path("plants", "plants_url")
+    return structure
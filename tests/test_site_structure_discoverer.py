@@ -1,6 +1,8 @@
 """Contains site structure discoverer tests"""
+import logging
 from typing import List, Tuple
-from unittest.mock import Mock, call, ANY
+from unittest.mock import Mock, call, ANY, patch
+from scrapy_patterns.site_structure import SiteStructure
 from scrapy_patterns.spiderlings.site_structure_discoverer import SiteStructureDiscoverer, CategoryParser
 
 
@@ -15,7 +17,7 @@ def test_responses_without_complete_cb():
                                          mock_request_factory)
     discoverer.create_start_request()
 
-    calls = [call.create("http://some-recipe.com", ANY, cb_kwargs=ANY)]
+    calls = [call.create("http://some-recipe.com", ANY, cb_kwargs=ANY, errback=ANY)]
     mock_request_factory.assert_has_calls(calls)
     assert discoverer.name == "some_spider_name"
 
@@ -41,8 +43,8 @@ def test_responses_with_complete_callback():
     # Main categories
     __simulate_category_response(mock_request_factory, 0)
     calls = [
-        call.create("http://some-recipe.com/main1", ANY, cb_kwargs=ANY),
-        call.create("http://some-recipe.com/main2", ANY, cb_kwargs=ANY)
+        call.create("http://some-recipe.com/main1", ANY, cb_kwargs=ANY, errback=ANY),
+        call.create("http://some-recipe.com/main2", ANY, cb_kwargs=ANY, errback=ANY)
     ]
     mock_request_factory.assert_has_calls(calls)
     assert discoverer.structure.get_node_at_path("MainOne") is not None
@@ -58,6 +60,101 @@ def test_responses_with_complete_callback():
     assert discoverer.structure.get_node_at_path("MainTwo/SubTwo") is not None
 
 
+def test_max_concurrent_requests():
+    """Tests that at most the given number of category requests are in progress, and failures are counted."""
+    mock_request_factory = Mock()
+    mock_request_factory.create.side_effect = lambda url, *args, **kwargs: url
+    mock_on_discovery_complete_callback = Mock(return_value=None)
+    discoverer = SiteStructureDiscoverer(Mock(), "http://some-recipe.com",
+                                         [_MockCategoryParserMain(), _MockCategoryParserSub()], mock_request_factory,
+                                         mock_on_discovery_complete_callback, max_concurrent_requests=1)
+    discoverer.create_start_request()
+
+    assert __simulate_category_response(mock_request_factory, 0, index=0) == ["http://some-recipe.com/main1"]
+    failure_callback = mock_request_factory.create.call_args[1]["errback"]
+    assert failure_callback(Mock()) == ["http://some-recipe.com/main2"]
+    assert not discoverer.is_complete
+    assert __simulate_category_response(mock_request_factory, 1, "MainTwo", index=2) == []
+    assert discoverer.is_complete
+    mock_on_discovery_complete_callback.assert_called_once_with(discoverer)
+    assert not discoverer.structure.get_node_at_path("MainOne").children
+
+
+def test_max_depth_and_categories():
+    """Tests that discovery is limited by the number of levels, and the number of categories."""
+    mock_request_factory = Mock()
+    mock_on_discovery_complete_callback = Mock()
+    discoverer = SiteStructureDiscoverer(Mock(), "http://some-recipe.com",
+                                         [_MockCategoryParserMain(), _MockCategoryParserSub()], mock_request_factory,
+                                         mock_on_discovery_complete_callback, max_depth=1, max_categories=1)
+    discoverer.create_start_request()
+
+    __simulate_category_response(mock_request_factory, 0)
+    assert mock_request_factory.create.call_count == 1
+    mock_on_discovery_complete_callback.assert_called_once()
+    assert [child.name for child in discoverer.structure.root_node.children] == ["MainOne"]
+
+
+def test_leaves_are_streamed():
+    """Tests that leaf categories are reported as soon as they are discovered."""
+    mock_request_factory = Mock()
+    mock_on_leaf_discovered = Mock(side_effect=lambda _, leaf: leaf.get_path())
+    discoverer = SiteStructureDiscoverer(Mock(), "http://some-recipe.com",
+                                         [_MockCategoryParserMain(), _MockCategoryParserSub()], mock_request_factory,
+                                         on_leaf_discovered=mock_on_leaf_discovered)
+    discoverer.create_start_request()
+    __simulate_category_response(mock_request_factory, 0)
+    mock_on_leaf_discovered.assert_not_called()
+
+    next_requests = __simulate_category_response(mock_request_factory, 1, "MainOne", index=1)
+    assert next_requests == ["/MainOne/SubOne", "/MainOne/SubTwo"]
+    # A category without sub-categories is a leaf too.
+    with patch.object(_MockCategoryParserSub, "parse", return_value=[]):
+        assert __simulate_category_response(mock_request_factory, 1, "MainTwo", index=2) == ["/MainTwo"]
+
+
+def test_refresh_with_known_structure():
+    """Tests that only the upper levels are discovered, and the rest is taken from the known structure."""
+    known_structure = SiteStructure("some-recipes")
+    known_structure.add_node_with_path("MainOne", "http://some-recipe.com/main1")
+    known_structure.add_node_with_path("MainOne/SubThree", "http://some-recipe.com/sub3")
+    known_structure.add_node_with_path("MainOne/SubThree/Deep", "http://some-recipe.com/deep")
+    known_structure.add_node_with_path("MainRemoved", "http://some-recipe.com/removed")
+    known_structure.add_node_with_path("MainRemoved/SubOne", "http://some-recipe.com/sub1")
+    mock_request_factory = Mock()
+    mock_on_discovery_complete_callback = Mock()
+    discoverer = SiteStructureDiscoverer(Mock(), "http://some-recipe.com",
+                                         [_MockCategoryParserMain(), _MockCategoryParserSub()], mock_request_factory,
+                                         mock_on_discovery_complete_callback, known_structure=known_structure)
+    discoverer.create_start_request()
+
+    __simulate_category_response(mock_request_factory, 0)
+    assert mock_request_factory.create.call_count == 2
+    mock_request_factory.create.assert_called_with("http://some-recipe.com/main2", ANY, cb_kwargs=ANY, errback=ANY)
+    mock_on_discovery_complete_callback.assert_not_called()
+    __simulate_category_response(mock_request_factory, 1, "MainTwo")
+    mock_on_discovery_complete_callback.assert_called_once()
+    assert discoverer.structure.get_node_at_path("MainOne/SubThree/Deep").url == "http://some-recipe.com/deep"
+    assert discoverer.structure.get_node_at_path("MainTwo/SubOne") is not None
+    assert discoverer.structure.get_node_at_path("MainRemoved") is None
+
+
+def test_log_on_discovery_complete(caplog):
+    """Tests that only the number of categories is logged when discovery is complete, unless asked otherwise."""
+    for log_structure in [False, True]:
+        mock_request_factory = Mock()
+        discoverer = SiteStructureDiscoverer(Mock(), "http://some-recipe.com", [_MockCategoryParserMain()],
+                                             mock_request_factory, log_structure=log_structure)
+        discoverer.create_start_request()
+        caplog.clear()
+        with caplog.at_level(logging.DEBUG):
+            with patch.object(SiteStructure, "__str__", return_value="some-structure-text") as str_mock:
+                __simulate_category_response(mock_request_factory, 0)
+        assert "Categories: 2 NEW, 0 IN_PROGRESS, 0 VISITED" in caplog.text
+        assert ("some-structure-text" in caplog.text) == log_structure
+        assert str_mock.called == log_structure
+
+
 class _MockCategoryParserMain(CategoryParser):
     def parse(self, response) -> List[Tuple[str, str]]:
         return [("http://some-recipe.com/main1", "MainOne"), ("http://some-recipe.com/main2", "MainTwo")]
@@ -69,7 +166,7 @@ class _MockCategoryParserSub(CategoryParser):
                 ("http://some-recipe.com/sub2", "SubTwo")]
 
 
-def __simulate_category_response(mock_req_factory: Mock, category_index: int, path: str = None):
-    process_category_response_callback = mock_req_factory.create.call_args[0][1]
+def __simulate_category_response(mock_req_factory: Mock, category_index: int, path: str = None, index: int = -1):
+    process_category_response_callback = mock_req_factory.create.call_args_list[index][0][1]
     mock_category_response = Mock()
     return list(process_category_response_callback(mock_category_response, category_index, path))
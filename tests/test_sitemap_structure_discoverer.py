@@ -0,0 +1,79 @@
+"""Contains sitemap structure discoverer tests"""
+import gzip
+from unittest.mock import Mock, call, ANY
+from scrapy_patterns.spiderlings.sitemap_structure_discoverer import SitemapStructureDiscoverer, \
+    UrlPathCategoryParser
+
+SITEMAP_INDEX = b"""<?xml version="1.0" encoding="UTF-8"?>
+<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <sitemap><loc>http://some-recipe.com/sitemap-categories.xml.gz</loc></sitemap>
+  <sitemap><loc>http://some-recipe.com/sitemap-recipes.xml</loc></sitemap>
+</sitemapindex>"""
+
+CATEGORY_SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://some-recipe.com/categories/main1</loc><lastmod>2020-01-01</lastmod></url>
+  <url><loc>http://some-recipe.com/categories/main1/sub1</loc></url>
+  <url><loc>http://some-recipe.com/categories/main2/sub2/</loc></url>
+  <url><loc>http://some-recipe.com/about</loc></url>
+</urlset>"""
+
+RECIPE_SITEMAP = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>http://some-recipe.com/recipes/soup</loc></url>
+  <url><loc>http://some-recipe.com/categories/main1/sub1?page=2</loc></url>
+</urlset>"""
+
+
+def test_sitemap_index_and_gzip():
+    """Tests following a sitemap index, and parsing gzipped sitemaps."""
+    mock_request_factory = Mock()
+    mock_on_discovery_complete_callback = Mock(return_value=["next_request"])
+    discoverer = SitemapStructureDiscoverer(Mock(), ["http://some-recipe.com/sitemap.xml"],
+                                            UrlPathCategoryParser("http://some-recipe.com/categories"),
+                                            mock_request_factory, mock_on_discovery_complete_callback)
+    assert len(discoverer.create_start_requests()) == 1
+
+    __simulate_sitemap_response(mock_request_factory, SITEMAP_INDEX, index=0)
+    mock_request_factory.assert_has_calls([
+        call.create("http://some-recipe.com/sitemap-categories.xml.gz", ANY, errback=ANY),
+        call.create("http://some-recipe.com/sitemap-recipes.xml", ANY, errback=ANY)
+    ])
+    assert __simulate_sitemap_response(mock_request_factory, gzip.compress(CATEGORY_SITEMAP), index=1) == []
+    assert not discoverer.is_complete
+    assert __simulate_sitemap_response(mock_request_factory, RECIPE_SITEMAP, index=2) == ["next_request"]
+    assert discoverer.is_complete
+    mock_on_discovery_complete_callback.assert_called_once_with(discoverer)
+    assert [child.name for child in discoverer.structure.root_node.children] == ["main1", "main2"]
+    assert discoverer.structure.get_node_at_path("main1/sub1").url == "http://some-recipe.com/categories/main1/sub1"
+    assert discoverer.structure.get_node_at_path("main2").url == "http://some-recipe.com/categories/main2"
+    assert discoverer.structure.get_node_at_path("main2/sub2") is not None
+
+
+def test_failures_and_category_limit():
+    """Tests that failed and invalid sitemaps are counted, and discovery is limited by the number of categories."""
+    mock_request_factory = Mock()
+    mock_on_discovery_complete_callback = Mock(return_value=None)
+    discoverer = SitemapStructureDiscoverer(Mock(), ["http://some-recipe.com/sitemap1.xml",
+                                                     "http://some-recipe.com/sitemap2.xml",
+                                                     "http://some-recipe.com/sitemap3.xml"],
+                                            UrlPathCategoryParser("http://some-recipe.com/categories/"),
+                                            mock_request_factory, mock_on_discovery_complete_callback,
+                                            max_categories=2)
+    discoverer.create_start_requests()
+
+    assert __simulate_sitemap_response(mock_request_factory, CATEGORY_SITEMAP[:-20], index=0) == []
+    failure_callback = mock_request_factory.create.call_args[1]["errback"]
+    assert failure_callback(Mock()) == []
+    mock_on_discovery_complete_callback.assert_not_called()
+    __simulate_sitemap_response(mock_request_factory, CATEGORY_SITEMAP, index=2)
+    mock_on_discovery_complete_callback.assert_called_once_with(discoverer)
+    assert [child.name for child in discoverer.structure.root_node.children] == ["main1"]
+    assert discoverer.structure.get_node_at_path("main1/sub1") is not None
+
+
+def __simulate_sitemap_response(mock_req_factory: Mock, body: bytes, index: int = -1):
+    process_sitemap_response_callback = mock_req_factory.create.call_args_list[index][0][1]
+    mock_sitemap_response = Mock()
+    mock_sitemap_response.body = body
+    return list(process_sitemap_response_callback(mock_sitemap_response))